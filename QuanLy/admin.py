@@ -5,7 +5,8 @@ from .models import (
     ExportReceipt, ExportItem,
     ReturnReceipt, ReturnItem,
     PurchaseOrder, PurchaseOrderItem,
-    ASN, ASNItem, Report
+    ASN, ASNItem, Report, StockStatusRefresh, DocumentSequence,
+    StockMovement, StockCheckpoint, DailySummary,
 )
 
 
@@ -35,6 +36,40 @@ class StockItemAdmin(admin.ModelAdmin):
     ordering = ("-import_receipt__import_date",)
     readonly_fields = ("status",)
     date_hierarchy = "expiry_date"
+    # __str__ của SP đọc NCC
+    list_select_related = ("import_receipt", "product__supplier")
+
+
+@admin.register(StockStatusRefresh)
+class StockStatusRefreshAdmin(admin.ModelAdmin):
+    list_display = ("run_date", "expired_count", "nearly_expired_count", "valid_count", "created_at")
+    date_hierarchy = "run_date"
+
+
+# ===================== SỔ KHO =====================
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    # Sổ chỉ ghi thêm từ phiếu nhập / xuất / hoàn – admin chỉ xem
+    list_display = ("movement_date", "movement_type", "stock_item_id", "product", "quantity", "reference")
+    list_filter = ("movement_type", "movement_date")
+    search_fields = ("reference", "product__product_code", "product__name")
+    date_hierarchy = "movement_date"
+    list_select_related = ("product__supplier",)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(StockCheckpoint)
+class StockCheckpointAdmin(admin.ModelAdmin):
+    list_display = ("checkpoint_date", "movement_count", "created_at")
+    date_hierarchy = "checkpoint_date"
 
 
 # ===================== IMPORT RECEIPT =====================
@@ -60,7 +95,7 @@ class ExportItemInline(admin.TabularInline):
 
 @admin.register(ExportReceipt)
 class ExportReceiptAdmin(admin.ModelAdmin):
-    list_display = ("export_code", "destination", "export_date", "created_by")
+    list_display = ("export_code", "destination", "export_date", "total_quantity", "total_price", "created_by")
     list_filter = ("export_date",)
     search_fields = ("export_code", "destination")
     inlines = [ExportItemInline]
@@ -74,7 +109,7 @@ class ReturnItemInline(admin.TabularInline):
 
 @admin.register(ReturnReceipt)
 class ReturnReceiptAdmin(admin.ModelAdmin):
-    list_display = ("return_code", "return_date", "created_by")
+    list_display = ("return_code", "return_date", "total_quantity", "total_price", "created_by")
     list_filter = ("return_code", "return_date")
     search_fields = ("return_code",)
     inlines = [ReturnItemInline]
@@ -88,7 +123,7 @@ class PurchaseOrderItemInline(admin.TabularInline):
 
 @admin.register(PurchaseOrder)
 class PurchaseOrderAdmin(admin.ModelAdmin):
-    list_display = ("po_code", "supplier", "created_date", "status", "created_by")
+    list_display = ("po_code", "supplier", "created_date", "status", "total_amount", "created_by")
     list_filter = ("status", "supplier")
     search_fields = ("po_code",)
     inlines = [PurchaseOrderItemInline]
@@ -108,6 +143,23 @@ class ASNAdmin(admin.ModelAdmin):
     inlines = [ASNItemInline]
 
 
+# ===================== MÃ CHỨNG TỪ =====================
+@admin.register(DocumentSequence)
+class DocumentSequenceAdmin(admin.ModelAdmin):
+    list_display = ("prefix", "period", "last_value")
+    list_filter = ("prefix",)
+
+
+# ===================== SỐ LIỆU THEO NGÀY =====================
+@admin.register(DailySummary)
+class DailySummaryAdmin(admin.ModelAdmin):
+    list_display = ("day", "product", "category", "import_quantity", "export_quantity",
+                    "export_value", "return_quantity", "return_value")
+    list_filter = ("category",)
+    date_hierarchy = "day"
+    list_select_related = ("product__supplier", "category")
+
+
 # ===================== REPORT =====================
 @admin.register(Report)
 class ReportAdmin(admin.ModelAdmin):
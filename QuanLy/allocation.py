@@ -0,0 +1,202 @@
+# QuanLy/allocation.py
+from collections import OrderedDict
+from datetime import date
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F, Q
+
+from .models import StockItem, StockMovement, ExportItem, DailySummary
+
+
+# ===================== PHÂN BỔ LÔ TỰ ĐỘNG (FEFO) =====================
+# Nhu cầu (sản phẩm, số lượng[, CK %]) được chia vào các lô theo thứ tự
+# hết hạn trước – xuất trước. Lô đã hết hạn (theo ngày, không theo cột
+# status vì status chỉ được cập nhật 1 lần/ngày) và lô hết hàng bị bỏ qua.
+#
+# Thường chỉ 1 câu SELECT cho cả đơn, đọc bộ (id, SL, giá...) của vài lô đầu
+# mỗi sản phẩm theo index riêng phần stock_fefo_idx (chỉ chứa lô còn hàng) nên
+# không phụ thuộc tổng số lô trong bảng; sản phẩm cần nhiều lô hơn mới đọc
+# thêm. Chỉ dựng object cho các lô thực sự cần dùng.
+
+def _fefo_order():
+    return [F("expiry_date").asc(nulls_last=True), F("id").asc()]
+
+
+def _normalize_demands(demands):
+    # Chấp nhận (product, qty) hoặc (product, qty, discount_percent);
+    # product là SupplierProduct hoặc pk
+    lines = []
+    for line in demands:
+        product, quantity = line[0], int(line[1])
+        discount = Decimal(str(line[2])) if len(line) > 2 and line[2] is not None else Decimal("0")
+        product_id = getattr(product, "pk", product)
+        if quantity <= 0:
+            continue
+        lines.append((product_id, quantity, discount))
+    return lines
+
+
+class FefoAllocation:
+    """
+    Kết quả phân bổ: `items` là các ExportItem CHƯA lưu (chưa gắn phiếu),
+    `shortages` là {product_id: số lượng còn thiếu}.
+    create_export lưu phiếu qua commit() với các dòng lấy từ formset (lô do
+    người dùng chọn hoặc do api_fefo_allocation đề xuất), shortages rỗng.
+    """
+
+    def __init__(self, items, shortages):
+        self.items = items
+        self.shortages = shortages
+
+    @property
+    def is_complete(self):
+        return not self.shortages
+
+    def lot_amounts(self):
+        amounts = OrderedDict()
+        for item in self.items:
+            amounts[item.stock_item_id] = amounts.get(item.stock_item_id, 0) + item.quantity
+        return amounts
+
+    def commit(self, receipt):
+        """
+        Lưu toàn bộ dòng vào phiếu trong 1 transaction: trừ tồn gộp
+        (StockItem.decrease_many) + bulk_create dòng xuất và sổ kho + tính lại tổng phiếu
+        và số liệu theo ngày.
+        Lô bị người khác xuất mất giữa lúc đề xuất và lúc lưu (hoặc nhiều dòng
+        cùng lô vượt tồn) -> ValidationError, không lưu gì.
+        """
+        if self.shortages:
+            raise ValidationError("Không đủ tồn kho để phân bổ")
+
+        with transaction.atomic():
+            StockItem.decrease_many(self.lot_amounts())
+            for item in self.items:
+                item.receipt = receipt
+                item.fill_totals()
+            # bulk_create không gọi ExportItem.save() -> không trừ tồn lần 2
+            ExportItem.objects.bulk_create(self.items)
+            StockMovement.bulk_record([
+                StockMovement.build(item.stock_item, -item.quantity, "export", receipt.pk,
+                                    receipt.export_date)
+                for item in self.items
+            ])
+            receipt.recalculate_totals()
+            DailySummary.refresh(receipt.export_date, [i.stock_item.product_id for i in self.items])
+        return self.items
+
+
+# Số lô đọc cho mỗi sản phẩm ở lượt đầu; sản phẩm chưa đủ thì lượt sau đọc
+# tiếp (gấp LOT_BATCH_GROWTH lần) từ sau lô cuối cùng đã đọc
+LOT_BATCH = 20
+LOT_BATCH_GROWTH = 4
+
+
+def _after_lot(expiry_date, pk):
+    # lô đứng sau (expiry_date, id) theo _fefo_order (HSD trống xếp cuối)
+    if expiry_date is None:
+        return Q(expiry_date__isnull=True, id__gt=pk)
+    return (Q(expiry_date__gt=expiry_date) | Q(expiry_date=expiry_date, id__gt=pk)
+            | Q(expiry_date__isnull=True))
+
+
+def candidate_lots(demand_by_product, today=None):
+    # Các lô cần dùng cho từng sản phẩm, đã theo thứ tự FEFO.
+    # Mỗi sản phẩm chỉ đọc LOT_BATCH lô đầu (id IN (SELECT ... ORDER BY HSD LIMIT n)
+    # trên stock_fefo_idx) -> số dòng đọc theo nhu cầu, không theo số lô đang có.
+    today = today or date.today()
+    if not demand_by_product:
+        return []
+
+    live = StockItem.objects.filter(quantity__gt=0) \
+                            .filter(Q(expiry_date__isnull=True) | Q(expiry_date__gte=today))
+
+    lots = []
+    running = {}
+    pending = {product_id: Q() for product_id in demand_by_product}
+    batch = LOT_BATCH
+    while pending:
+        condition = Q()
+        for product_id, after in pending.items():
+            first_lots = live.filter(after, product_id=product_id).order_by(*_fefo_order())
+            condition |= Q(pk__in=first_lots.values("pk")[:batch])
+
+        rows = (
+            StockItem.objects.filter(condition)
+            .order_by("product_id", *_fefo_order())
+            .values_list("id", "product_id", "quantity", "unit", "unit_price", "expiry_date")
+        )
+
+        read, last = {}, {}
+        for pk, product_id, quantity, unit, unit_price, expiry_date in rows:
+            read[product_id] = read.get(product_id, 0) + 1
+            last[product_id] = (expiry_date, pk)
+            # đủ nhu cầu rồi thì các lô sau của sản phẩm này không cần dựng object
+            if running.get(product_id, 0) >= demand_by_product[product_id]:
+                continue
+            running[product_id] = running.get(product_id, 0) + quantity
+            lots.append(StockItem(
+                id=pk, product_id=product_id, quantity=quantity,
+                unit=unit, unit_price=unit_price, expiry_date=expiry_date,
+            ))
+
+        # đọc đủ batch lô mà vẫn thiếu -> có thể còn lô phía sau
+        pending = {
+            product_id: _after_lot(*last[product_id])
+            for product_id in pending
+            if read.get(product_id, 0) == batch
+            and running.get(product_id, 0) < demand_by_product[product_id]
+        }
+        batch *= LOT_BATCH_GROWTH
+
+    return lots
+
+
+def allocate_fefo(demands, today=None):
+    """
+    Đề xuất dòng xuất cho các nhu cầu theo FEFO (không ghi DB).
+    Nhiều dòng cùng sản phẩm được phân bổ nối tiếp trên cùng dãy lô.
+    """
+    lines = _normalize_demands(demands)
+
+    demand_by_product = OrderedDict()
+    for product_id, quantity, _ in lines:
+        demand_by_product[product_id] = demand_by_product.get(product_id, 0) + quantity
+
+    lots_by_product = {}
+    for lot in candidate_lots(demand_by_product, today=today):
+        lots_by_product.setdefault(lot.product_id, []).append(lot)
+
+    # (lô, tồn còn lại) dùng dần cho các dòng nhu cầu
+    cursors = {pk: [[lot, lot.quantity] for lot in lots] for pk, lots in lots_by_product.items()}
+
+    items = []
+    shortages = OrderedDict()
+    for product_id, quantity, discount in lines:
+        remaining = quantity
+        for slot in cursors.get(product_id, []):
+            if remaining == 0:
+                break
+            lot, available = slot
+            take = min(available, remaining)
+            if take == 0:
+                continue
+            slot[1] -= take
+            remaining -= take
+
+            base = take * lot.unit_price
+            items.append(ExportItem(
+                stock_item=lot,
+                quantity=take,
+                unit=lot.unit,
+                unit_price=lot.unit_price,
+                discount_percent=discount,
+                total=base - (base * discount / 100),
+            ))
+
+        if remaining:
+            shortages[product_id] = shortages.get(product_id, 0) + remaining
+
+    return FefoAllocation(items, shortages)
@@ -4,3 +4,44 @@ from django.apps import AppConfig
 class QuanlyConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'QuanLy'
+
+    def ready(self):
+        # Nhóm của user đổi ở admin / shell -> bỏ cache nhóm quyền (QuanLy/roles.py)
+        from django.contrib.auth import get_user_model
+        from django.contrib.auth.models import Group
+        from django.db.models.signals import (
+            m2m_changed, post_delete, post_migrate, post_save, pre_delete,
+        )
+        from .roles import (
+            ensure_version_cache, on_group_deleted, on_group_deleting, on_group_saved,
+            on_groups_changed,
+        )
+        from .search import ensure_fts
+        from .search_index import connect_signals
+
+        m2m_changed.connect(
+            on_groups_changed,
+            sender=get_user_model().groups.through,
+            dispatch_uid="quanly_roles_groups_changed",
+        )
+        # đổi tên / xoá nhóm cũng làm bản nhóm trong session hết hiệu lực
+        post_save.connect(on_group_saved, sender=Group, dispatch_uid="quanly_roles_group_saved")
+        pre_delete.connect(on_group_deleting, sender=Group, dispatch_uid="quanly_roles_group_deleting")
+        post_delete.connect(on_group_deleted, sender=Group, dispatch_uid="quanly_roles_group_deleted")
+        # bảng cache phiên bản nhóm quyền (ROLE_VERSION_CACHE) tạo cùng lúc migrate
+        post_migrate.connect(ensure_version_cache, sender=self, dispatch_uid="quanly_role_version_cache")
+
+        # Xoá phiếu -> tính lại số liệu theo ngày của ngày + sản phẩm trên phiếu
+        from .models import DAILY_SUMMARY_RECEIPTS, on_receipt_deleted, on_receipt_deleting
+        for model_name in DAILY_SUMMARY_RECEIPTS:
+            model = self.get_model(model_name)
+            pre_delete.connect(on_receipt_deleting, sender=model,
+                               dispatch_uid=f"quanly_daily_summary_deleting_{model_name}")
+            post_delete.connect(on_receipt_deleted, sender=model,
+                                dispatch_uid=f"quanly_daily_summary_deleted_{model_name}")
+
+        # Chỉ mục tìm kiếm chung (/api/search) theo dõi lưu / xoá chứng từ
+        connect_signals()
+
+        # Migration dựng lại bảng trên SQLite làm mất trigger FTS5 -> cài lại
+        post_migrate.connect(ensure_fts, sender=self, dispatch_uid="quanly_ensure_fts")
@@ -0,0 +1,199 @@
+# QuanLy/benchmarks.py
+import math
+from collections import namedtuple
+from datetime import timedelta
+
+from django.contrib import messages
+from django.contrib.messages import get_messages
+from django.db.models import Count, Max
+from django.urls import reverse
+
+from .models import (
+    ASN, ExportItem, ExportReceipt, ImportReceipt, PurchaseOrder,
+    StockItem, Supplier, SupplierProduct,
+)
+from .search import normalize_text
+
+
+# ===================== KỊCH BẢN ĐO HIỆU NĂNG =====================
+# Các trang / API nóng của kho, chạy qua test client trên dữ liệu sinh bởi
+# seed_warehouse (lệnh benchmark_views). Tham số (NCC, lô, phiếu...) lấy từ
+# chính CSDL đang đo theo thứ tự cố định -> 2 lần chạy trên cùng bộ dữ liệu
+# gửi cùng request. Kịch bản ghi (writes=True) chạy trong transaction rồi
+# rollback nên dữ liệu không đổi giữa các lượt. Mỗi lượt phải trả đúng mã HTTP
+# mong đợi (status) và không kèm thông báo lỗi / cảnh báo, nếu không lệnh đo
+# dừng lại thay vì đo thời gian của một trang lỗi.
+
+Scenario = namedtuple("Scenario", "name method url data writes status")
+
+FORM_LINES = 8          # số dòng hàng mỗi phiếu gửi lên
+
+
+def _get(name, url, **params):
+    return Scenario(name, "get", url, params, False, 200)
+
+
+def _post(name, url, data):
+    # lưu thành công -> redirect sang trang danh sách
+    return Scenario(name, "post", url, data, True, 302)
+
+
+def _management(total, prefix="items"):
+    return {
+        f"{prefix}-TOTAL_FORMS": str(total),
+        f"{prefix}-INITIAL_FORMS": "0",
+        f"{prefix}-MIN_NUM_FORMS": "0",
+        f"{prefix}-MAX_NUM_FORMS": "1000",
+    }
+
+
+def _import_form(supplier, products, day):
+    data = {"supplier": supplier.pk, "asn": "", "import_date": day.isoformat(), "note": "benchmark",
+            **_management(len(products))}
+    for i, product in enumerate(products):
+        data.update({
+            f"items-{i}-asn_item": "",
+            f"items-{i}-product": product.pk,
+            f"items-{i}-quantity": "10",
+            f"items-{i}-unit_price": str(product.unit_price),
+            f"items-{i}-unit": "Thùng",
+            f"items-{i}-location": "Kệ A1",
+            f"items-{i}-expiry_date": (day + timedelta(days=180)).isoformat(),
+        })
+    return data
+
+
+def _export_form(lots, day):
+    data = {"export_date": day.isoformat(), "destination": "Cửa hàng benchmark",
+            "receiver_name": "Người nhận", "receiver_phone": "0900000000", "note": "", **_management(len(lots))}
+    for i, lot in enumerate(lots):
+        data.update({
+            f"items-{i}-stock_item": lot.pk,
+            f"items-{i}-quantity": "1",
+            f"items-{i}-unit_price": str(lot.unit_price),
+            f"items-{i}-discount_percent": "0",
+            f"items-{i}-unit": lot.unit,
+            f"items-{i}-total": str(lot.unit_price),
+        })
+    return data
+
+
+def _return_form(export, items, day):
+    data = {"return_date": day.isoformat(), "export_receipt": export.pk, "note": "",
+            **_management(len(items))}
+    for i, item in enumerate(items):
+        lot = item.stock_item
+        data.update({
+            f"items-{i}-export_item": item.pk,
+            f"items-{i}-product": lot.product_id,
+            f"items-{i}-quantity": "1",
+            f"items-{i}-unit": item.unit,
+            f"items-{i}-unit_price": str(item.unit_price),
+            f"items-{i}-expiry_date": lot.expiry_date.isoformat() if lot.expiry_date else "",
+            f"items-{i}-location": lot.location or "",
+            f"items-{i}-reason": "Hàng lỗi",
+            f"items-{i}-detail_note": "",
+        })
+    return data
+
+
+def build_scenarios():
+    """Danh sách Scenario cho CSDL hiện tại (cần dữ liệu kiểu seed_warehouse)."""
+    last_import = ImportReceipt.objects.aggregate(day=Max("import_date"))["day"]
+    if last_import is None:
+        raise ValueError("Chưa có phiếu nhập – hãy chạy seed_warehouse trước.")
+
+    supplier = Supplier.objects.annotate(product_count=Count("products")) \
+                               .filter(product_count__gte=FORM_LINES).order_by("pk").first()
+    products = list(SupplierProduct.objects.filter(supplier=supplier).order_by("pk")[:FORM_LINES])
+    lots = list(StockItem.objects.filter(quantity__gte=FORM_LINES).order_by("expiry_date", "pk")[:FORM_LINES])
+    export = (ExportReceipt.objects.annotate(lines=Count("items")).order_by("-lines", "pk").first())
+    export_items = list(ExportItem.objects.filter(receipt=export).select_related("stock_item").order_by("pk"))
+    po = PurchaseOrder.objects.annotate(lines=Count("items")).order_by("-lines", "pk").first()
+    asn = ASN.objects.annotate(lines=Count("items")).order_by("-lines", "pk").first()
+    word = normalize_text(products[0].name).split()[0]
+    code_prefix = products[0].product_code[:-1]
+    fefo = [p for p in StockItem.objects.filter(quantity__gt=0)
+                                        .values_list("product_id", flat=True).order_by("product_id")
+                                        .distinct()[:3]]
+
+    scenarios = [
+        _get("stock_list", reverse("stock_list")),
+        _get("stock_list/search", reverse("stock_list"), q=word),
+        _get("create_import", reverse("create_import")),
+        _post("create_import/post", reverse("create_import"), _import_form(supplier, products, last_import)),
+        _get("create_export", reverse("create_export")),
+        _post("create_export/post", reverse("create_export"), _export_form(lots, last_import)),
+        _get("create_return", reverse("create_return")),
+        _get("reports", reverse("reports"),
+             start_date=(last_import - timedelta(days=30)).isoformat(), end_date=last_import.isoformat()),
+        _get("api_supplier_products", reverse("api_supplier_products", args=[supplier.pk])),
+        _get("api_stock_lots", reverse("api_stock_lots")),
+        _get("api_stock_lots/search", reverse("api_stock_lots"), q=word),
+        _get("api_fefo_allocation", reverse("api_fefo_allocation"),
+             product=fefo, quantity=["50"] * len(fefo)),
+        _get("api_search/code", reverse("api_search"), q=code_prefix),
+        _get("api_search/text", reverse("api_search"), q=f"{word} {normalize_text(products[0].name).split()[-1]}"),
+    ]
+    if export is not None and export_items:
+        scenarios += [
+            _post("create_return/post", reverse("create_return"),
+                  _return_form(export, export_items[:FORM_LINES], last_import)),
+            _get("api_export_items", reverse("api_export_items", args=[export.pk])),
+        ]
+    if po is not None:
+        scenarios.append(_get("api_po_details", reverse("api_po_details", args=[po.pk])))
+    if asn is not None:
+        scenarios.append(_get("api_asn_items", reverse("api_asn_items", args=[asn.pk])))
+    return scenarios
+
+
+def response_problem(scenario, response):
+    """Lý do lượt chạy không tính được (sai mã HTTP, form lỗi, lưu 0 dòng...) hoặc None."""
+    if response.status_code != scenario.status:
+        return f"HTTP {response.status_code}, cần {scenario.status}"
+    # form lỗi / "Chưa có sản phẩm hợp lệ." vẫn redirect -> xem thông báo của request
+    problems = [str(m) for m in get_messages(response.wsgi_request) if m.level >= messages.WARNING]
+    if problems:
+        return "; ".join(problems)
+    return None
+
+
+# ---------- thống kê ----------
+def percentile(samples, q):
+    # nearest-rank trên mẫu đã sắp xếp
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def summarize(samples):
+    return {
+        "p50_ms": round(percentile(samples, 0.50), 3),
+        "p95_ms": round(percentile(samples, 0.95), 3),
+        "p99_ms": round(percentile(samples, 0.99), 3),
+        "max_ms": round(max(samples), 3),
+        "mean_ms": round(sum(samples) / len(samples), 3),
+    }
+
+
+def compare_results(baseline, current, threshold=0.2, min_delta_ms=2.0):
+    """
+    So kết quả 2 lần chạy (dict JSON của benchmark_views). Trả về danh sách
+    (bộ dữ liệu, kịch bản, mô tả) bị chậm đi quá threshold (và quá min_delta_ms,
+    tránh nhiễu ở request rất nhanh) hoặc tăng số câu truy vấn.
+    """
+    regressions = []
+    for size, dataset in current["datasets"].items():
+        base_dataset = baseline.get("datasets", {}).get(size)
+        if not base_dataset:
+            continue
+        for name, result in dataset["scenarios"].items():
+            base = base_dataset["scenarios"].get(name)
+            if not base:
+                continue
+            before, after = base["p95_ms"], result["p95_ms"]
+            if after > before * (1 + threshold) and after - before > min_delta_ms:
+                regressions.append((size, name, f"p95 {before:.1f} -> {after:.1f} ms"))
+            if result["queries"] > base["queries"]:
+                regressions.append((size, name, f"{base['queries']} -> {result['queries']} câu SQL"))
+    return regressions
@@ -0,0 +1,115 @@
+# QuanLy/dashboard.py
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+
+
+# ===================== SỐ LIỆU TRANG CHỦ (CACHE) =====================
+# Trang chủ được nhiều người mở và tải lại liên tục -> số liệu được tính
+# bằng 2 câu SQL rồi lưu cache. Mỗi lần ghi phiếu / tồn kho chỉ tăng số
+# phiên bản (dashboard:version) sau khi transaction commit; key cache có
+# chứa phiên bản nên bản cũ tự bị bỏ qua, không phải xoá từng key.
+#
+# Dùng chung cache giữa các tiến trình (Redis / Memcached / DatabaseCache)
+# thì mọi worker thấy cùng phiên bản; LocMemCache chỉ đúng trong 1 tiến trình.
+
+CACHE_TIMEOUT = getattr(settings, "DASHBOARD_CACHE_TIMEOUT", 300)
+
+VERSION_KEY = "dashboard:version"
+HITS_KEY = "dashboard:hits"
+MISSES_KEY = "dashboard:misses"
+
+
+def _incr(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # key chưa có (hoặc vừa bị đẩy khỏi cache)
+        if cache.add(key, 1, timeout=None):
+            return 1
+        return cache.incr(key)
+
+
+def _current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # khởi tạo theo thời gian -> không trùng phiên bản cũ còn sót trong cache
+        cache.add(VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def _bump_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, int(time.time() * 1000), timeout=None)
+
+
+def invalidate_dashboard():
+    # Gọi từ mọi đường ghi phiếu / tồn kho; chạy sau commit để request khác
+    # không kịp lưu số liệu cũ vào phiên bản mới
+    transaction.on_commit(_bump_version)
+
+
+def _count_many(querysets):
+    # Nhiều COUNT trong 1 câu: SELECT (SELECT COUNT(*) FROM (...)), (...), ...
+    selects, params = [], []
+    for name, queryset in querysets.items():
+        sql, query_params = queryset.order_by().query.sql_with_params()
+        selects.append(f"(SELECT COUNT(*) FROM ({sql}) subquery_{name}) AS {name}")
+        params.extend(query_params)
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT " + ", ".join(selects), params)
+        row = cursor.fetchone()
+    return dict(zip(querysets, row))
+
+
+def compute_dashboard_metrics(today):
+    from .models import (
+        StockItem, SupplierProduct, ImportReceipt, ExportReceipt, ReturnReceipt,
+    )
+
+    metrics = StockItem.objects.aggregate(
+        stock_total=Sum("quantity"),
+        expired=Count("id", filter=Q(status="expired")),
+        nearly_expired=Count("id", filter=Q(status="nearly_expired")),
+    )
+    metrics["stock_total"] = metrics["stock_total"] or 0
+
+    metrics.update(_count_many({
+        "import_count_today": ImportReceipt.objects.filter(import_date=today).values("pk"),
+        "export_count_today": ExportReceipt.objects.filter(export_date=today).values("pk"),
+        "return_count_today": ReturnReceipt.objects.filter(return_date=today).values("pk"),
+        "total_products": SupplierProduct.objects.values("product_code").distinct(),
+    }))
+    return metrics
+
+
+def get_dashboard_metrics(today):
+    key = f"dashboard:metrics:{_current_version()}:{today.isoformat()}"
+
+    metrics = cache.get(key)
+    if metrics is not None:
+        _incr(HITS_KEY)
+        return metrics
+
+    _incr(MISSES_KEY)
+    metrics = compute_dashboard_metrics(today)
+    cache.set(key, metrics, CACHE_TIMEOUT)
+    return metrics
+
+
+def dashboard_cache_stats():
+    hits = cache.get(HITS_KEY) or 0
+    misses = cache.get(MISSES_KEY) or 0
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / total, 4) if total else 0.0,
+    }
@@ -4,6 +4,8 @@ from django.shortcuts import redirect
 from django.conf import settings
 from django.core.exceptions import PermissionDenied
 
+from .roles import get_group_names, user_in_groups
+
 
 def group_required(*group_names):
     def decorator(view_func):
@@ -24,7 +26,7 @@ def group_required(*group_names):
                 return view_func(request, *args, **kwargs)
 
             # Nếu user thuộc ít nhất một group
-            if user.groups.filter(name__in=group_names).exists():
+            if user_in_groups(user, group_names, request):
                 return view_func(request, *args, **kwargs)
 
             # Không đủ quyền → 403
@@ -43,14 +45,14 @@ from django.core.exceptions import PermissionDenied
 
 
 
-def get_permission_flags(user):
+def get_permission_flags(user, request=None):
 
     is_manager = False      # Cửa hàng trưởng
     is_employee = False     # Nhân viên
     is_supplier = False     # Nhà cung ứng
 
     if user.is_authenticated:
-        groups = set(user.groups.values_list("name", flat=True))
+        groups = get_group_names(user, request)
         is_manager = "Cửa hàng trưởng" in groups
         is_employee = "Nhân viên" in groups
         is_supplier = "Nhà cung ứng" in groups
@@ -1,6 +1,7 @@
+from functools import partial
+
 from django import forms
 from django.forms import inlineformset_factory
-from django.db.models import Sum
 
 from .models import (
     Category, Supplier, SupplierProduct,
@@ -12,6 +13,89 @@ from .models import (
     ASN, ASNItem
 )
 
+# Mã phiếu do DocumentSequence cấp lúc lưu -> ô mã chỉ để xem (giá trị
+# dự kiến), không nhận mã từ POST để hai người mở form cùng lúc không trùng mã.
+def lock_code_field(form, field_name):
+    field = form.fields[field_name]
+    field.disabled = True
+    field.required = False
+    field.widget.attrs.setdefault("placeholder", "Tự sinh khi lưu")
+
+
+# ===================== FORMSET: NẠP SẴN LỰA CHỌN =====================
+# ModelChoiceField mặc định chạy 1 câu SELECT cho mỗi dòng formset (và
+# Model.full_clean() thêm 1 câu kiểm tra FK nữa). Formset dùng
+# PreloadedChoicesFormSetMixin nạp mọi id được gửi lên bằng 1 câu
+# WHERE id IN (...) cho mỗi field, từng dòng chỉ tra trong dict.
+# Khi render, ô <select> của field trong shared_choice_fields dùng chung
+# 1 danh sách lựa chọn cho mọi dòng thay vì mỗi dòng 1 câu SELECT.
+class PreloadedModelChoiceField(forms.ModelChoiceField):
+    preloaded = None    # {pk: object} do formset gán, None = tra DB như thường
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        if self.preloaded is None:
+            return super().to_python(value)
+        try:
+            obj = self.preloaded.get(int(value))
+        except (TypeError, ValueError):
+            obj = None
+        if obj is None:
+            raise forms.ValidationError(
+                self.error_messages["invalid_choice"],
+                code="invalid_choice",
+                params={"value": value},
+            )
+        return obj
+
+
+class PreloadedChoicesFormMixin:
+    def _get_validation_exclusions(self):
+        # field đã nạp sẵn đã kiểm tra object tồn tại -> bỏ câu kiểm tra FK lặp lại
+        exclude = super()._get_validation_exclusions()
+        for name, field in self.fields.items():
+            if isinstance(field, PreloadedModelChoiceField) and field.preloaded is not None:
+                exclude.add(name)
+        return exclude
+
+
+class PreloadedChoicesFormSetMixin:
+    preload_fields = ()
+    shared_choice_fields = ()
+
+    def _preloaded(self, name, queryset):
+        cache = self.__dict__.setdefault("_preloaded_choices", {})
+        if name not in cache:
+            ids = set()
+            for i in range(self.total_form_count()):
+                try:
+                    ids.add(int(self.data.get(f"{self.add_prefix(i)}-{name}")))
+                except (TypeError, ValueError):
+                    continue
+            # queryset của field (đã lọc theo ASN / NCC...) -> id ngoài phạm vi vẫn bị từ chối
+            cache[name] = queryset.in_bulk(ids) if ids else {}
+        return cache[name]
+
+    def _shared_choices(self, name, field):
+        # tính lúc render dòng đầu tiên (POST hợp lệ không render thì không tốn câu nào)
+        cache = self.__dict__.setdefault("_shared_choices", {})
+        if name not in cache:
+            cache[name] = list(field.iterator(field))
+        return cache[name]
+
+    def _construct_form(self, i, **kwargs):
+        form = super()._construct_form(i, **kwargs)
+        if self.is_bound:
+            for name in self.preload_fields:
+                field = form.fields[name]
+                field.preloaded = self._preloaded(name, field.queryset)
+        for name in self.shared_choice_fields:
+            field = form.fields[name]
+            field.choices = partial(self._shared_choices, name, field)
+        return form
+
+
 # ===================== CATEGORY =====================
 class CategoryForm(forms.ModelForm):
     class Meta:
@@ -150,10 +234,15 @@ class SupplierProductForm(forms.ModelForm):
         return cleaned
 
 
+class BaseSupplierProductFormSet(PreloadedChoicesFormSetMixin, forms.BaseInlineFormSet):
+    shared_choice_fields = ("category",)
+
+
 SupplierProductFormSet = inlineformset_factory(
     Supplier,
     SupplierProduct,
     form=SupplierProductForm,
+    formset=BaseSupplierProductFormSet,
     extra=1,
     can_delete=True,
 )
@@ -201,8 +290,12 @@ class ImportReceiptForm(forms.ModelForm):
             "note": forms.Textarea(attrs={"class": "form-control", "rows": 2}),
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        lock_code_field(self, "import_code")
+
 
-class ImportItemForm(forms.ModelForm):
+class ImportItemForm(PreloadedChoicesFormMixin, forms.ModelForm):
     class Meta:
         model = ImportItem
         fields = [
@@ -218,6 +311,10 @@ class ImportItemForm(forms.ModelForm):
             "location": "Vị trí",
             "expiry_date": "Hạn sử dụng",
         }
+        field_classes = {
+            "asn_item": PreloadedModelChoiceField,
+            "product": PreloadedModelChoiceField,
+        }
         widgets = {
             "asn_item": forms.HiddenInput(),
             "product": forms.Select(
@@ -270,8 +367,11 @@ class ImportItemForm(forms.ModelForm):
                 is_active=True
             )
 
-        self.fields["product"].queryset = qs.order_by("name")
+        # nhãn lựa chọn (SupplierProduct.__str__) in mã NCC -> nạp kèm, không 1 câu / SP
+        self.fields["product"].queryset = qs.select_related("supplier").order_by("name")
         self.fields["product"].empty_label = "---------"
+        # clean() đọc asn_item.product
+        self.fields["asn_item"].queryset = ASNItem.objects.select_related("product")
 
     def clean(self):
         cleaned = super().clean()
@@ -299,10 +399,16 @@ class ImportItemForm(forms.ModelForm):
         return cleaned
 
 
+class BaseImportItemFormSet(PreloadedChoicesFormSetMixin, forms.BaseInlineFormSet):
+    preload_fields = ("asn_item", "product")
+    shared_choice_fields = ("product",)
+
+
 ImportItemFormSet = inlineformset_factory(
     ImportReceipt,
     ImportItem,
     form=ImportItemForm,
+    formset=BaseImportItemFormSet,
     extra=0,
     can_delete=True
 )
@@ -351,6 +457,10 @@ class ExportReceiptForm(forms.ModelForm):
             "receiver_phone": "SĐT người nhận",
             "note": "Ghi chú",
         }
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        lock_code_field(self, "export_code")
+
     def clean_receiver_phone(self):
         receiver_phone = (self.cleaned_data.get("receiver_phone") or "").strip()
         if not receiver_phone.isdigit():
@@ -361,17 +471,33 @@ class ExportReceiptForm(forms.ModelForm):
             raise forms.ValidationError("Số điện thoại phải bắt đầu bằng số 0.")
         return receiver_phone
 
-class ExportItemForm(forms.ModelForm):
+class LotChoiceField(PreloadedModelChoiceField):
+    """
+    Ô chọn lô cho dòng xuất: danh sách lô lấy dần qua api_stock_lots nên không
+    render sẵn <option> cho mọi lô.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(queryset=StockItem.objects.select_related("product"), **kwargs)
+
+    def _get_choices(self):
+        return [("", self.empty_label)]
+
+    choices = property(_get_choices, forms.ChoiceField._set_choices)
+
+
+class ExportItemForm(PreloadedChoicesFormMixin, forms.ModelForm):
+    stock_item = LotChoiceField(
+        label="Lô hàng",
+        widget=forms.Select(attrs={"class": "form-select stock-select"}),
+    )
+
     class Meta:
         model = ExportItem
         fields = ["stock_item", "quantity", "unit_price",
                   "discount_percent", "unit", "total"]
 
         widgets = {
-            "stock_item": forms.Select(attrs={
-                "class": "form-select stock-select",
-                "size": 6
-            }),
             "quantity": forms.NumberInput(attrs={
                 "class": "form-control text-end quantity",
                 "min": 1
@@ -393,38 +519,25 @@ class ExportItemForm(forms.ModelForm):
             }),
         }
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-
-        from django.db import models as dj
-
-        base_qs = StockItem.objects.all().order_by(
-            dj.Case(
-                dj.When(status="nearly_expired", then=0),
-                dj.When(status="expired", then=1),
-                dj.When(status="valid", then=2),
-                default=3,
-                output_field=dj.IntegerField()
-            ),
-            "expiry_date"
-        )
-
-
+    @property
+    def selected_lot(self):
+        # Lô đang chọn (khi render lại form lỗi), lấy từ dict formset đã nạp
+        lots = self.fields["stock_item"].preloaded or {}
         try:
-            if self.instance and hasattr(self.instance, "stock_item") and self.instance.stock_item:
-                p = self.instance.stock_item.product
-                base_qs = base_qs.filter(product=p)
-        except:
-            pass
+            return lots.get(int(self["stock_item"].value()))
+        except (TypeError, ValueError):
+            return None
 
-        self.fields["stock_item"].queryset = base_qs
 
+class BaseExportItemFormSet(PreloadedChoicesFormSetMixin, forms.BaseInlineFormSet):
+    preload_fields = ("stock_item",)
 
 
 ExportItemFormSet = inlineformset_factory(
     ExportReceipt,
     ExportItem,
     form=ExportItemForm,
+    formset=BaseExportItemFormSet,
     extra=1,
     can_delete=True
 )
@@ -451,9 +564,13 @@ class ReturnReceiptForm(forms.ModelForm):
             "note": forms.Textarea(attrs={"class": "form-control", "rows": 2}),
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        lock_code_field(self, "return_code")
+
 
-class ReturnItemForm(forms.ModelForm):
-    export_item = forms.ModelChoiceField(
+class ReturnItemForm(PreloadedChoicesFormMixin, forms.ModelForm):
+    export_item = PreloadedModelChoiceField(
         queryset=ExportItem.objects.select_related("stock_item__product", "receipt"),
         label="Dòng phiếu xuất",
         widget=forms.Select(attrs={"class": "form-select export-item-select"}),
@@ -475,6 +592,7 @@ class ReturnItemForm(forms.ModelForm):
             "reason": "Lý do hoàn hàng",
             "detail_note": "Ghi chú chi tiết",
         }
+        field_classes = {"product": PreloadedModelChoiceField}
         widgets = {
             "product": forms.Select(attrs={"class": "form-select product-select"}),
             "quantity": forms.NumberInput(attrs={
@@ -493,6 +611,9 @@ class ReturnItemForm(forms.ModelForm):
             "detail_note": forms.Textarea(attrs={"class": "form-control", "rows": 2}),
         }
 
+    # {export_item_id: SL đã hoàn} do formset nạp 1 lần; None = tự truy vấn
+    returned_quantities = None
+
     def __init__(self, *args, **kwargs):
         export_receipt = kwargs.pop("export_receipt", None)
         super().__init__(*args, **kwargs)
@@ -529,11 +650,12 @@ class ReturnItemForm(forms.ModelForm):
         # validate SL hoàn không vượt SL còn lại
         if export_item and quantity:
             exported_qty = export_item.quantity
-            returned_qty = ReturnItem.objects.filter(
-                export_item=export_item
-            ).exclude(
-                pk=self.instance.pk if self.instance and self.instance.pk else None
-            ).aggregate(total=Sum("quantity"))["total"] or 0
+            returned = self.returned_quantities
+            if returned is None:
+                returned = ReturnItem.returned_quantities(
+                    [export_item.pk], exclude_pks=[self.instance.pk]
+                )
+            returned_qty = returned.get(export_item.pk, 0)
 
             max_qty = exported_qty - returned_qty
             if quantity > max_qty:
@@ -547,9 +669,42 @@ class ReturnItemForm(forms.ModelForm):
         return cleaned
 
 
+class BaseReturnItemFormSet(PreloadedChoicesFormSetMixin, forms.BaseInlineFormSet):
+    preload_fields = ("export_item", "product")
+
+    def _construct_form(self, i, **kwargs):
+        form = super()._construct_form(i, **kwargs)
+        if self.is_bound:
+            if not hasattr(self, "_returned_quantities"):
+                # SL đã hoàn của mọi dòng xuất được chọn: 1 câu GROUP BY
+                self._returned_quantities = ReturnItem.returned_quantities(
+                    form.fields["export_item"].preloaded,
+                    exclude_pks=[obj.pk for obj in self.get_queryset()],
+                )
+            form.returned_quantities = self._returned_quantities
+        return form
+
+    def clean(self):
+        super().clean()
+        # nhiều dòng cùng 1 dòng xuất: tổng SL hoàn không vượt SL còn lại
+        totals = {}
+        for form in self.forms:
+            data = getattr(form, "cleaned_data", None) or {}
+            export_item = data.get("export_item")
+            if not export_item or data.get("DELETE") or not data.get("quantity"):
+                continue
+            totals[export_item.pk] = totals.get(export_item.pk, 0) + data["quantity"]
+            max_qty = export_item.quantity - self._returned_quantities.get(export_item.pk, 0)
+            if totals[export_item.pk] > max_qty:
+                raise forms.ValidationError(
+                    f"Tổng số lượng hoàn cho {export_item.stock_item.product.name} tối đa là {max_qty}."
+                )
+
+
 ReturnItemFormSet = inlineformset_factory(
     ReturnReceipt, ReturnItem,
     form=ReturnItemForm,
+    formset=BaseReturnItemFormSet,
     extra=1,
     can_delete=True
 )
@@ -579,9 +734,10 @@ class PurchaseOrderForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+        lock_code_field(self, "po_code")
+
         if self.instance and self.instance.pk:
             self.fields["supplier"].disabled = True
-            self.fields["po_code"].disabled = True
 
 class PurchaseOrderItemForm(forms.ModelForm):
     class Meta:
@@ -655,6 +811,10 @@ class ASNForm(forms.ModelForm):
             "status": forms.Select(attrs={"class": "form-select"}),
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        lock_code_field(self, "asn_code")
+
     def clean(self):
         cleaned = super().clean()
         po = cleaned.get("po")
@@ -669,7 +829,7 @@ class ASNForm(forms.ModelForm):
         return cleaned
 
 
-class ASNItemForm(forms.ModelForm):
+class ASNItemForm(PreloadedChoicesFormMixin, forms.ModelForm):
     class Meta:
         model = ASNItem
         fields = ["product", "quantity", "unit", "unit_price", "expiry_date"]
@@ -680,6 +840,7 @@ class ASNItemForm(forms.ModelForm):
             "unit_price": "Đơn giá",
             "expiry_date": "Hạn sử dụng",
         }
+        field_classes = {"product": PreloadedModelChoiceField}
         widgets = {
             "product": forms.Select(attrs={"class": "form-select product-select"}),
             "quantity": forms.NumberInput(attrs={"class": "form-control quantity", "min": 1}),
@@ -699,6 +860,14 @@ class ASNItemForm(forms.ModelForm):
         else:
             self.fields["product"].queryset = SupplierProduct.objects.none()
 
+    def current_po(self):
+        asn = getattr(self.instance, "asn", None)
+        if asn and asn.po_id:
+            return asn.po_id
+        if self._po:
+            return self._po.pk
+        return None
+
     def clean(self):
         cleaned_data = super().clean()
         product = cleaned_data.get("product")
@@ -707,37 +876,22 @@ class ASNItemForm(forms.ModelForm):
         if not product or not quantity:
             return cleaned_data
 
-        # Lấy asn / po hiện tại
-        asn = getattr(self.instance, "asn", None)
-        po = None
-        if asn and asn.po_id:
-            po = asn.po
-        elif hasattr(self, "_po") and self._po:
-            po = self._po
-
-        if po:
-            from .models import PurchaseOrderItem, ASNItem
-
-            po_item = PurchaseOrderItem.objects.filter(
-                po=po,
-                product=product
-            ).first()
+        po_id = self.current_po()
+        if po_id:
+            # tiến độ PO do formset nạp sẵn (instance.po_fulfillment), gọi lẻ thì tự tính
+            fulfillment = self.instance.po_fulfillment
+            if fulfillment is None:
+                fulfillment = PurchaseOrderItem.fulfillment(
+                    po_id, exclude_asn_items=[self.instance.pk]
+                )
+            line = fulfillment.get(product.pk)
 
-            if not po_item:
+            if not line:
                 raise forms.ValidationError(
                     f"Sản phẩm '{product.name}' không có trong PO đã chọn."
                 )
 
-            ordered_qty = po_item.quantity
-
-            delivered_qty = ASNItem.objects.filter(
-                asn__po=po,
-                product=product
-            ).exclude(
-                pk=self.instance.pk if self.instance and self.instance.pk else None
-            ).aggregate(total=Sum("quantity"))["total"] or 0
-
-            max_qty = ordered_qty - delivered_qty
+            max_qty = line["ordered"] - line["shipped"]
 
             if quantity > max_qty:
                 raise forms.ValidationError(
@@ -747,9 +901,55 @@ class ASNItemForm(forms.ModelForm):
         return cleaned_data
 
 
+class BaseASNItemFormSet(PreloadedChoicesFormSetMixin, forms.BaseInlineFormSet):
+    preload_fields = ("product",)
+    shared_choice_fields = ("product",)
+
+    def po_fulfillment(self, form):
+        # Tiến độ PO (đặt / đã giao / đã nhập) 1 câu cho cả formset; bỏ các dòng
+        # của chính ASN này vì chúng đang được gửi lại trong formset
+        if not hasattr(self, "_po_fulfillment"):
+            po_id = form.current_po()
+            self._po_fulfillment = PurchaseOrderItem.fulfillment(
+                po_id, exclude_asn=self.instance if self.instance.pk else None,
+            ) if po_id else {}
+        return self._po_fulfillment
+
+    def _construct_form(self, i, **kwargs):
+        form = super()._construct_form(i, **kwargs)
+        # formset chỉ gán asn_id -> gán luôn object để clean() không SELECT ASN mỗi dòng
+        setattr(form.instance, self.fk.name, self.instance)
+        if self.is_bound:
+            form.instance.po_fulfillment = self.po_fulfillment(form)
+        return form
+
+    def clean(self):
+        super().clean()
+        # nhiều dòng cùng sản phẩm: tổng SL giao không vượt SL còn lại của PO
+        fulfillment = getattr(self, "_po_fulfillment", None)
+        if not fulfillment:
+            return
+        totals = {}
+        for form in self.forms:
+            data = getattr(form, "cleaned_data", None) or {}
+            product = data.get("product")
+            if not product or data.get("DELETE") or not data.get("quantity"):
+                continue
+            line = fulfillment.get(product.pk)
+            if not line:
+                continue
+            totals[product.pk] = totals.get(product.pk, 0) + data["quantity"]
+            max_qty = line["ordered"] - line["shipped"]
+            if totals[product.pk] > max_qty:
+                raise forms.ValidationError(
+                    f"Tổng số lượng giao của '{product.name}' vượt quá số lượng còn lại trong PO ({max_qty})."
+                )
+
+
 ASNItemFormSet = inlineformset_factory(
     ASN, ASNItem,
     form=ASNItemForm,
+    formset=BaseASNItemFormSet,
     extra=1,
     can_delete=True
 )
@@ -0,0 +1,120 @@
+import random
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from QuanLy.models import SearchIndexEntry
+from QuanLy.search_index import DOC_TYPES, tokenize
+
+
+# Từ (đã bỏ dấu) để ghép tên / ghi chú giả lập
+VOCABULARY = (
+    "sua tuoi chua dac bot banh keo mi goi gao nep dau an nuoc mam tuong ot ca phe tra xanh "
+    "den duong muoi tieu hat nem thit bo heo ga vit trung rau cai cu qua tao cam chuoi xoai "
+    "nho dua hau lanh dong kho hop chai lon thung goi tui vi hop giay nhua thuy tinh nho lon "
+    "vua nhap xuat hoan giao som tre thieu du loi vo hong het han can ke kho lanh mat tang"
+).split()
+
+PREFIXES = {"import": "pn", "export": "xk", "return": "hh", "po": "po", "asn": "asn",
+            "supplier": "ncc", "product": "sp", "lot": "lo"}
+
+
+class Command(BaseCommand):
+    help = (
+        "Đo độ trễ tìm kiếm chung trên chỉ mục giả lập N tài liệu, gọi đúng đường của "
+        "người dùng: GET /api/search/ qua test client (đăng nhập, view, global_search, JSON). "
+        "Dữ liệu được ghi trong 1 transaction và rollback khi xong (trừ khi --keep)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--documents", type=int, default=1_000_000, help="Số tài liệu giả lập.")
+        parser.add_argument("--queries", type=int, default=500, help="Số câu tìm để đo.")
+        parser.add_argument("--budget-ms", type=float, default=20.0, help="Ngưỡng p95 (ms).")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--keep", action="store_true", help="Giữ lại dữ liệu giả lập.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        n = options["documents"]
+
+        with transaction.atomic():
+            started = time.perf_counter()
+            self._populate(rng, n)
+            self.stdout.write(f"Đã tạo {n:,} tài liệu giả lập trong {time.perf_counter() - started:.1f}s.")
+
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+                samples = self._measure(rng, n, options["queries"])
+
+            if not options["keep"]:
+                transaction.set_rollback(True)
+
+        samples.sort()
+        p = lambda q: samples[min(len(samples) - 1, int(len(samples) * q))]
+        p95 = p(0.95)
+        self.stdout.write(
+            f"{len(samples)} câu: p50 {p(0.5):.2f} ms · p95 {p95:.2f} ms · "
+            f"p99 {p(0.99):.2f} ms · max {samples[-1]:.2f} ms"
+        )
+        if p95 > options["budget_ms"]:
+            raise CommandError(f"p95 {p95:.2f} ms vượt ngưỡng {options['budget_ms']} ms.")
+        self.stdout.write(self.style.SUCCESS(f"p95 trong ngưỡng {options['budget_ms']} ms."))
+
+    def _populate(self, rng, n, chunk=50_000):
+        # Ghi thẳng bằng executemany: nhanh hơn bulk_create nhiều lần ở hàng triệu dòng
+        table = connection.ops.quote_name(SearchIndexEntry._meta.db_table)
+        sql = f"INSERT INTO {table} (word, doc_type, doc_key, weight) VALUES (%s, %s, %s, %s)"
+        types = list(DOC_TYPES)
+        rows = []
+        with connection.cursor() as cursor:
+            for i in range(n):
+                doc_type = types[i % len(types)]
+                key = f"bench{i}"
+                code = f"{PREFIXES[doc_type]}{i:07d}"
+                text = " ".join(rng.choices(VOCABULARY, k=4))
+                rows.extend((token, doc_type, key, weight)
+                            for token, weight in tokenize(code, text).items())
+                if len(rows) >= chunk:
+                    cursor.executemany(sql, rows)
+                    rows = []
+            if rows:
+                cursor.executemany(sql, rows)
+            if connection.vendor == "sqlite":
+                cursor.execute("ANALYZE")
+
+    def _measure(self, rng, n, count):
+        # Tài liệu giả lập không có dòng thật -> in_bulk của global_search vẫn chạy
+        # (1 câu / loại có mặt) nhưng không dựng kết quả; tài liệu thật có sẵn thì có.
+        user, _ = User.objects.get_or_create(
+            username="benchmark", defaults={"is_superuser": True, "is_staff": True}
+        )
+        client = Client()
+        client.force_login(user)
+        url = reverse("api_search")
+
+        types = list(DOC_TYPES)
+        samples = []
+        for _ in range(count):
+            kind = rng.random()
+            if kind < 0.4:      # mã chứng từ đầy đủ
+                i = rng.randrange(n)
+                query = f"{PREFIXES[types[i % len(types)]]}{i:07d}"
+            elif kind < 0.5:    # đang gõ dở mã
+                i = rng.randrange(n)
+                query = f"{PREFIXES[types[i % len(types)]]}{i:07d}"[:rng.randint(3, 7)]
+            elif kind < 0.75:   # tên 2 từ
+                query = " ".join(rng.sample(VOCABULARY, 2))
+            else:               # đang gõ dở: 2 từ, từ sau mới 2-3 ký tự
+                first, second = rng.sample(VOCABULARY, 2)
+                query = f"{first} {second[:rng.choice((2, 3))]}"
+
+            started = time.perf_counter()
+            response = client.get(url, {"q": query})
+            samples.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                raise CommandError(f"/api/search/?q={query} trả HTTP {response.status_code}")
+        return samples
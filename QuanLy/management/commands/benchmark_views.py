@@ -0,0 +1,187 @@
+import json
+import platform
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from QuanLy.benchmarks import build_scenarios, compare_results, response_problem, summarize
+from QuanLy.models import StockItem
+from QuanLy.search import reset_fts_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Đo độ trễ (p50/p95/p99), số câu SQL và bộ nhớ đỉnh của các trang / API kho "
+        "qua test client, trên bộ dữ liệu seed_warehouse 10k / 100k / 1M lô. "
+        "Mỗi quy mô dùng 1 file CSDL riêng trong --data-dir (sinh 1 lần, dùng lại). "
+        "Ghi kết quả JSON; --compare để so với lần chạy trước theo --threshold."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lots", type=int, nargs="+", default=[10_000],
+                            help="Các quy mô cần đo, VD: --lots 10000 100000 1000000.")
+        parser.add_argument("--data-dir", default=str(Path(settings.BASE_DIR) / "benchmarks"),
+                            help="Thư mục chứa CSDL đo và kết quả.")
+        parser.add_argument("--iterations", type=int, default=30, help="Số lượt đo mỗi kịch bản.")
+        parser.add_argument("--warmup", type=int, default=3, help="Số lượt chạy nóng (không tính).")
+        parser.add_argument("--scenario", action="append", default=[],
+                            help="Chỉ đo kịch bản có tên bắt đầu bằng chuỗi này (lặp được).")
+        parser.add_argument("--output", help="File JSON kết quả (mặc định <data-dir>/results-<thời điểm>.json).")
+        parser.add_argument("--compare", help="File JSON lần chạy trước để so sánh.")
+        parser.add_argument("--threshold", type=float, default=0.2,
+                            help="Chậm hơn bao nhiêu (tỉ lệ p95) thì tính là hồi quy. Mặc định 0.2 = 20%%.")
+        parser.add_argument("--min-delta-ms", type=float, default=2.0,
+                            help="Bỏ qua chênh lệch p95 nhỏ hơn mức này (nhiễu).")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--end-date", default="2026-01-31",
+                            help="Ngày cuối của dữ liệu sinh (cố định để các máy sinh cùng dữ liệu).")
+
+    def handle(self, *args, **options):
+        if options["iterations"] <= 0:
+            raise CommandError("--iterations phải lớn hơn 0")
+        baseline = None
+        if options["compare"]:
+            try:
+                baseline = json.loads(Path(options["compare"]).read_text(encoding="utf-8"))
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Không đọc được {options['compare']}: {e}")
+
+        data_dir = Path(options["data_dir"])
+        data_dir.mkdir(parents=True, exist_ok=True)
+        self.options = options
+        results = {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "iterations": options["iterations"],
+            "datasets": {},
+        }
+
+        original_name = connection.settings_dict["NAME"]
+        setup_test_environment()     # ALLOWED_HOSTS testserver, email vào bộ nhớ
+        try:
+            for lots in options["lots"]:
+                self.use_database(data_dir / f"bench_{lots}.sqlite3")
+                self.prepare(lots)
+                results["datasets"][str(lots)] = self.run_dataset(lots)
+        finally:
+            teardown_test_environment()
+            self.use_database(original_name)
+
+        output = Path(options["output"] or data_dir / f"results-{datetime.now():%Y%m%d-%H%M%S}.json")
+        output.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+        self.stdout.write(f"Đã ghi kết quả: {output}")
+
+        if baseline is not None:
+            regressions = compare_results(baseline, results, options["threshold"], options["min_delta_ms"])
+            for size, name, detail in regressions:
+                self.stdout.write(self.style.ERROR(f"  [{size}] {name}: {detail}"))
+            if regressions:
+                raise CommandError(f"{len(regressions)} kịch bản chậm hơn lần chạy {options['compare']}.")
+            self.stdout.write(self.style.SUCCESS("Không có hồi quy so với lần chạy trước."))
+
+    # ---------- CSDL theo quy mô ----------
+    @staticmethod
+    def use_database(name):
+        # Đổi file SQLite của kết nối default (giống test runner đổi sang CSDL test)
+        connections.close_all()
+        settings.DATABASES["default"]["NAME"] = name
+        connection.settings_dict["NAME"] = name
+        reset_fts_cache()
+        cache.clear()
+
+    def prepare(self, lots):
+        call_command("migrate", verbosity=0, interactive=False)
+        if not StockItem.objects.exists():
+            self.stdout.write(f"Sinh dữ liệu {lots:,} lô (chỉ lần đầu)...")
+            call_command("seed_warehouse", lots=lots, seed=self.options["seed"],
+                         end_date=self.options["end_date"], stdout=self.stdout)
+        with connection.cursor() as cursor:
+            if connection.vendor == "sqlite":
+                cursor.execute("ANALYZE")
+
+    # ---------- đo ----------
+    def run_dataset(self, lots):
+        user, _ = User.objects.get_or_create(
+            username="benchmark", defaults={"is_superuser": True, "is_staff": True}
+        )
+        client = Client()
+        client.force_login(user)
+
+        scenarios = build_scenarios()
+        if self.options["scenario"]:
+            scenarios = [s for s in scenarios if s.name.startswith(tuple(self.options["scenario"]))]
+
+        dataset = {"lots": lots, "rows": StockItem.objects.count(), "scenarios": {}}
+        self.stdout.write(f"== {lots:,} lô ==")
+        for scenario in scenarios:
+            result = self.measure(client, scenario)
+            dataset["scenarios"][scenario.name] = result
+            self.stdout.write(
+                f"  {scenario.name:<26} p50 {result['p50_ms']:8.1f} · p95 {result['p95_ms']:8.1f} ms · "
+                f"{result['queries']:3d} câu · {result['peak_kib']:8.0f} KiB · HTTP {result['status']}"
+            )
+        return dataset
+
+    def request(self, client, scenario):
+        # Kịch bản ghi: rollback sau mỗi lượt -> lượt sau thấy cùng dữ liệu
+        with transaction.atomic():
+            response = getattr(client, scenario.method)(scenario.url, scenario.data)
+            if scenario.writes:
+                transaction.set_rollback(True)
+        return response
+
+    @staticmethod
+    def check(scenario, response):
+        # Trang lỗi / form lỗi / lưu 0 dòng nhanh hơn đường thật -> không đo, dừng hẳn
+        problem = response_problem(scenario, response)
+        if problem:
+            raise CommandError(f"Kịch bản {scenario.name} không chạy đúng: {problem}")
+
+    def measure(self, client, scenario):
+        for _ in range(self.options["warmup"]):
+            self.check(scenario, self.request(client, scenario))
+
+        queries = []
+
+        def count(execute, sql, params, many, context):
+            queries[-1] += 1
+            return execute(sql, params, many, context)
+
+        samples = []
+        with connection.execute_wrapper(count):
+            for _ in range(self.options["iterations"]):
+                queries.append(0)
+                started = time.perf_counter()
+                response = self.request(client, scenario)
+                samples.append((time.perf_counter() - started) * 1000)
+                self.check(scenario, response)
+
+        # bộ nhớ đỉnh: lượt riêng vì tracemalloc làm chậm request
+        tracemalloc.start()
+        try:
+            self.request(client, scenario)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {
+            **summarize(samples),
+            "queries": max(queries),
+            "queries_min": min(queries),
+            "peak_kib": round(peak / 1024, 1),
+            "status": response.status_code,
+            "bytes": len(response.content),
+        }
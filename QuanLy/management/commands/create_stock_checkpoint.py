@@ -0,0 +1,42 @@
+from datetime import date, timedelta
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from QuanLy.models import StockCheckpoint
+
+
+class Command(BaseCommand):
+    help = (
+        "Chốt sổ kho: lưu số dư từng lô tại cuối ngày để tra tồn theo ngày chỉ cần cộng "
+        "biến động từ mốc gần nhất. Nên đặt lịch chạy hằng ngày (hoặc hằng tuần) sau 0h."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--date",
+            help="Ngày chốt (YYYY-MM-DD), mặc định hôm qua.",
+        )
+
+    def handle(self, *args, **options):
+        day = date.today() - timedelta(days=1)
+        if options["date"]:
+            try:
+                day = date.fromisoformat(options["date"])
+            except ValueError:
+                raise CommandError("Ngày không hợp lệ, định dạng đúng: YYYY-MM-DD")
+
+        try:
+            checkpoint = StockCheckpoint.create_for(day)
+        except ValidationError as e:
+            raise CommandError(e.messages[0])
+
+        if checkpoint is None:
+            self.stdout.write(f"Ngày {day:%d/%m/%Y} đã chốt sổ, bỏ qua.")
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Đã chốt sổ ngày {checkpoint.checkpoint_date:%d/%m/%Y}: "
+            f"{checkpoint.lines.count()} lô còn tồn, "
+            f"{checkpoint.movement_count} dòng sổ từ mốc trước."
+        ))
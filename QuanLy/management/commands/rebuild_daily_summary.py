@@ -0,0 +1,30 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from QuanLy.models import DailySummary
+
+
+class Command(BaseCommand):
+    help = (
+        "Tính lại bảng số liệu theo ngày (nhập / xuất / hoàn theo sản phẩm) từ các phiếu. "
+        "Dùng sau khi sửa phiếu trực tiếp trong DB / admin, hoặc khi nghi ngờ số liệu báo cáo lệch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="start", help="Từ ngày (YYYY-MM-DD), mặc định từ đầu.")
+        parser.add_argument("--to", dest="end", help="Đến ngày (YYYY-MM-DD), mặc định đến nay.")
+
+    def handle(self, *args, **options):
+        try:
+            start = date.fromisoformat(options["start"]) if options["start"] else None
+            end = date.fromisoformat(options["end"]) if options["end"] else None
+        except ValueError:
+            raise CommandError("Ngày không hợp lệ, định dạng đúng: YYYY-MM-DD")
+
+        if start and end and start > end:
+            raise CommandError("--from phải trước --to")
+
+        count = DailySummary.rebuild(start=start, end=end)
+
+        self.stdout.write(self.style.SUCCESS(f"Đã tính lại {count} dòng số liệu theo ngày."))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from QuanLy.search import fts_supported, install_fts, search_models
+from QuanLy.search_index import rebuild_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Tính lại cột search_text (viết thường, bỏ dấu) của sản phẩm, NCC, danh mục, phiếu, "
+        "dựng lại chỉ mục FTS5 và chỉ mục tìm kiếm chung (/api/search). Chạy sau khi nạp dữ liệu "
+        "bằng SQL / update() / loaddata (không qua save() nên search_text / chỉ mục không tự cập nhật)."
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            for model in search_models():
+                rows = list(model.objects.all())
+                changed = []
+                for row in rows:
+                    text = row.build_search_text()
+                    if text != row.search_text:
+                        row.search_text = text
+                        changed.append(row)
+                model.objects.bulk_update(changed, ["search_text"], batch_size=500)
+                self.stdout.write(
+                    f"{model._meta.verbose_name}: {len(rows)} dòng, cập nhật {len(changed)}."
+                )
+
+            if fts_supported(connection):
+                for model in search_models():
+                    install_fts(connection, model._meta.db_table)
+                self.stdout.write("Đã dựng lại chỉ mục FTS5.")
+            else:
+                self.stdout.write("CSDL không hỗ trợ FTS5 trigram – tìm kiếm dùng LIKE trên search_text.")
+
+            entries = rebuild_index()
+            self.stdout.write(f"Chỉ mục tìm kiếm chung: {entries} từ.")
+
+        self.stdout.write(self.style.SUCCESS("Hoàn tất dựng lại chỉ mục tìm kiếm."))
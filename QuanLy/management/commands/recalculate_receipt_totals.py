@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from QuanLy.models import ImportReceipt, ExportReceipt, ReturnReceipt, PurchaseOrder
+
+
+RECEIPT_MODELS = [ImportReceipt, ExportReceipt, ReturnReceipt, PurchaseOrder]
+
+
+class Command(BaseCommand):
+    help = (
+        "Tính lại các cột tổng lưu sẵn (SL, tiền, chiết khấu) của phiếu nhập / xuất / "
+        "hoàn và PO từ dòng hàng. Dùng --verify để chỉ kiểm tra, không ghi."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="Chỉ liệt kê các phiếu bị lệch, không cập nhật.",
+        )
+
+    def handle(self, *args, **options):
+        if options["verify"]:
+            self._verify()
+            return
+
+        with transaction.atomic():
+            for model in RECEIPT_MODELS:
+                count = model.backfill_totals()
+                self.stdout.write(f"{model._meta.verbose_name}: đã tính lại {count} phiếu.")
+
+        self.stdout.write(self.style.SUCCESS("Hoàn tất tính lại tổng phiếu."))
+
+    def _verify(self):
+        total = 0
+        for model in RECEIPT_MODELS:
+            mismatched = model.mismatched_totals()
+            total += len(mismatched)
+            for pk, diff in mismatched:
+                detail = ", ".join(f"{name}: {saved} ≠ {calc}" for name, (saved, calc) in diff.items())
+                self.stdout.write(f"{model._meta.verbose_name} {pk}: {detail}")
+
+        if total:
+            raise CommandError(
+                f"Có {total} phiếu lệch tổng. Chạy lại lệnh không có --verify để sửa."
+            )
+        self.stdout.write(self.style.SUCCESS("Tổng của tất cả phiếu đều khớp với dòng hàng."))
@@ -0,0 +1,44 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from QuanLy.models import StockStatusRefresh
+
+
+class Command(BaseCommand):
+    help = (
+        "Cập nhật trạng thái hạn dùng (còn hạn / cận hạn / hết hạn) cho toàn bộ lô tồn kho. "
+        "Mỗi ngày chỉ chạy một lần – nên đặt lịch (cron / Task Scheduler) chạy sau 0h."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--date",
+            help="Ngày dùng để tính hạn (YYYY-MM-DD), mặc định hôm nay.",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Chạy lại kể cả khi ngày này đã chạy.",
+        )
+
+    def handle(self, *args, **options):
+        today = None
+        if options["date"]:
+            try:
+                today = date.fromisoformat(options["date"])
+            except ValueError:
+                raise CommandError("Ngày không hợp lệ, định dạng đúng: YYYY-MM-DD")
+
+        record = StockStatusRefresh.run(today=today, force=options["force"])
+
+        if record is None:
+            self.stdout.write("Hôm nay đã cập nhật hạn dùng, bỏ qua (dùng --force để chạy lại).")
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Đã cập nhật hạn dùng ngày {record.run_date:%d/%m/%Y}: "
+            f"{record.expired_count} lô hết hạn, "
+            f"{record.nearly_expired_count} lô cận hạn, "
+            f"{record.valid_count} lô còn hạn."
+        ))
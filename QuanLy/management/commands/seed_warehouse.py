@@ -0,0 +1,473 @@
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connection, connections, models, transaction
+
+from QuanLy.dashboard import invalidate_dashboard
+from QuanLy.models import (
+    DOCUMENT_SEQUENCE_DEFAULTS, DocumentSequence,
+    Category, Supplier, SupplierProduct, StockItem, StockMovement,
+    ImportReceipt, ImportItem, ExportReceipt, ExportItem, ReturnReceipt, ReturnItem,
+    PurchaseOrder, PurchaseOrderItem, ASN, ASNItem, DailySummary,
+)
+from QuanLy.search_index import rebuild_index
+
+
+# ===================== DỮ LIỆU MẪU =====================
+CATEGORIES = [
+    ("Sữa tươi", "Sữa tươi tiệt trùng, thanh trùng"),
+    ("Sữa chua", "Sữa chua ăn, sữa chua uống"),
+    ("Đồ uống", "Nước khoáng, nước ngọt, trà đóng chai"),
+    ("Mì - Phở ăn liền", "Mì gói, phở, hủ tiếu ăn liền"),
+    ("Gia vị", "Nước mắm, nước tương, dầu ăn, hạt nêm"),
+    ("Bánh kẹo", "Bánh quy, kẹo, snack"),
+    ("Cà phê - Trà", "Cà phê hoà tan, cà phê hạt, trà túi lọc"),
+    ("Gạo - Ngũ cốc", "Gạo, nếp, ngũ cốc dinh dưỡng"),
+    ("Đồ đông lạnh", "Thịt, cá, chả giò đông lạnh"),
+    ("Hoá mỹ phẩm", "Nước giặt, dầu gội, kem đánh răng"),
+]
+
+BRANDS = ["TH True Milk", "Vinamilk", "Acecook", "Masan", "Cholimex", "Kinh Đô", "Trung Nguyên",
+          "Vissan", "Ajinomoto", "Tân Hiệp Phát", "Bibica", "Nam Ngư", "Simply", "Hảo Hảo", "Lavie"]
+PRODUCT_KINDS = [
+    (0, ["Sữa tươi", "Sữa tươi ít đường", "Sữa tươi không đường"], ["180ml", "110ml", "1L"], "Hộp"),
+    (1, ["Sữa chua ăn", "Sữa chua uống", "Sữa chua nha đam"], ["100g", "180ml", "lốc 4"], "Hộp"),
+    (2, ["Nước khoáng", "Trà xanh", "Nước cam", "Nước tăng lực"], ["500ml", "1.5L", "330ml"], "Chai"),
+    (3, ["Mì tôm chua cay", "Phở bò", "Hủ tiếu Nam Vang", "Mì xào"], ["gói 75g", "thùng 30"], "Thùng"),
+    (4, ["Nước mắm", "Nước tương", "Dầu ăn", "Hạt nêm"], ["500ml", "1L", "400g"], "Chai"),
+    (5, ["Bánh quy bơ", "Kẹo dừa", "Bánh xốp", "Snack khoai tây"], ["hộp 300g", "gói 50g"], "Gói"),
+    (6, ["Cà phê hoà tan", "Cà phê rang xay", "Trà túi lọc"], ["hộp 20 gói", "500g"], "Hộp"),
+    (7, ["Gạo thơm", "Gạo nếp", "Ngũ cốc"], ["túi 5kg", "túi 2kg"], "Túi"),
+    (8, ["Chả giò", "Cá basa phi lê", "Xúc xích"], ["gói 500g", "khay 1kg"], "Gói"),
+    (9, ["Nước giặt", "Dầu gội", "Kem đánh răng"], ["chai 1L", "túi 3kg", "tuýp 180g"], "Chai"),
+]
+COMPANY_WORDS = ["Phú Thịnh", "An Khang", "Minh Phát", "Đại Việt", "Hoàng Gia", "Sài Gòn", "Thành Công",
+                 "Hưng Thịnh", "Bình Minh", "Tân Phú", "Đông Á", "Nam Long", "Việt Tín", "Kim Ngân"]
+PEOPLE = ["Nguyễn Văn An", "Trần Thị Bình", "Lê Minh Châu", "Phạm Quốc Dũng", "Hoàng Thu Hà",
+          "Võ Thanh Hải", "Đặng Mỹ Linh", "Bùi Gia Huy", "Đỗ Ngọc Lan", "Ngô Đức Tài"]
+CITIES = ["Hà Nội", "TP. Hồ Chí Minh", "Đà Nẵng", "Hải Phòng", "Cần Thơ", "Nha Trang", "Huế"]
+STORES = ["Cửa hàng Quận 1", "Cửa hàng Quận 3", "Cửa hàng Thủ Đức", "Cửa hàng Gò Vấp",
+          "Cửa hàng Bình Thạnh", "Siêu thị mini Tân Bình", "Đại lý Biên Hoà", "Đại lý Dĩ An"]
+LOCATIONS = [f"Kệ {row}{n}" for row in "ABCDEF" for n in range(1, 10)]
+RETURN_REASONS = ["Hàng lỗi bao bì", "Sai quy cách", "Cận hạn", "Khách trả lại", "Giao dư"]
+IMPORT_NOTES = ["", "", "", "Giao đủ", "Giao thiếu 1 thùng, bù sau", "Hàng khuyến mãi", "Nhập bổ sung"]
+
+CODE_MODELS = {
+    "PN": (ImportReceipt, "import_code"),
+    "XK": (ExportReceipt, "export_code"),
+    "HH": (ReturnReceipt, "return_code"),
+    "PO": (PurchaseOrder, "po_code"),
+    "ASN": (ASN, "asn_code"),
+}
+
+
+class CodeAllocator:
+    # Cấp mã chứng từ trong bộ nhớ theo đúng định dạng DocumentSequence (độ dài,
+    # đánh số theo kỳ) và ghi lại bộ đếm khi xong -> phiếu tạo sau trên web không trùng mã
+    def __init__(self):
+        self.config = {p: DocumentSequence.get_config(p) for p in DOCUMENT_SEQUENCE_DEFAULTS}
+        self.last = {}
+
+    def next(self, prefix, day):
+        config = self.config[prefix]
+        period = DocumentSequence.current_period(config["period"], day)
+        value = self.last.get((prefix, period), 0) + 1
+        self.last[(prefix, period)] = value
+        return f"{prefix}{period}{value:0{config['width']}d}"
+
+    def save(self):
+        for (prefix, period), value in self.last.items():
+            counter, created = DocumentSequence.objects.get_or_create(
+                prefix=prefix, period=period, defaults={"last_value": value},
+            )
+            if not created and counter.last_value < value:
+                counter.last_value = value
+                counter.save(update_fields=["last_value"])
+
+
+class Command(BaseCommand):
+    help = (
+        "Sinh dữ liệu kho giả lập để đo tải: NCC, sản phẩm, PO, ASN, phiếu nhập + lô, "
+        "phiếu xuất, phiếu hoàn, sổ kho và số liệu theo ngày, tồn kho khớp sổ. "
+        "Cùng --seed và --end-date cho ra cùng dữ liệu. Chỉ chạy trên CSDL chưa có chứng từ."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lots", type=int, default=10_000,
+                            help="Số lô nhập (= số dòng phiếu nhập), quyết định quy mô. Mặc định 10000.")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--suppliers", type=int, help="Số NCC (mặc định theo --lots).")
+        parser.add_argument("--products-per-supplier", type=int, default=40)
+        parser.add_argument("--lines-per-receipt", type=int, default=8, help="Số dòng trung bình mỗi phiếu.")
+        parser.add_argument("--asn-ratio", type=float, default=0.6,
+                            help="Tỉ lệ phiếu nhập đi qua PO + ASN.")
+        parser.add_argument("--export-ratio", type=float, default=0.7,
+                            help="Tỉ lệ lô có xuất kho.")
+        parser.add_argument("--return-ratio", type=float, default=0.05,
+                            help="Tỉ lệ phiếu xuất có hoàn hàng.")
+        parser.add_argument("--days", type=int, default=365, help="Số ngày lịch sử.")
+        parser.add_argument("--end-date", help="Ngày cuối (YYYY-MM-DD), mặc định hôm nay.")
+        parser.add_argument("--chunk-size", type=int, default=5000,
+                            help="Số lô mỗi đợt ghi (mỗi đợt 1 transaction), cũng là số dòng mỗi lần executemany.")
+        parser.add_argument("--skip-search-index", action="store_true",
+                            help="Không dựng chỉ mục /api/search (chạy rebuild_search_index sau).")
+
+    def handle(self, *args, **options):
+        if options["lots"] <= 0 or options["chunk_size"] <= 0:
+            raise CommandError("--lots và --chunk-size phải lớn hơn 0")
+        if any(m.objects.exists() for m in (Supplier, ImportReceipt, ExportReceipt, PurchaseOrder)):
+            raise CommandError("CSDL đã có dữ liệu kho – hãy chạy trên CSDL trống (VD: manage.py flush).")
+        try:
+            self.end = date.fromisoformat(options["end_date"]) if options["end_date"] else date.today()
+        except ValueError:
+            raise CommandError("Ngày không hợp lệ, định dạng đúng: YYYY-MM-DD")
+
+        self.options = options
+        self.rng = random.Random(options["seed"])
+        self.codes = CodeAllocator()
+        self.start = self.end - timedelta(days=options["days"])
+        self.counts = {}
+        self.next_id = {}
+        started = time.perf_counter()
+
+        with transaction.atomic():
+            self.create_catalog()
+        self.stdout.write(f"Danh mục: {len(self.categories)} · NCC: {len(self.suppliers)} · "
+                          f"sản phẩm: {sum(len(p) for p in self.catalog.values())}")
+
+        total_lots = options["lots"]
+        chunk = options["chunk_size"]
+        # ngày nhập tăng dần theo đợt -> dữ liệu trải đều khoảng --days
+        for offset in range(0, total_lots, chunk):
+            n = min(chunk, total_lots - offset)
+            with transaction.atomic():
+                self.create_chunk(offset, n, total_lots)
+            self.stdout.write(f"  {offset + n:,}/{total_lots:,} lô ({time.perf_counter() - started:.0f}s)")
+
+        with transaction.atomic():
+            self.reset_sequences()
+            self.codes.save()
+            DailySummary.rebuild()
+            invalidate_dashboard()
+
+        if not options["skip_search_index"]:
+            entries = rebuild_index(chunk_size=chunk)
+            self.counts["SearchIndexEntry"] = entries
+
+        for name, count in self.counts.items():
+            self.stdout.write(f"{name}: {count:,}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Đã sinh {sum(self.counts.values()):,} dòng trong {time.perf_counter() - started:.1f}s."
+        ))
+
+    # ---------- tiện ích ----------
+    def bulk(self, objects):
+        """
+        Ghi danh sách object cùng model bằng executemany theo lô --chunk-size.
+        pk tự tăng được cấp sẵn trong Python (CSDL trống) nên bảng sau dùng
+        được ngay; nhanh hơn bulk_create nhiều lần vì không dựng câu SQL cho
+        từng dòng. Không chạy save() / signal – giống bulk_create.
+        """
+        if not objects:
+            return objects
+        model = type(objects[0])
+        meta = model._meta
+        fields = meta.concrete_fields
+        auto_pk = meta.pk if isinstance(meta.pk, models.AutoField) else None
+        relations = [f for f in fields if f.is_relation]
+        db = connections[DEFAULT_DB_ALIAS]    # bỏ qua proxy `connection` (tra thread-local mỗi lần)
+
+        if auto_pk is not None and model not in self.next_id:
+            self.next_id[model] = (model.objects.aggregate(last=models.Max("pk"))["last"] or 0) + 1
+        rows = []
+        for obj in objects:
+            if auto_pk is not None:
+                obj.pk = self.next_id[model]
+                self.next_id[model] += 1
+            for field in relations:
+                # FK gán bằng object (chưa có pk lúc dựng) -> lấy pk bây giờ
+                if getattr(obj, field.attname) is None and field.is_cached(obj):
+                    related = getattr(obj, field.name)
+                    if related is not None:
+                        setattr(obj, field.name, related)   # giữ cache, tránh query lại
+            rows.append(tuple(
+                field.get_db_prep_save(self.field_value(obj, field), db) for field in fields
+            ))
+
+        table = db.ops.quote_name(meta.db_table)
+        columns = ", ".join(db.ops.quote_name(f.column) for f in fields)
+        sql = f"INSERT INTO {table} ({columns}) VALUES ({', '.join(['%s'] * len(fields))})"
+        size = self.options["chunk_size"]
+        with db.cursor() as cursor:
+            for start in range(0, len(rows), size):
+                cursor.executemany(sql, rows[start:start + size])
+
+        self.counts[model.__name__] = self.counts.get(model.__name__, 0) + len(objects)
+        return objects
+
+    @staticmethod
+    def field_value(obj, field):
+        # auto_now_add (created_date của PO / ASN) giữ ngày giả lập nếu đã đặt
+        if getattr(field, "auto_now_add", False) and getattr(obj, field.attname) is not None:
+            return getattr(obj, field.attname)
+        return field.pre_save(obj, add=True)
+
+    def reset_sequences(self):
+        # CSDL có sequence riêng (PostgreSQL...) phải đặt lại sau khi ghi pk tường minh
+        statements = connection.ops.sequence_reset_sql(no_style(), list(self.next_id))
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+    def day_between(self, first, last):
+        if last <= first:
+            return first
+        return first + timedelta(days=self.rng.randint(0, (last - first).days))
+
+    @staticmethod
+    def money(value):
+        # làm tròn 100đ như giá thực tế
+        return Decimal(int(value) // 100 * 100)
+
+    @staticmethod
+    def with_search_text(objects):
+        for obj in objects:
+            obj.search_text = obj.build_search_text()
+        return objects
+
+    # ---------- danh mục / NCC / sản phẩm ----------
+    def create_catalog(self):
+        rng = self.rng
+        self.categories = self.bulk(self.with_search_text([
+            Category(category_code=f"DM{n:02d}", name=name, description=desc)
+            for n, (name, desc) in enumerate(CATEGORIES, start=1)
+        ]))
+
+        supplier_count = self.options["suppliers"] or max(5, min(500, self.options["lots"] // 2000))
+        self.suppliers = self.bulk(self.with_search_text([
+            Supplier(
+                supplier_code=f"NCC{n:04d}",
+                company_name=f"Công ty TNHH {rng.choice(COMPANY_WORDS)} {n}",
+                contact_name=rng.choice(PEOPLE),
+                phone=f"09{rng.randint(0, 99_999_999):08d}",
+                tax_code=f"{rng.randint(0, 9_999_999_999):010d}",
+                email=f"ncc{n:04d}@example.com",
+                address=f"{rng.randint(1, 300)} đường số {rng.randint(1, 40)}, {rng.choice(CITIES)}",
+            )
+            for n in range(1, supplier_count + 1)
+        ]))
+
+        products, sku = [], 0
+        self.units = {}
+        for supplier in self.suppliers:
+            for _ in range(self.options["products_per_supplier"]):
+                sku += 1
+                category, kinds, sizes, unit = rng.choice(PRODUCT_KINDS)
+                product = SupplierProduct(
+                    supplier=supplier,
+                    product_code=f"SP{sku:05d}",
+                    name=f"{rng.choice(kinds)} {rng.choice(BRANDS)} {rng.choice(sizes)}",
+                    category=self.categories[category],
+                    unit_price=self.money(rng.randint(50, 5000) * 100),
+                )
+                products.append(product)
+                self.units[product.product_code] = unit
+        self.bulk(self.with_search_text(products))
+
+        self.catalog = {}
+        for product in products:
+            self.catalog.setdefault(product.supplier_id, []).append(product)
+
+    # ---------- 1 đợt: phiếu nhập (+ PO / ASN), lô, xuất, hoàn ----------
+    def create_chunk(self, offset, n, total):
+        rng, opts = self.rng, self.options
+        span = (self.end - self.start).days
+        first_day = self.start + timedelta(days=span * offset // total)
+        last_day = self.start + timedelta(days=span * (offset + n) // total)
+
+        receipts, import_items, lots, pos, po_items, asns, asn_items = [], [], [], [], [], [], []
+        remaining = n
+        while remaining > 0:
+            supplier = rng.choice(self.suppliers)
+            catalog = self.catalog[supplier.pk]
+            size = min(remaining, len(catalog), max(1, rng.randint(1, 2 * opts["lines_per_receipt"] - 1)))
+            remaining -= size
+            day = self.day_between(first_day, last_day)
+
+            receipt = ImportReceipt(
+                import_code=self.codes.next("PN", day), supplier=supplier, import_date=day,
+                note=rng.choice(IMPORT_NOTES),
+            )
+            asn = None
+            if rng.random() < opts["asn_ratio"]:
+                po_day = max(self.start, day - timedelta(days=rng.randint(3, 10)))
+                po = PurchaseOrder(po_code=self.codes.next("PO", po_day), supplier=supplier,
+                                   created_date=po_day, status="closed")
+                asn = ASN(
+                    asn_code=self.codes.next("ASN", po_day), po=po, supplier=supplier,
+                    deliverer_name=rng.choice(PEOPLE), deliverer_phone=f"09{rng.randint(0, 99_999_999):08d}",
+                    expected_date=day, created_date=po_day, status="delivered",
+                )
+                receipt.asn = asn
+                pos.append(po)
+                asns.append(asn)
+            receipts.append(receipt)
+
+            for product in rng.sample(catalog, size):
+                unit = self.units[product.product_code]
+                quantity = rng.randint(10, 200)
+                price = self.money(product.unit_price * Decimal(rng.uniform(0.9, 1.1)))
+                expiry = day + timedelta(days=rng.randint(20, 540))
+                location = rng.choice(LOCATIONS)
+                discount = Decimal(rng.choice((0, 0, 0, 2, 5)))
+                item = ImportItem(import_receipt=receipt, product=product, quantity=quantity,
+                                  unit_price=price, discount_percent=discount, unit=unit,
+                                  location=location, expiry_date=expiry)
+                if asn is not None:
+                    po_item = PurchaseOrderItem(po=asn.po, product=product, quantity=quantity,
+                                                unit=unit, unit_price=price, total=price * quantity)
+                    item.asn_item = ASNItem(asn=asn, product=product, quantity=quantity,
+                                            unit=unit, unit_price=price, expiry_date=expiry)
+                    po_items.append(po_item)
+                    asn_items.append(item.asn_item)
+                lot = StockItem(source_type="import", import_receipt=receipt, product=product,
+                                quantity=quantity, unit=unit, location=location,
+                                expiry_date=expiry, unit_price=price)
+                lot.imported = quantity
+                import_items.append(item)
+                lots.append(lot)
+
+        # PO / ASN còn mở (chưa giao) ở cuối khoảng thời gian
+        if last_day >= self.end - timedelta(days=14):
+            for supplier in rng.sample(self.suppliers, min(3, len(self.suppliers))):
+                day = self.day_between(self.end - timedelta(days=14), self.end)
+                po = PurchaseOrder(po_code=self.codes.next("PO", day), supplier=supplier,
+                                   created_date=day, status=rng.choice(("pending", "approved")))
+                pos.append(po)
+                for product in rng.sample(self.catalog[supplier.pk], min(3, len(self.catalog[supplier.pk]))):
+                    unit = self.units[product.product_code]
+                    quantity = rng.randint(10, 100)
+                    po_items.append(PurchaseOrderItem(po=po, product=product, quantity=quantity,
+                                                      unit=unit, unit_price=product.unit_price,
+                                                      total=product.unit_price * quantity))
+
+        exports, export_items = self.plan_exports(lots)
+        returns, return_items, return_lots = self.plan_returns(exports, export_items)
+
+        # ===== TỔNG PHIẾU (tính sẵn, không UPDATE lại) =====
+        for receipt in receipts:
+            receipt.total_quantity, receipt.total_price = 0, Decimal(0)
+        for item in import_items:
+            base = item.quantity * item.unit_price
+            item.import_receipt.total_quantity += item.quantity
+            item.import_receipt.total_price += base - base * item.discount_percent / 100
+        for po in pos:
+            po.total_quantity, po.total_amount = 0, Decimal(0)
+        for item in po_items:
+            item.po.total_quantity += item.quantity
+            item.po.total_amount += item.total
+
+        for lot in lots + return_lots:
+            lot.update_status()
+        for lot in lots:
+            lot.update_sort_date()
+
+        # ===== GHI (thứ tự theo khoá ngoại) =====
+        self.bulk(self.with_search_text(pos))
+        self.bulk(po_items)
+        self.bulk(self.with_search_text(asns))
+        self.bulk(asn_items)
+        self.bulk(self.with_search_text(receipts))
+        self.bulk(import_items)
+        self.bulk(lots)
+        self.bulk(self.with_search_text(exports))
+        self.bulk(export_items)
+        self.bulk(self.with_search_text(returns))
+        self.bulk(return_lots)
+        self.bulk(return_items)
+
+        # ===== SỔ KHO: SL lô = tổng biến động =====
+        movements = []
+        for lot in lots:
+            movements.append(StockMovement.build(lot, lot.imported, "import",
+                                                 lot.import_receipt.pk, lot.import_receipt.import_date))
+        for item in export_items:
+            movements.append(StockMovement.build(item.stock_item, -item.quantity, "export",
+                                                 item.receipt.pk, item.receipt.export_date))
+        for lot in return_lots:
+            movements.append(StockMovement.build(lot, lot.quantity, "return",
+                                                 lot.return_receipt.pk, lot.return_receipt.return_date))
+        self.bulk(movements)
+
+    def plan_exports(self, lots):
+        # Xuất từ các lô của đợt này, sau ngày nhập; SL lô giảm tương ứng
+        rng, opts = self.rng, self.options
+        candidates = [lot for lot in lots if rng.random() < opts["export_ratio"]]
+        rng.shuffle(candidates)
+
+        exports, items = [], []
+        while candidates:
+            size = rng.randint(1, 6)
+            picked, candidates = candidates[:size], candidates[size:]
+            day = self.day_between(max(l.import_receipt.import_date for l in picked),
+                                   min(self.end, max(l.import_receipt.import_date for l in picked)
+                                       + timedelta(days=60)))
+            receipt = ExportReceipt(
+                export_code=self.codes.next("XK", day), export_date=day,
+                destination=rng.choice(STORES), receiver_name=rng.choice(PEOPLE),
+                receiver_phone=f"09{rng.randint(0, 99_999_999):08d}",
+                total_quantity=0, total_price=Decimal(0), total_discount=Decimal(0),
+            )
+            exports.append(receipt)
+            for lot in picked:
+                quantity = rng.randint(1, lot.quantity)
+                lot.quantity -= quantity
+                price = self.money(lot.unit_price * Decimal("1.25"))
+                discount = Decimal(rng.choice((0, 0, 0, 5, 10)))
+                base = quantity * price
+                item = ExportItem(receipt=receipt, stock_item=lot, quantity=quantity, unit_price=price,
+                                  discount_percent=discount, unit=lot.unit,
+                                  total=base - base * discount / 100)
+                receipt.total_quantity += quantity
+                receipt.total_price += item.total
+                receipt.total_discount += base * discount / 100
+                items.append(item)
+        return exports, items
+
+    def plan_returns(self, exports, export_items):
+        # Hoàn 1 phần dòng xuất: mỗi dòng hoàn tạo lô hoàn mới (giống ReturnItem.bulk_return)
+        rng = self.rng
+        by_receipt = {}
+        for item in export_items:
+            by_receipt.setdefault(id(item.receipt), []).append(item)
+
+        returns, items, lots = [], [], []
+        for export in exports:
+            if rng.random() >= self.options["return_ratio"]:
+                continue
+            day = self.day_between(export.export_date, min(self.end, export.export_date + timedelta(days=10)))
+            receipt = ReturnReceipt(return_code=self.codes.next("HH", day), return_date=day,
+                                    export_receipt=export, note=rng.choice(RETURN_REASONS),
+                                    total_quantity=0, total_price=Decimal(0))
+            returns.append(receipt)
+            lines = by_receipt[id(export)]
+            for export_item in rng.sample(lines, min(len(lines), rng.randint(1, 2))):
+                source = export_item.stock_item
+                quantity = rng.randint(1, export_item.quantity)
+                lot = StockItem(source_type="return", return_receipt=receipt, product=source.product,
+                                quantity=quantity, unit=export_item.unit, location=source.location,
+                                expiry_date=source.expiry_date, unit_price=export_item.unit_price)
+                item = ReturnItem(receipt=receipt, export_item=export_item, product=source.product,
+                                  quantity=quantity, unit=export_item.unit, unit_price=export_item.unit_price,
+                                  location=source.location, expiry_date=source.expiry_date,
+                                  reason=rng.choice(RETURN_REASONS), stock_item=lot,
+                                  total=quantity * export_item.unit_price)
+                receipt.total_quantity += quantity
+                receipt.total_price += item.total
+                lots.append(lot)
+                items.append(item)
+        return returns, items, lots
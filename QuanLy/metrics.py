@@ -0,0 +1,342 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+
+
+# ===================== SỐ LIỆU PROMETHEUS (/metrics) =====================
+# Mỗi tiến trình (worker gunicorn) ghi số liệu của mình vào 1 file mmap riêng
+# METRICS_DIR/quanly_<pid>.db: cộng dồn tại chỗ, không khoá giữa các tiến
+# trình (mỗi file chỉ 1 tiến trình ghi), trong tiến trình chỉ 1 khoá nhỏ cho
+# các luồng. /metrics đọc mọi file trong thư mục và cộng lại -> số liệu của
+# toàn bộ worker, kể cả worker đã khởi động lại (counter không bị tụt).
+# Xoá METRICS_DIR mỗi lần triển khai / khởi động lại server.
+#
+# Định dạng file: 8 byte đầu = số byte đã dùng, sau đó lần lượt
+# [độ dài khoá: uint32][khoá utf-8, đệm cho tròn 8 byte][giá trị: double].
+
+_HEADER = struct.Struct("i4x")
+_KEY_LENGTH = struct.Struct("i")
+_VALUE = struct.Struct("d")
+_INITIAL_SIZE = 64 * 1024
+
+
+class MmapedValues:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._positions = {}
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._file = os.fdopen(fd, "r+b")
+        if os.fstat(fd).st_size == 0:
+            self._file.truncate(_INITIAL_SIZE)
+        self._capacity = os.fstat(fd).st_size
+        self._map = mmap.mmap(fd, self._capacity)
+        self._used = _HEADER.unpack_from(self._map, 0)[0] or _HEADER.size
+        _HEADER.pack_into(self._map, 0, self._used)
+        for key, _, position in _read_entries(self._map, self._used):
+            self._positions[key] = position
+
+    def _add_key(self, key):
+        encoded = key.encode("utf-8")
+        padded = encoded + b" " * (8 - (len(encoded) + _KEY_LENGTH.size) % 8)
+        entry = _KEY_LENGTH.pack(len(encoded)) + padded + _VALUE.pack(0.0)
+        while self._used + len(entry) > self._capacity:
+            self._capacity *= 2
+            self._file.truncate(self._capacity)
+            self._map.close()
+            self._map = mmap.mmap(self._file.fileno(), self._capacity)
+        self._map[self._used:self._used + len(entry)] = entry
+        position = self._used + len(entry) - _VALUE.size
+        self._used += len(entry)
+        _HEADER.pack_into(self._map, 0, self._used)
+        self._positions[key] = position
+        return position
+
+    def inc(self, items):
+        """items: [(khoá, lượng cộng thêm)] – ghi cả loạt trong 1 lần giữ khoá."""
+        with self._lock:
+            for key, amount in items:
+                position = self._positions.get(key)
+                if position is None:
+                    position = self._add_key(key)
+                value = _VALUE.unpack_from(self._map, position)[0]
+                _VALUE.pack_into(self._map, position, value + amount)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+def _read_entries(data, used):
+    position = _HEADER.size
+    while position < used:
+        length = _KEY_LENGTH.unpack_from(data, position)[0]
+        key_end = position + _KEY_LENGTH.size + length
+        key = bytes(data[position + _KEY_LENGTH.size:key_end]).decode("utf-8")
+        position = key_end + (8 - (length + _KEY_LENGTH.size) % 8)
+        yield key, _VALUE.unpack_from(data, position)[0], position
+        position += _VALUE.size
+
+
+def read_file(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < _HEADER.size:
+        return []
+    used = min(_HEADER.unpack_from(data, 0)[0], len(data))
+    return [(key, value) for key, value, _ in _read_entries(data, used)]
+
+
+# ---------- file của tiến trình hiện tại ----------
+_values = None
+_values_pid = None
+_values_lock = threading.Lock()
+
+
+def metrics_dir():
+    return Path(getattr(settings, "METRICS_DIR", Path(settings.BASE_DIR) / "metrics"))
+
+
+def _process_values():
+    # gunicorn fork worker sau khi nạp app -> mở file theo pid lúc ghi, không lúc import
+    global _values, _values_pid
+    pid = os.getpid()
+    if _values_pid != pid:
+        with _values_lock:
+            if _values_pid != pid:
+                directory = metrics_dir()
+                directory.mkdir(parents=True, exist_ok=True)
+                _values = MmapedValues(str(directory / f"quanly_{pid}.db"))
+                _values_pid = pid
+    return _values
+
+
+def clear_metrics():
+    """Xoá số liệu của mọi tiến trình (khởi động lại server, test)."""
+    global _values, _values_pid
+    with _values_lock:
+        if _values is not None:
+            _values.close()
+        _values, _values_pid = None, None
+        for path in metrics_dir().glob("quanly_*.db"):
+            path.unlink()
+
+
+def _key(name, labels):
+    return json.dumps([name, sorted(labels.items())], ensure_ascii=False)
+
+
+# ---------- loại số liệu ----------
+REGISTRY = []
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY.append(self)
+
+    def _labels(self, labels):
+        return {name: str(labels[name]) for name in self.labelnames}
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        _process_values().inc([(_key(self.name, self._labels(labels)), amount)])
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        self.observe_many([value], **labels)
+
+    def observe_many(self, values, **labels):
+        """Nhiều giá trị cùng nhãn (vd. mọi câu SQL của 1 request) – 1 lần ghi."""
+        if not values:
+            return
+        labels = self._labels(labels)
+        counts = [0] * (len(self.buckets) + 1)
+        for value in values:
+            counts[bisect_left(self.buckets, value)] += 1
+        items = [
+            (_key(f"{self.name}_bucket", {**labels, "le": _le(bound)}), n)
+            for bound, n in zip(self.buckets, counts) if n
+        ]
+        items += [
+            (_key(f"{self.name}_bucket", {**labels, "le": "+Inf"}), len(values)),
+            (_key(f"{self.name}_count", labels), len(values)),
+            (_key(f"{self.name}_sum", labels), sum(values)),
+        ]
+        _process_values().inc(items)
+
+
+def _le(bound):
+    return repr(float(bound))
+
+
+# ---------- số liệu của kho ----------
+HTTP_REQUEST_DURATION = Histogram(
+    "quanly_http_request_duration_seconds", "Thời gian xử lý request theo tên URL.",
+    ("view",), buckets=(0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+HTTP_REQUESTS = Counter(
+    "quanly_http_requests_total", "Số request theo tên URL, phương thức và mã trạng thái.",
+    ("view", "method", "status"),
+)
+SQL_QUERIES = Counter(
+    "quanly_sql_queries_total", "Số câu SQL theo tên URL.", ("view",),
+)
+SQL_QUERY_DURATION = Histogram(
+    "quanly_sql_query_duration_seconds", "Thời gian từng câu SQL theo tên URL.",
+    ("view",), buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+EXTERNAL_CALL_DURATION = Histogram(
+    "quanly_external_call_duration_seconds", "Thời gian gọi ra ngoài (pdfkit render PDF, SMTP).",
+    ("call",), buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+RECEIPTS_CREATED = Counter(
+    "quanly_receipts_created_total", "Số chứng từ đã tạo theo loại.", ("type",),
+)
+RECEIPT_LINES = Histogram(
+    "quanly_receipt_lines", "Số dòng hàng trên mỗi chứng từ mới.",
+    ("type",), buckets=(1, 2, 5, 10, 20, 50, 100, 200),
+)
+STOCK_MOVEMENTS = Counter(
+    "quanly_stock_movements_total", "Số dòng sổ kho theo loại và chiều (in = tăng tồn, out = giảm tồn).",
+    ("type", "direction"),
+)
+STOCK_UNITS = Counter(
+    "quanly_stock_units_total", "Số lượng hàng tăng / giảm tồn theo loại sổ kho.",
+    ("type", "direction"),
+)
+
+
+# ---------- ghi nhận nghiệp vụ (sau khi transaction commit) ----------
+def count_receipt(receipt_type, lines):
+    # phiếu bị rollback không được tính
+    def inc():
+        RECEIPTS_CREATED.inc(type=receipt_type)
+        RECEIPT_LINES.observe(lines, type=receipt_type)
+    transaction.on_commit(inc)
+
+
+def count_stock_movements(movements):
+    totals = {}
+    for movement in movements:
+        if not movement.quantity:
+            continue
+        direction = "in" if movement.quantity > 0 else "out"
+        count, units = totals.get((movement.movement_type, direction), (0, 0))
+        totals[(movement.movement_type, direction)] = (count + 1, units + abs(movement.quantity))
+    if not totals:
+        return
+
+    def inc():
+        for (movement_type, direction), (count, units) in totals.items():
+            STOCK_MOVEMENTS.inc(count, type=movement_type, direction=direction)
+            STOCK_UNITS.inc(units, type=movement_type, direction=direction)
+    transaction.on_commit(inc)
+
+
+# ---------- xuất định dạng text của Prometheus ----------
+def collect():
+    """{tên mẫu: {nhãn (tuple đã sắp xếp): giá trị}} cộng từ file của mọi tiến trình."""
+    samples = {}
+    for path in sorted(metrics_dir().glob("quanly_*.db")):
+        for key, value in read_file(path):
+            name, labels = json.loads(key)
+            series = samples.setdefault(name, {})
+            labels = tuple(tuple(pair) for pair in labels)
+            series[labels] = series.get(labels, 0.0) + value
+    return samples
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"'))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value):
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+def render_metrics():
+    samples = collect()
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        if metric.kind == "histogram":
+            # bucket trong file là số đếm riêng từng khoảng (chỉ khoảng có giá trị)
+            # -> Prometheus cần đủ mọi mốc le, cộng dồn
+            buckets = samples.get(f"{metric.name}_bucket", {})
+            for base in sorted(samples.get(f"{metric.name}_count", {})):
+                running = 0.0
+                for le in [_le(bound) for bound in metric.buckets] + ["+Inf"]:
+                    labels = tuple(sorted(base + (("le", le),)))
+                    if le == "+Inf":
+                        running = buckets.get(labels, 0.0)
+                    else:
+                        running += buckets.get(labels, 0.0)
+                    lines.append(f"{metric.name}_bucket{_format_labels(labels)} {_format_value(running)}")
+            names = (f"{metric.name}_count", f"{metric.name}_sum")
+        else:
+            names = (metric.name,)
+        for name in names:
+            for labels, value in sorted(samples.get(name, {}).items()):
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# ---------- middleware ----------
+class MetricsMiddleware:
+    # Đứng ngoài cùng: thời gian câu SQL lấy từ RequestTimings mà
+    # RequestTimingMiddleware đã gom (1 execute_wrapper cho cả request),
+    # ghi 1 lần cuối request
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # performance.py import metrics.py -> import lúc chạy, không lúc nạp module
+        from .performance import request_timings
+
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            elapsed = time.perf_counter() - started
+            match = getattr(request, "resolver_match", None)
+            # theo tên URL, không theo đường dẫn -> số chuỗi số liệu không tăng theo dữ liệu
+            view = (match.view_name if match else None) or "unmatched"
+            HTTP_REQUEST_DURATION.observe(elapsed, view=view)
+            HTTP_REQUESTS.inc(view=view, method=request.method, status=status)
+            timings = request_timings(request)
+            if timings is not None and timings.sql_durations:
+                SQL_QUERIES.inc(len(timings.sql_durations), view=view)
+                SQL_QUERY_DURATION.observe_many(timings.sql_durations, view=view)
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.30 on 2026-10-17 07:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('QuanLy', '0012_purchaseorder_unit_price_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockStatusRefresh',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('run_date', models.DateField(unique=True, verbose_name='Ngày chạy')),
+                ('expired_count', models.PositiveIntegerField(default=0, verbose_name='Số lô chuyển hết hạn')),
+                ('nearly_expired_count', models.PositiveIntegerField(default=0, verbose_name='Số lô chuyển cận hạn')),
+                ('valid_count', models.PositiveIntegerField(default=0, verbose_name='Số lô chuyển còn hạn')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Lần cập nhật hạn dùng',
+                'verbose_name_plural': 'Lịch sử cập nhật hạn dùng',
+                'ordering': ['-run_date'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='name',
+            field=models.CharField(max_length=100, unique=True, verbose_name='Tên danh mục'),
+        ),
+        migrations.AlterField(
+            model_name='supplier',
+            name='phone',
+            field=models.CharField(blank=True, max_length=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='supplier',
+            name='tax_code',
+            field=models.CharField(blank=True, max_length=13, null=True),
+        ),
+    ]
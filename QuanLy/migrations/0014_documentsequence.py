@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-17 07:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('QuanLy', '0013_stockstatusrefresh'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prefix', models.CharField(max_length=10, verbose_name='Tiền tố')),
+                ('period', models.CharField(blank=True, default='', max_length=10, verbose_name='Kỳ đánh số')),
+                ('last_value', models.PositiveBigIntegerField(default=0, verbose_name='Số đã cấp gần nhất')),
+            ],
+            options={
+                'verbose_name': 'Bộ đếm mã chứng từ',
+                'verbose_name_plural': 'Bộ đếm mã chứng từ',
+                'unique_together': {('prefix', 'period')},
+            },
+        ),
+    ]
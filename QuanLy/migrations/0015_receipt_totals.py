@@ -0,0 +1,111 @@
+# Generated by Django 4.2.30 on 2026-10-17 07:42
+
+from django.db import migrations, models
+from django.db.models import ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def _line_total(discount):
+    base = F("quantity") * F("unit_price")
+    if discount:
+        base = base - base * F("discount_percent") / 100
+    return ExpressionWrapper(base, output_field=models.DecimalField(max_digits=20, decimal_places=2))
+
+
+def _line_discount():
+    return ExpressionWrapper(
+        F("quantity") * F("unit_price") * F("discount_percent") / 100,
+        output_field=models.DecimalField(max_digits=20, decimal_places=2),
+    )
+
+
+def backfill_totals(apps, schema_editor):
+    # receipt model, item model, FK trên item, {cột tổng: aggregate}
+    specs = [
+        ("ImportReceipt", "ImportItem", "import_receipt", {
+            "total_quantity": lambda: Sum("quantity"),
+            "total_price": lambda: Sum(_line_total(True)),
+        }),
+        ("ExportReceipt", "ExportItem", "receipt", {
+            "total_quantity": lambda: Sum("quantity"),
+            "total_price": lambda: Sum("total"),
+            "total_discount": lambda: Sum(_line_discount()),
+        }),
+        ("ReturnReceipt", "ReturnItem", "receipt", {
+            "total_quantity": lambda: Sum("quantity"),
+            "total_price": lambda: Sum("total"),
+        }),
+        ("PurchaseOrder", "PurchaseOrderItem", "po", {
+            "total_quantity": lambda: Sum("quantity"),
+            "total_amount": lambda: Sum("total"),
+        }),
+    ]
+
+    for receipt_name, item_name, fk, columns in specs:
+        Receipt = apps.get_model("QuanLy", receipt_name)
+        Item = apps.get_model("QuanLy", item_name)
+        updates = {}
+        for column, expr in columns.items():
+            per_receipt = Item.objects.filter(**{fk: OuterRef("pk")}) \
+                                      .values(fk).annotate(value=expr()).values("value")
+            updates[column] = Coalesce(
+                Subquery(per_receipt), Value(0),
+                output_field=Receipt._meta.get_field(column).clone(),
+            )
+        Receipt.objects.update(**updates)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('QuanLy', '0014_documentsequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportreceipt',
+            name='total_discount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=20, verbose_name='Tổng chiết khấu'),
+        ),
+        migrations.AddField(
+            model_name='exportreceipt',
+            name='total_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=20, verbose_name='Tổng tiền'),
+        ),
+        migrations.AddField(
+            model_name='exportreceipt',
+            name='total_quantity',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Tổng số lượng'),
+        ),
+        migrations.AddField(
+            model_name='importreceipt',
+            name='total_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=20, verbose_name='Tổng tiền'),
+        ),
+        migrations.AddField(
+            model_name='importreceipt',
+            name='total_quantity',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Tổng số lượng'),
+        ),
+        migrations.AddField(
+            model_name='purchaseorder',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=20, verbose_name='Tổng tiền'),
+        ),
+        migrations.AddField(
+            model_name='purchaseorder',
+            name='total_quantity',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Tổng số lượng'),
+        ),
+        migrations.AddField(
+            model_name='returnreceipt',
+            name='total_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=20, verbose_name='Tổng tiền'),
+        ),
+        migrations.AddField(
+            model_name='returnreceipt',
+            name='total_quantity',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Tổng số lượng'),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
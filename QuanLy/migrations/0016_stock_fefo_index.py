@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-17 07:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('QuanLy', '0015_receipt_totals'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stockitem',
+            index=models.Index(condition=models.Q(('quantity__gt', 0)), fields=['product', 'expiry_date', 'id'], name='stock_fefo_idx'),
+        ),
+    ]
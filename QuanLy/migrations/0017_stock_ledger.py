@@ -0,0 +1,78 @@
+# Generated by Django 4.2.30 on 2026-10-17 07:59
+
+import datetime
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def seed_opening_balances(apps, schema_editor):
+    # Sổ kho bắt đầu từ hôm nay: mỗi lô còn hàng có 1 dòng "tồn đầu kỳ"
+    StockItem = apps.get_model("QuanLy", "StockItem")
+    StockMovement = apps.get_model("QuanLy", "StockMovement")
+
+    today = datetime.date.today()
+    lots = StockItem.objects.filter(quantity__gt=0).values_list("id", "product_id", "quantity")
+    StockMovement.objects.bulk_create([
+        StockMovement(stock_item_id=lot_id, product_id=product_id, quantity=qty,
+                      movement_type="opening", movement_date=today)
+        for lot_id, product_id, qty in lots.iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('QuanLy', '0016_stock_fefo_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checkpoint_date', models.DateField(unique=True, verbose_name='Ngày chốt')),
+                ('movement_count', models.PositiveIntegerField(default=0, verbose_name='Số dòng sổ từ mốc trước')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Mốc chốt sổ kho',
+                'verbose_name_plural': 'Mốc chốt sổ kho',
+                'ordering': ['-checkpoint_date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('movement_type', models.CharField(choices=[('opening', 'Tồn đầu kỳ'), ('import', 'Nhập kho'), ('export', 'Xuất kho'), ('return', 'Hoàn hàng')], max_length=20, verbose_name='Loại')),
+                ('quantity', models.IntegerField(verbose_name='Số lượng (+/-)')),
+                ('movement_date', models.DateField(default=datetime.date.today, verbose_name='Ngày')),
+                ('reference', models.CharField(blank=True, default='', max_length=30, verbose_name='Chứng từ')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='stock_movements', to='QuanLy.supplierproduct', verbose_name='Sản phẩm NCC')),
+                ('stock_item', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='movements', to='QuanLy.stockitem', verbose_name='Lô hàng')),
+            ],
+            options={
+                'verbose_name': 'Dòng sổ kho',
+                'verbose_name_plural': 'Sổ kho',
+                'ordering': ['-movement_date', '-id'],
+                'indexes': [models.Index(fields=['stock_item', 'movement_date'], name='movement_lot_date_idx'), models.Index(fields=['product', 'movement_date'], name='movement_product_date_idx'), models.Index(fields=['movement_date'], name='movement_date_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockCheckpointLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('checkpoint', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='QuanLy.stockcheckpoint')),
+                ('product', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='QuanLy.supplierproduct')),
+                ('stock_item', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='QuanLy.stockitem')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['checkpoint', 'product'], name='checkpoint_product_idx')],
+                'unique_together': {('checkpoint', 'stock_item')},
+            },
+        ),
+        migrations.RunPython(seed_opening_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 4.2.30 on 2026-10-17 08:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('QuanLy', '0017_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='asn',
+            index=models.Index(fields=['expected_date'], name='asn_expected_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='asn',
+            index=models.Index(fields=['status', 'expected_date'], name='asn_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='asn',
+            index=models.Index(fields=['supplier', 'expected_date'], name='asn_supplier_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exportreceipt',
+            index=models.Index(fields=['export_date'], name='export_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='importreceipt',
+            index=models.Index(fields=['import_date'], name='import_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='importreceipt',
+            index=models.Index(fields=['supplier', 'import_date'], name='import_supplier_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchaseorder',
+            index=models.Index(fields=['created_date'], name='po_created_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchaseorder',
+            index=models.Index(fields=['status', 'created_date'], name='po_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchaseorder',
+            index=models.Index(fields=['supplier', 'created_date'], name='po_supplier_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='returnreceipt',
+            index=models.Index(fields=['return_date'], name='return_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockitem',
+            index=models.Index(condition=models.Q(('quantity__gt', 0)), fields=['expiry_date', 'id'], name='stock_active_expiry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockitem',
+            index=models.Index(fields=['status', 'expiry_date'], name='stock_status_expiry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockitem',
+            index=models.Index(fields=['location'], name='stock_location_idx'),
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 4.2.30 on 2026-10-17 08:03
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import ExpressionWrapper, F, Sum
+import django.db.models.deletion
+
+
+def _money(expr):
+    return ExpressionWrapper(expr, output_field=models.DecimalField(max_digits=20, decimal_places=2))
+
+
+def backfill_daily_summary(apps, schema_editor):
+    # Tổng hợp (ngày, sản phẩm) từ toàn bộ dòng phiếu hiện có
+    base = F("quantity") * F("unit_price")
+    discount = base * F("discount_percent") / 100
+    sources = [
+        ("ImportItem", "import_receipt__import_date", "product_id", {
+            "import_quantity": Sum("quantity"),
+            "import_value": Sum(_money(base - discount)),
+            "import_discount": Sum(_money(discount)),
+        }),
+        ("ExportItem", "receipt__export_date", "stock_item__product_id", {
+            "export_quantity": Sum("quantity"),
+            "export_value": Sum("total"),
+            "export_discount": Sum(_money(discount)),
+        }),
+        ("ReturnItem", "receipt__return_date", "product_id", {
+            "return_quantity": Sum("quantity"),
+            "return_value": Sum("total"),
+        }),
+    ]
+
+    rows = defaultdict(dict)
+    for model_name, date_field, product_field, measures in sources:
+        grouped = apps.get_model("QuanLy", model_name).objects \
+            .filter(**{f"{date_field}__isnull": False}) \
+            .values(date_field, product_field).annotate(**measures).order_by()
+        for row in grouped:
+            rows[(row[date_field], row[product_field])].update({n: row[n] or 0 for n in measures})
+
+    SupplierProduct = apps.get_model("QuanLy", "SupplierProduct")
+    DailySummary = apps.get_model("QuanLy", "DailySummary")
+    categories = dict(SupplierProduct.objects.values_list("pk", "category_id"))
+    DailySummary.objects.bulk_create([
+        DailySummary(day=day, product_id=product_id, category_id=categories.get(product_id), **measures)
+        for (day, product_id), measures in rows.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('QuanLy', '0018_list_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='Ngày')),
+                ('import_quantity', models.PositiveIntegerField(default=0, verbose_name='SL nhập')),
+                ('import_value', models.DecimalField(decimal_places=2, default=0, max_digits=20, verbose_name='Giá trị nhập')),
+                ('import_discount', models.DecimalField(decimal_places=2, default=0, max_digits=20, verbose_name='CK nhập')),
+                ('export_quantity', models.PositiveIntegerField(default=0, verbose_name='SL xuất')),
+                ('export_value', models.DecimalField(decimal_places=2, default=0, max_digits=20, verbose_name='Giá trị xuất')),
+                ('export_discount', models.DecimalField(decimal_places=2, default=0, max_digits=20, verbose_name='CK xuất')),
+                ('return_quantity', models.PositiveIntegerField(default=0, verbose_name='SL hoàn')),
+                ('return_value', models.DecimalField(decimal_places=2, default=0, max_digits=20, verbose_name='Giá trị hoàn')),
+                ('category', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='QuanLy.category', verbose_name='Danh mục')),
+                ('product', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='QuanLy.supplierproduct', verbose_name='Sản phẩm NCC')),
+            ],
+            options={
+                'verbose_name': 'Số liệu theo ngày',
+                'verbose_name_plural': 'Số liệu theo ngày',
+                'indexes': [models.Index(fields=['category', 'day'], name='summary_category_day_idx'), models.Index(fields=['product', 'day'], name='summary_product_day_idx')],
+                'unique_together': {('day', 'product')},
+            },
+        ),
+        migrations.RunPython(backfill_daily_summary, migrations.RunPython.noop),
+    ]
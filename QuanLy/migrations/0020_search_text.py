@@ -0,0 +1,143 @@
+# Generated by Django 4.2.30 on 2026-10-17 08:27
+
+import re
+import unicodedata
+
+from django.db import OperationalError, migrations, models
+
+
+# Bản chép cố định các hàm của QuanLy/search.py lúc tạo migration: sửa code
+# app sau này không được làm đổi kết quả của migration cũ.
+def normalize_text(*parts):
+    text = " ".join(str(p) for p in parts if p not in (None, ""))
+    text = text.lower().replace("đ", "d")
+    text = unicodedata.normalize("NFD", text)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def fts_supported(conn):
+    if conn.vendor != "sqlite":
+        return False
+    with conn.cursor() as cursor:
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE temp.quanly_fts_probe USING fts5(x, tokenize='trigram')")
+        except OperationalError:
+            return False
+        cursor.execute("DROP TABLE temp.quanly_fts_probe")
+    return True
+
+
+def install_fts(conn, db_table):
+    fts = f"{db_table}_search"
+    statements = [
+        f'DROP TABLE IF EXISTS "{fts}"',
+        f'CREATE VIRTUAL TABLE "{fts}" USING fts5('
+        f"search_text, content='{db_table}', content_rowid='rowid', tokenize='trigram')",
+        f'DROP TRIGGER IF EXISTS "{fts}_ai"',
+        f'DROP TRIGGER IF EXISTS "{fts}_ad"',
+        f'DROP TRIGGER IF EXISTS "{fts}_au"',
+        f'CREATE TRIGGER "{fts}_ai" AFTER INSERT ON "{db_table}" BEGIN '
+        f'INSERT INTO "{fts}"(rowid, search_text) VALUES (new.rowid, new.search_text); END',
+        f'CREATE TRIGGER "{fts}_ad" AFTER DELETE ON "{db_table}" BEGIN '
+        f'INSERT INTO "{fts}"("{fts}", rowid, search_text) VALUES (\'delete\', old.rowid, old.search_text); END',
+        f'CREATE TRIGGER "{fts}_au" AFTER UPDATE OF search_text ON "{db_table}" BEGIN '
+        f'INSERT INTO "{fts}"("{fts}", rowid, search_text) VALUES (\'delete\', old.rowid, old.search_text); '
+        f'INSERT INTO "{fts}"(rowid, search_text) VALUES (new.rowid, new.search_text); END',
+        f'INSERT INTO "{fts}"("{fts}") VALUES (\'rebuild\')',
+    ]
+    with conn.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+# Cột gộp vào search_text của từng bảng (giống search_parts() trên model)
+SEARCH_FIELDS = {
+    "Category": ["category_code", "name", "description"],
+    "Supplier": ["supplier_code", "company_name", "contact_name", "phone", "tax_code", "address"],
+    "SupplierProduct": ["product_code", "name"],
+    "ImportReceipt": ["import_code", "note"],
+    "ExportReceipt": ["export_code", "destination", "receiver_name", "note"],
+    "ReturnReceipt": ["return_code", "note"],
+    "PurchaseOrder": ["po_code", "note"],
+    "ASN": ["asn_code", "po_id", "deliverer_name", "note"],
+}
+
+
+def backfill_search_text(apps, schema_editor):
+    for model_name, fields in SEARCH_FIELDS.items():
+        model = apps.get_model("QuanLy", model_name)
+        rows = list(model.objects.only(*fields))
+        for row in rows:
+            row.search_text = normalize_text(*(getattr(row, f) for f in fields))
+        model.objects.bulk_update(rows, ["search_text"], batch_size=500)
+
+
+def create_fts_indexes(apps, schema_editor):
+    # Chỉ SQLite có FTS5 trigram; CSDL khác tìm bằng LIKE trên search_text
+    if not fts_supported(schema_editor.connection):
+        return
+    for model_name in SEARCH_FIELDS:
+        install_fts(schema_editor.connection, apps.get_model("QuanLy", model_name)._meta.db_table)
+
+
+def drop_fts_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for model_name in SEARCH_FIELDS:
+        fts = apps.get_model("QuanLy", model_name)._meta.db_table + "_search"
+        for suffix in ("_ai", "_ad", "_au"):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS "{fts}{suffix}"')
+        schema_editor.execute(f'DROP TABLE IF EXISTS "{fts}"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('QuanLy', '0019_daily_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='asn',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='exportreceipt',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='importreceipt',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='purchaseorder',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='returnreceipt',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='supplier',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='supplierproduct',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(backfill_search_text, migrations.RunPython.noop),
+        migrations.RunPython(create_fts_indexes, drop_fts_indexes),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-17 08:37
+
+from django.db import migrations, models
+
+from QuanLy.search_index import rebuild_index
+
+
+def build_search_index(apps, schema_editor):
+    # Chỉ đọc trường qua values() nên chạy được với model lịch sử
+    rebuild_index(apps=apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('QuanLy', '0020_search_text'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchIndexEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('word', models.CharField(max_length=20, verbose_name='Từ')),
+                ('doc_type', models.CharField(max_length=10, verbose_name='Loại')),
+                ('doc_key', models.CharField(max_length=30, verbose_name='Khoá')),
+                ('weight', models.PositiveSmallIntegerField(default=1, verbose_name='Trọng số')),
+            ],
+            options={
+                'verbose_name': 'Chỉ mục tìm kiếm',
+                'verbose_name_plural': 'Chỉ mục tìm kiếm',
+                'indexes': [models.Index(fields=['word', 'id', 'doc_type', 'doc_key', 'weight'], name='search_word_idx'), models.Index(fields=['doc_type', 'doc_key', 'word', 'weight'], name='search_doc_idx')],
+            },
+        ),
+        migrations.RunPython(build_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.30 on 2026-10-17 11:00
+
+import datetime
+from django.db import migrations, models
+from django.db.models import Case, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+
+
+def backfill_sort_keys(apps, schema_editor):
+    # 1 câu UPDATE cho cả bảng: hạng trạng thái + ngày nhập của phiếu nhập
+    StockItem = apps.get_model("QuanLy", "StockItem")
+    ImportReceipt = apps.get_model("QuanLy", "ImportReceipt")
+
+    import_date = ImportReceipt.objects.filter(pk=OuterRef("import_receipt_id")).values("import_date")
+    StockItem.objects.update(
+        status_rank=Case(
+            When(status="nearly_expired", then=Value(0)),
+            When(status="expired", then=Value(2)),
+            default=Value(1),
+        ),
+        sort_date=Coalesce(Subquery(import_date), Value(datetime.date.min),
+                           output_field=models.DateField()),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('QuanLy', '0021_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockitem',
+            name='sort_date',
+            field=models.DateField(default=datetime.date(1, 1, 1), editable=False),
+        ),
+        migrations.AddField(
+            model_name='stockitem',
+            name='status_rank',
+            field=models.PositiveSmallIntegerField(default=1, editable=False),
+        ),
+        migrations.RunPython(backfill_sort_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='stockitem',
+            index=models.Index(fields=['status_rank', '-sort_date', '-id'], name='stock_list_keyset_idx'),
+        ),
+    ]
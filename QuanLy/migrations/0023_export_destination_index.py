@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-17 11:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('QuanLy', '0022_stock_list_sort_keys'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='exportreceipt',
+            index=models.Index(fields=['destination'], name='export_destination_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-17 11:32
+
+import datetime
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_fefo_date(apps, schema_editor):
+    # Lô không có HSD giữ mặc định date.max; lô có HSD: fefo_date = expiry_date
+    StockItem = apps.get_model("QuanLy", "StockItem")
+    StockItem.objects.filter(expiry_date__isnull=False).update(fefo_date=F("expiry_date"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('QuanLy', '0023_export_destination_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='stockitem',
+            name='stock_active_expiry_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='stockitem',
+            name='stock_location_idx',
+        ),
+        migrations.AddField(
+            model_name='stockitem',
+            name='fefo_date',
+            field=models.DateField(default=datetime.date(9999, 12, 31), editable=False),
+        ),
+        migrations.RunPython(backfill_fefo_date, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='stockitem',
+            index=models.Index(condition=models.Q(('quantity__gt', 0)), fields=['fefo_date', 'id'], name='stock_picker_fefo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockitem',
+            index=models.Index(fields=['location', 'status_rank', '-sort_date', '-id'], name='stock_location_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 11:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('QuanLy', '0024_stock_picker_fefo_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stockmovement',
+            name='movement_type',
+            field=models.CharField(choices=[('opening', 'Tồn đầu kỳ'), ('import', 'Nhập kho'), ('export', 'Xuất kho'), ('return', 'Hoàn hàng'), ('adjustment', 'Điều chỉnh')], max_length=20, verbose_name='Loại'),
+        ),
+    ]
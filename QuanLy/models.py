@@ -1,12 +1,220 @@
 from django.db import models
 from django.contrib.auth.models import User
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 from django.utils import timezone
 from decimal import Decimal
 
+from .dashboard import invalidate_dashboard
+from .metrics import count_stock_movements
+from .search import SearchTextMixin
+from .search_index import index_documents
+
+
+def as_date(value):
+    # DateField default=timezone.now để datetime trong bộ nhớ đến khi đọc lại từ DB
+    if isinstance(value, datetime):
+        return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+    return value
+
+
+# ===================== ĐÁNH SỐ CHỨNG TỪ =====================
+# Mỗi tiền tố (PN, XK, HH, PO, ASN) có một dòng đếm riêng; cấp số = 1 câu
+# UPDATE last_value = last_value + 1 trong transaction của phiếu -> O(1),
+# không trùng mã khi nhiều người tạo phiếu cùng lúc.
+#
+# width: số chữ số tối thiểu (vượt quá thì mã tự dài thêm, không quay vòng)
+# period: None | "day" | "month" – đánh số lại theo ngày / tháng, mã có thêm
+#         dấu thời gian, VD: PN2410170001 (day), PN24100001 (month)
+# Có thể ghi đè trong settings.DOCUMENT_SEQUENCES = {"PN": {"period": "month"}}
+DOCUMENT_SEQUENCE_DEFAULTS = {
+    "PN": {"width": 4, "period": None},
+    "XK": {"width": 4, "period": None},
+    "HH": {"width": 4, "period": None},
+    "PO": {"width": 3, "period": None},
+    "ASN": {"width": 4, "period": None},
+}
+
+PERIOD_FORMATS = {
+    "day": "%y%m%d",
+    "month": "%y%m",
+}
+
+
+class DocumentSequence(models.Model):
+    prefix = models.CharField(max_length=10, verbose_name="Tiền tố")
+    period = models.CharField(max_length=10, blank=True, default="", verbose_name="Kỳ đánh số")
+    last_value = models.PositiveBigIntegerField(default=0, verbose_name="Số đã cấp gần nhất")
+
+    class Meta:
+        verbose_name = "Bộ đếm mã chứng từ"
+        verbose_name_plural = "Bộ đếm mã chứng từ"
+        unique_together = ("prefix", "period")
+
+    def __str__(self):
+        return f"{self.prefix}{self.period}: {self.last_value}"
+
+    @staticmethod
+    def get_config(prefix):
+        from django.conf import settings
+
+        config = dict(DOCUMENT_SEQUENCE_DEFAULTS.get(prefix, {"width": 4, "period": None}))
+        config.update(getattr(settings, "DOCUMENT_SEQUENCES", {}).get(prefix, {}))
+        return config
+
+    @staticmethod
+    def current_period(period, today=None):
+        if not period:
+            return ""
+        return (today or date.today()).strftime(PERIOD_FORMATS[period])
+
+    @staticmethod
+    def _seed(model, field, code_prefix):
+        # Chỉ chạy 1 lần khi tạo bộ đếm: lấy số lớn nhất trong các mã đã có
+        # (so sánh theo số, không theo chuỗi -> PO1000 > PO999)
+        last = 0
+        codes = model.objects.filter(**{f"{field}__startswith": code_prefix}) \
+                             .values_list(field, flat=True)
+        for code in codes.iterator():
+            number = code[len(code_prefix):]
+            if number.isdigit():
+                last = max(last, int(number))
+        return last
+
+    @classmethod
+    def allocate(cls, prefix, model, field, today=None):
+        """Cấp mã mới cho `prefix`; nên gọi bên trong transaction lưu phiếu."""
+        from django.db import IntegrityError, transaction
+
+        config = cls.get_config(prefix)
+        period = cls.current_period(config["period"], today)
+        counter = cls.objects.filter(prefix=prefix, period=period)
+
+        with transaction.atomic():
+            if not counter.update(last_value=models.F("last_value") + 1):
+                seed = cls._seed(model, field, prefix + period)
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(prefix=prefix, period=period, last_value=seed + 1)
+                except IntegrityError:
+                    # tiến trình khác vừa tạo bộ đếm -> tăng như bình thường
+                    counter.update(last_value=models.F("last_value") + 1)
+
+            value = counter.values_list("last_value", flat=True).get()
+
+        return f"{prefix}{period}{value:0{config['width']}d}"
+
+    @classmethod
+    def preview(cls, prefix, model, field, today=None):
+        """Mã dự kiến để hiển thị trên form – không cấp số."""
+        config = cls.get_config(prefix)
+        period = cls.current_period(config["period"], today)
+
+        last = cls.objects.filter(prefix=prefix, period=period) \
+                          .values_list("last_value", flat=True).first()
+        if last is None:
+            last = cls._seed(model, field, prefix + period)
+
+        return f"{prefix}{period}{last + 1:0{config['width']}d}"
+
+
+# ===================== TỔNG TIỀN PHIẾU (LƯU SẴN) =====================
+# Các cột tổng trên phiếu (SL, thành tiền, chiết khấu) được lưu sẵn và tính
+# lại bằng 1 câu aggregate mỗi khi dòng hàng được lưu / xoá -> trang danh
+# sách đọc thẳng cột, không phải cộng dồn items.all() cho từng phiếu.
+class ReceiptTotalsMixin:
+    # Lớp phiếu phải khai báo totals_expressions() -> {tên cột tổng: biểu thức
+    # aggregate trên bảng dòng hàng}; thiếu thì báo lỗi ngay khi nạp models.
+    # save / delete phiếu và mỗi lần tính lại tổng đều làm mới cache trang chủ
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if not callable(getattr(cls, "totals_expressions", None)):
+            raise TypeError(f"{cls.__name__} dùng ReceiptTotalsMixin nhưng chưa khai báo totals_expressions()")
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        invalidate_dashboard()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        invalidate_dashboard()
+        return result
+
+    def recalculate_totals(self):
+        totals = {
+            name: value or 0
+            for name, value in self.items.aggregate(**self.totals_expressions()).items()
+        }
+        type(self).objects.filter(pk=self.pk).update(**totals)
+        for name, value in totals.items():
+            setattr(self, name, value)
+        # dòng hàng vừa đổi -> tồn kho / số liệu trang chủ đổi theo
+        invalidate_dashboard()
+        return totals
+
+    @classmethod
+    def totals_subqueries(cls):
+        from django.db.models import OuterRef, Subquery, Value
+        from django.db.models.functions import Coalesce
+
+        fk = cls.items.field
+        result = {}
+        for name, expr in cls.totals_expressions().items():
+            per_receipt = fk.model.objects.filter(**{fk.name: OuterRef("pk")}) \
+                                          .values(fk.name).annotate(value=expr).values("value")
+            result[name] = Coalesce(
+                Subquery(per_receipt), Value(0),
+                output_field=cls._meta.get_field(name).clone(),
+            )
+        return result
+
+    @classmethod
+    def backfill_totals(cls):
+        # Tính lại toàn bộ bảng bằng 1 câu UPDATE ... = (SELECT SUM ...)
+        return cls.objects.update(**cls.totals_subqueries())
+
+    @classmethod
+    def mismatched_totals(cls):
+        # Các phiếu có cột tổng lệch với dòng hàng: [(pk, {cột: (lưu, đúng)})]
+        names = list(cls.totals_expressions())
+        rows = cls.objects.annotate(
+            **{f"calc_{n}": expr for n, expr in cls.totals_subqueries().items()}
+        ).values("pk", *names, *[f"calc_{n}" for n in names])
+
+        result = []
+        for row in rows.iterator():
+            diff = {
+                n: (row[n], row[f"calc_{n}"])
+                for n in names
+                if Decimal(row[n] or 0).quantize(Decimal("0.01"))
+                != Decimal(row[f"calc_{n}"] or 0).quantize(Decimal("0.01"))
+            }
+            if diff:
+                result.append((row["pk"], diff))
+        return result
+
+
+def line_total_expression(with_discount=True):
+    # SL * đơn giá (- chiết khấu %), cùng công thức với ImportItem.total
+    from django.db.models import ExpressionWrapper, F
+
+    base = F("quantity") * F("unit_price")
+    if with_discount:
+        base = base - base * F("discount_percent") / 100
+    return ExpressionWrapper(base, output_field=models.DecimalField(max_digits=20, decimal_places=2))
+
+
+def line_discount_expression():
+    from django.db.models import ExpressionWrapper, F
+
+    return ExpressionWrapper(
+        F("quantity") * F("unit_price") * F("discount_percent") / 100,
+        output_field=models.DecimalField(max_digits=20, decimal_places=2),
+    )
+
 
 # ===================== DANH MỤC =====================
-class Category(models.Model):
+class Category(SearchTextMixin):
     category_code = models.CharField(max_length=10, primary_key=True, verbose_name="Mã danh mục")
     name = models.CharField(max_length=100,unique=True, verbose_name="Tên danh mục")
     description = models.TextField(blank=True, null=True, verbose_name="Mô tả")
@@ -20,9 +228,50 @@ class Category(models.Model):
     def __str__(self):
         return f"{self.name} ({self.category_code})"
 
+    def search_parts(self):
+        return [self.category_code, self.name, self.description]
+
+    @staticmethod
+    def attach_products_from_imports(categories):
+        """
+        Gắn `products_from_imports` cho cả danh sách danh mục bằng 1 câu SQL:
+        mỗi (danh mục, mã SP) lấy dòng nhập mới nhất (ROW_NUMBER() OVER ...
+        ORDER BY ngày nhập giảm dần) -> tên + đơn giá nhập gần nhất.
+        """
+        from django.db.models import F, Window
+        from django.db.models.functions import RowNumber
+
+        categories = list(categories)
+        by_code = {c.pk: c for c in categories}
+        for c in categories:
+            c.products_from_imports = []
+        if not by_code:
+            return categories
+
+        latest = (
+            ImportItem.objects
+            .filter(product__category_id__in=list(by_code))
+            .annotate(row_number=Window(
+                RowNumber(),
+                partition_by=[F("product__category_id"), F("product__product_code")],
+                order_by=[F("import_receipt__import_date").desc(), F("id").desc()],
+            ))
+            .filter(row_number=1)
+            .values("product__category_id", "product__product_code", "product__name", "unit_price")
+            .order_by("product__category_id", "product__product_code")
+        )
+
+        for row in latest:
+            by_code[row["product__category_id"]].products_from_imports.append({
+                "product_code": row["product__product_code"],
+                "name": row["product__name"],
+                "unit_price": row["unit_price"],
+            })
+        return categories
+
 
 # ===================== NHÀ CUNG ỨNG =====================
-class Supplier(models.Model):
+class Supplier(SearchTextMixin):
     supplier_code = models.CharField(max_length=10, primary_key=True, verbose_name="Mã NCC")
     company_name = models.CharField(max_length=200, verbose_name="Tên công ty")
     phone = models.CharField(max_length=10, blank=True, null=True)
@@ -42,10 +291,14 @@ class Supplier(models.Model):
     def __str__(self):
         return f"{self.company_name} ({self.supplier_code})"
 
+    def search_parts(self):
+        return [self.supplier_code, self.company_name, self.contact_name,
+                self.phone, self.tax_code, self.address]
+
 
 
 # ===================== SẢN PHẨM NHÀ CUNG ỨNG (PRODUCT CHÍNH) =====================
-class SupplierProduct(models.Model):
+class SupplierProduct(SearchTextMixin):
     supplier = models.ForeignKey(
         "Supplier",
         on_delete=models.CASCADE,
@@ -87,9 +340,21 @@ class SupplierProduct(models.Model):
     def __str__(self):
         return f"{self.product_code} - {self.name} ({self.supplier.supplier_code})"
 
+    def search_parts(self):
+        return [self.product_code, self.name]
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        invalidate_dashboard()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        invalidate_dashboard()
+        return result
+
 
 # ===================== NHẬP KHO =====================
-class ImportReceipt(models.Model):
+class ImportReceipt(ReceiptTotalsMixin, SearchTextMixin):
     import_code = models.CharField(
         max_length=20, unique=True, verbose_name="Mã phiếu nhập", blank=True
     )
@@ -117,41 +382,40 @@ class ImportReceipt(models.Model):
         verbose_name="Người tạo"
     )
 
+    total_quantity = models.PositiveIntegerField(default=0, editable=False, verbose_name="Tổng số lượng")
+    total_price = models.DecimalField(max_digits=20, decimal_places=2, default=0, editable=False,
+                                      verbose_name="Tổng tiền")
+
     class Meta:
         verbose_name = "Phiếu nhập kho"
         verbose_name_plural = "Phiếu nhập kho"
         ordering = ["-import_date", "-id"]
+        indexes = [
+            # báo cáo / danh sách lọc theo khoảng ngày nhập (+ NCC)
+            models.Index(fields=["import_date"], name="import_date_idx"),
+            models.Index(fields=["supplier", "import_date"], name="import_supplier_date_idx"),
+        ]
 
     def __str__(self):
         return f"{self.import_code} - {self.import_date.strftime('%d/%m/%Y')}"
 
-    @property
-    def total_quantity(self):
-        return sum(item.quantity for item in self.items.all())
+    def search_parts(self):
+        return [self.import_code, self.note]
 
-    @property
-    def total_price(self):
-        return sum(item.total for item in self.items.all())
+    @staticmethod
+    def totals_expressions():
+        return {
+            "total_quantity": models.Sum("quantity"),
+            "total_price": models.Sum(line_total_expression()),
+        }
 
     @staticmethod
     def generate_new_code():
-        prefix = "PN"
-        last = ImportReceipt.objects.filter(import_code__startswith=prefix).order_by("-import_code").first()
+        return DocumentSequence.allocate("PN", ImportReceipt, "import_code")
 
-        if not last:
-            return "PN0001"
-
-        last_number = last.import_code.replace(prefix, "")
-        if not last_number.isdigit():
-            return "PN0001"
-
-        new_number = int(last_number) + 1
-        return f"{prefix}{new_number:04d}"
-
-    def save(self, *args, **kwargs):
-        if not self.export_code:
-            self.export_code = ExportReceipt.generate_new_code()
-        super().save(*args, **kwargs)
+    @staticmethod
+    def preview_new_code():
+        return DocumentSequence.preview("PN", ImportReceipt, "import_code")
 
     def save(self, *args, **kwargs):
         # nếu có ASN mà chưa set supplier -> tự set
@@ -160,10 +424,22 @@ class ImportReceipt(models.Model):
 
         # tự sinh code nếu chưa có
         if not self.import_code:
-            self.import_code = self._generate_import_code()
+            self.import_code = ImportReceipt.generate_new_code()
+
+        old_date = None
+        if not self._state.adding:
+            old_date = ImportReceipt.objects.filter(pk=self.pk) \
+                                            .values_list("import_date", flat=True).first()
 
         super().save(*args, **kwargs)
 
+        # đổi ngày nhập -> khóa sắp xếp của các lô thuộc phiếu đổi theo,
+        # số liệu theo ngày tính lại cho cả ngày cũ lẫn ngày mới
+        if old_date is not None and old_date != as_date(self.import_date):
+            StockItem.objects.filter(import_receipt=self).update(sort_date=as_date(self.import_date))
+            DailySummary.refresh_days([old_date, self.import_date],
+                                      self.items.values_list("product_id", flat=True))
+
     def clean(self):
         from django.core.exceptions import ValidationError
         # Nếu chọn ASN thì supplier phải trùng
@@ -226,12 +502,130 @@ class ImportItem(models.Model):
             },
         )
 
+        # lô mới: StockItem.save() đã ghi sổ "import" cho toàn bộ SL của lô;
+        # lô có sẵn: save() ghi phần tăng thêm, cũng là dòng "import" của phiếu
         if not created:
             lot.quantity += self.quantity
             lot.unit = self.unit
             lot.location = self.location
             lot.unit_price = self.unit_price
-            lot.save()
+            lot.save(movement=("import", self.import_receipt_id, self.import_receipt.import_date))
+
+        self.import_receipt.recalculate_totals()
+        DailySummary.refresh(self.import_receipt.import_date, [self.product_id])
+
+    @classmethod
+    def bulk_receive(cls, receipt, items):
+        """
+        Lưu nhiều dòng nhập (chưa lưu) vào phiếu trong 1 transaction.
+        Tồn kho giống hệt gọi save() từng dòng: dòng cùng sản phẩm + HSD cộng
+        dồn vào 1 lô của phiếu, đơn vị / vị trí / giá lô theo dòng sau cùng.
+        Số câu SQL không phụ thuộc số dòng: 1 SELECT dòng ASN, 1 SELECT lô có sẵn,
+        bulk_create dòng nhập / lô mới / sổ kho, bulk_update lô cũ.
+        """
+        from django.db import transaction
+
+        items = list(items)
+
+        # Dòng ASN chưa nạp -> lấy 1 lần cho cả phiếu
+        missing = {i.asn_item_id for i in items
+                   if i.asn_item_id and not cls.asn_item.is_cached(i)}
+        if missing:
+            asn_items = ASNItem.objects.select_related("product").in_bulk(missing)
+            for item in items:
+                if item.asn_item_id in asn_items:
+                    item.asn_item = asn_items[item.asn_item_id]
+
+        # ===== KIỂM TRA TOÀN BỘ DÒNG TRƯỚC KHI GHI =====
+        for n, item in enumerate(items, start=1):
+            item.import_receipt = receipt
+            if item.asn_item_id:
+                # giống save(): đồng bộ từ ASNItem
+                item.product = item.asn_item.product
+                if not item.unit_price:
+                    item.unit_price = item.asn_item.unit_price
+                if not item.unit:
+                    item.unit = item.asn_item.unit
+                if not item.expiry_date:
+                    item.expiry_date = item.asn_item.expiry_date
+
+            if not item.product_id:
+                raise ValidationError(f"Dòng {n}: chưa chọn sản phẩm.")
+            if not item.quantity or item.quantity <= 0:
+                raise ValidationError(f"Dòng {n}: số lượng phải lớn hơn 0.")
+
+        if not items:
+            return []
+
+        # ===== GỘP VÀO LÔ (THEO THỨ TỰ DÒNG) =====
+        lots = {}
+        if receipt.pk:
+            existing = StockItem.objects.filter(
+                source_type="import",
+                import_receipt=receipt,
+                product_id__in={i.product_id for i in items},
+            ).order_by("id")
+            for lot in existing:
+                lots.setdefault((lot.product_id, lot.expiry_date), lot)
+
+        new_lots, changed_lots, pairs = [], {}, []
+        for item in items:
+            key = (item.product_id, item.expiry_date)
+            lot = lots.get(key)
+            if lot is None:
+                lot = StockItem(
+                    source_type="import",
+                    import_receipt=receipt,
+                    product_id=item.product_id,
+                    expiry_date=item.expiry_date,
+                    quantity=item.quantity,
+                    unit=item.unit,
+                    location=item.location,
+                    unit_price=item.unit_price,
+                )
+                lots[key] = lot
+                new_lots.append(lot)
+            else:
+                lot.quantity += item.quantity
+                lot.unit = item.unit
+                lot.location = item.location
+                lot.unit_price = item.unit_price
+                if lot.pk:
+                    changed_lots[lot.pk] = lot
+            pairs.append((item, lot))
+
+        for lot in new_lots + list(changed_lots.values()):
+            lot.update_status()
+        for lot in new_lots:
+            lot.update_sort_date()
+
+        with transaction.atomic():
+            cls.objects.bulk_create(items)
+            # cần pk lô mới cho sổ kho (SQLite >= 3.35 / PostgreSQL trả về id)
+            StockItem.objects.bulk_create(new_lots)
+            StockItem.objects.bulk_update(
+                list(changed_lots.values()),
+                ["quantity", "unit", "location", "unit_price", "status", "status_rank"],
+            )
+            # bulk_create / bulk_update không phát post_save -> lập chỉ mục tìm kiếm ở đây
+            index_documents("lot", [lot.pk for lot in new_lots] + list(changed_lots))
+            StockMovement.bulk_record([
+                StockMovement.build(lot, item.quantity, "import", receipt.pk, receipt.import_date)
+                for item, lot in pairs
+            ])
+
+            receipt.recalculate_totals()
+            DailySummary.refresh(receipt.import_date, [i.product_id for i in items])
+            invalidate_dashboard()
+
+        return items
+
+    def delete(self, *args, **kwargs):
+        receipt = self.import_receipt
+        result = super().delete(*args, **kwargs)
+        receipt.recalculate_totals()
+        DailySummary.refresh(receipt.import_date, [self.product_id])
+        return result
 
 
 # ===================== TỒN KHO (LÔ HÀNG) =====================
@@ -281,21 +675,174 @@ class StockItem(models.Model):
     unit_price = models.DecimalField(max_digits=15, decimal_places=2, default=0, verbose_name="Đơn giá nhập")
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="valid", verbose_name="Trạng thái")
 
+    # Khóa sắp xếp của trang tồn kho, lưu sẵn để index stock_list_keyset_idx
+    # phục vụ được phân trang keyset (annotate Case / Coalesce thì không):
+    #   status_rank: Cận hạn (0) → Còn hạn (1) → Hết hạn (2), đi cùng status
+    #   sort_date:   ngày nhập của phiếu nhập, lô hoàn = date.min (xếp cuối nhóm)
+    STATUS_RANKS = {"nearly_expired": 0, "valid": 1, "expired": 2}
+    NO_IMPORT_SORT_DATE = date.min
+
+    status_rank = models.PositiveSmallIntegerField(default=1, editable=False)
+    sort_date = models.DateField(default=NO_IMPORT_SORT_DATE, editable=False)
+
+    # Khóa FEFO của ô chọn lô phiếu xuất (api_stock_lots), lưu sẵn để index
+    # stock_picker_fefo_idx đi đúng thứ tự (fefo_date, id): = expiry_date, lô
+    # không có HSD = date.max (xếp cuối, giống allocation._fefo_order)
+    NO_EXPIRY_SORT_DATE = date.max
+
+    fefo_date = models.DateField(default=NO_EXPIRY_SORT_DATE, editable=False)
+
+    # Còn <= 30 ngày là cận hạn
+    NEARLY_EXPIRED_DAYS = 30
+
     def update_status(self):
         if self.expiry_date:
             today = date.today()
             if self.expiry_date < today:
                 self.status = "expired"
-            elif self.expiry_date <= today + timedelta(days=30):
+            elif self.expiry_date <= today + timedelta(days=self.NEARLY_EXPIRED_DAYS):
                 self.status = "nearly_expired"
             else:
                 self.status = "valid"
         else:
             self.status = "valid"
+        self.status_rank = self.STATUS_RANKS[self.status]
+        self.fefo_date = self.expiry_date or self.NO_EXPIRY_SORT_DATE
 
-    def save(self, *args, **kwargs):
+    def update_sort_date(self):
+        if self.import_receipt_id:
+            self.sort_date = as_date(self.import_receipt.import_date)
+        else:
+            self.sort_date = self.NO_IMPORT_SORT_DATE
+
+    @classmethod
+    def refresh_statuses(cls, today=None):
+        # Phân loại lại hạn dùng cho toàn bộ lô bằng 3 câu UPDATE theo ngưỡng
+        # expiry_date (cùng quy tắc với update_status). Chỉ đụng các dòng
+        # thực sự đổi trạng thái. Trả về số dòng đã đổi theo từng trạng thái.
+        today = today or date.today()
+        nearly_limit = today + timedelta(days=cls.NEARLY_EXPIRED_DAYS)
+
+        rules = {
+            "expired": models.Q(expiry_date__lt=today),
+            "nearly_expired": models.Q(expiry_date__gte=today, expiry_date__lte=nearly_limit),
+            "valid": models.Q(expiry_date__isnull=True) | models.Q(expiry_date__gt=nearly_limit),
+        }
+
+        counts = {
+            status: cls.objects.filter(rule).exclude(status=status)
+                               .update(status=status, status_rank=cls.STATUS_RANKS[status])
+            for status, rule in rules.items()
+        }
+        if any(counts.values()):
+            invalidate_dashboard()
+        return counts
+
+    def save(self, *args, movement=("adjustment", "", None), **kwargs):
+        # movement = (loại, chứng từ, ngày) của dòng sổ ghi phần chênh SL khi sửa
+        # lô có sẵn; mặc định "Điều chỉnh" hôm nay (form tồn kho, admin)
         self.update_status()
+        # phiếu nhập đã nạp sẵn (lô mới, đổi phiếu) -> không tốn thêm câu SELECT
+        adding = self._state.adding
+        if adding or StockItem.import_receipt.is_cached(self):
+            self.update_sort_date()
+        old_qty = None
+        update_fields = kwargs.get("update_fields")
+        if not adding and (update_fields is None or "quantity" in update_fields):
+            old_qty = StockItem.objects.filter(pk=self.pk) \
+                                       .values_list("quantity", flat=True).first()
         super().save(*args, **kwargs)
+        if adding:
+            self.record_opening_movement()
+        elif old_qty is not None:
+            StockMovement.record(self, self.quantity - old_qty, *movement)
+        invalidate_dashboard()
+
+    def record_opening_movement(self):
+        # Lô mới vào sổ kho với toàn bộ SL ban đầu -> số dư sổ khớp tồn kho kể
+        # cả lô tạo ngoài phiếu (form tồn kho, admin): có phiếu thì ghi theo loại
+        # và ngày của phiếu, không có thì là "Tồn đầu kỳ" hôm nay.
+        # Đường lưu gộp (bulk_create) tự ghi sổ.
+        if self.source_type == "return" and self.return_receipt_id:
+            StockMovement.record(self, self.quantity, "return", self.return_receipt_id,
+                                 self.return_receipt.return_date)
+        elif self.source_type == "import" and self.import_receipt_id:
+            StockMovement.record(self, self.quantity, "import", self.import_receipt_id,
+                                 self.import_receipt.import_date)
+        else:
+            StockMovement.record(self, self.quantity, "opening")
+
+    @classmethod
+    def decrease(cls, pk, amount):
+        # Trừ tồn bằng 1 câu UPDATE có điều kiện:
+        #   UPDATE ... SET quantity = quantity - n WHERE id = pk AND quantity >= n
+        # DB tự khóa dòng -> 2 người xuất cùng lô không thể bán âm / mất cập nhật.
+        # amount < 0 là trả lại tồn (giảm SL dòng xuất khi sửa phiếu).
+        if not amount:
+            return
+        updated = cls.objects.filter(pk=pk, quantity__gte=amount) \
+                             .update(quantity=models.F("quantity") - amount)
+        if not updated:
+            raise ValidationError("Không đủ tồn kho")
+
+    # Số lô tối đa trong 1 câu UPDATE gộp (giữ biểu thức WHERE/CASE vừa giới hạn của SQLite)
+    DECREASE_BATCH_SIZE = 200
+
+    @classmethod
+    def decrease_many(cls, amounts):
+        # Trừ tồn nhiều lô cùng lúc: {pk: số lượng} -> mỗi lô 200 dòng 1 câu
+        #   UPDATE ... SET quantity = quantity - CASE id WHEN .. END
+        #   WHERE (id = a AND quantity >= na) OR (id = b AND quantity >= nb) ...
+        # Chỉ cần 1 lô thiếu là huỷ hết (số dòng cập nhật != số lô).
+        from django.db import transaction
+
+        amounts = [(pk, n) for pk, n in amounts.items() if n]
+        with transaction.atomic():
+            for start in range(0, len(amounts), cls.DECREASE_BATCH_SIZE):
+                batch = amounts[start:start + cls.DECREASE_BATCH_SIZE]
+                condition = models.Q()
+                for pk, n in batch:
+                    condition |= models.Q(pk=pk, quantity__gte=n)
+
+                delta = models.Case(
+                    *[models.When(pk=pk, then=models.Value(n)) for pk, n in batch],
+                    output_field=models.IntegerField(),
+                )
+                updated = cls.objects.filter(condition) \
+                                     .update(quantity=models.F("quantity") - delta)
+                if updated != len(batch):
+                    raise ValidationError("Không đủ tồn kho")
+
+    @classmethod
+    def picker_queryset(cls, q=""):
+        # Lô còn hàng cho ô chọn lô phiếu xuất: tìm theo đầu mã / tên sản phẩm,
+        # khóa sắp xếp FEFO (fefo_date, id) – cột lưu sẵn, không annotate
+        qs = cls.objects.filter(quantity__gt=0).select_related("product")
+        q = (q or "").strip()
+        if q:
+            qs = qs.filter(
+                models.Q(product__product_code__istartswith=q)
+                | models.Q(product__name__istartswith=q)
+            )
+        return qs
+
+    class Meta:
+        indexes = [
+            # chọn lô FEFO theo sản phẩm: WHERE product_id IN (...) AND quantity > 0
+            # ORDER BY expiry_date, id – chỉ index lô còn hàng (phần lớn lô đã xuất hết)
+            models.Index(fields=["product", "expiry_date", "id"], name="stock_fefo_idx",
+                         condition=models.Q(quantity__gt=0)),
+            # lô còn hàng theo thứ tự FEFO (ô chọn lô khi xuất kho, keyset (fefo_date, id))
+            models.Index(fields=["fefo_date", "id"], name="stock_picker_fefo_idx",
+                         condition=models.Q(quantity__gt=0)),
+            # đếm lô hết hạn / cận hạn, refresh_stock_status
+            models.Index(fields=["status", "expiry_date"], name="stock_status_expiry_idx"),
+            # trang tồn kho lọc theo vị trí: trong 1 vị trí đã theo thứ tự STOCK_LIST_KEYS
+            models.Index(fields=["location", "status_rank", "-sort_date", "-id"],
+                         name="stock_location_keyset_idx"),
+            # thứ tự trang tồn kho (views.STOCK_LIST_KEYS): trang sâu cũng chỉ đọc page_size dòng
+            models.Index(fields=["status_rank", "-sort_date", "-id"], name="stock_list_keyset_idx"),
+        ]
 
     def __str__(self):
         if self.source_type == "import" and self.import_receipt:
@@ -307,11 +854,263 @@ class StockItem(models.Model):
         return f"{self.product.name} - {self.quantity} {self.unit} ({code})"
 
 
+class StockStatusRefresh(models.Model):
+    # Mỗi ngày chỉ chạy phân loại hạn dùng một lần (lệnh refresh_stock_status)
+    run_date = models.DateField(unique=True, verbose_name="Ngày chạy")
+    expired_count = models.PositiveIntegerField(default=0, verbose_name="Số lô chuyển hết hạn")
+    nearly_expired_count = models.PositiveIntegerField(default=0, verbose_name="Số lô chuyển cận hạn")
+    valid_count = models.PositiveIntegerField(default=0, verbose_name="Số lô chuyển còn hạn")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Lần cập nhật hạn dùng"
+        verbose_name_plural = "Lịch sử cập nhật hạn dùng"
+        ordering = ["-run_date"]
+
+    def __str__(self):
+        return f"Cập nhật hạn dùng {self.run_date.strftime('%d/%m/%Y')}"
+
+    @classmethod
+    def run(cls, today=None, force=False):
+        """
+        Chạy StockItem.refresh_statuses() nếu hôm nay chưa chạy.
+        Trả về bản ghi của lần chạy, hoặc None nếu đã chạy rồi (và không force).
+        """
+        from django.db import IntegrityError, transaction
+
+        today = today or date.today()
+
+        if force:
+            cls.objects.filter(run_date=today).delete()
+
+        try:
+            with transaction.atomic():
+                # tạo mốc trước -> 2 tiến trình chạy cùng lúc chỉ 1 cái qua được
+                record = cls.objects.create(run_date=today)
+                counts = StockItem.refresh_statuses(today)
+                record.expired_count = counts["expired"]
+                record.nearly_expired_count = counts["nearly_expired"]
+                record.valid_count = counts["valid"]
+                record.save(update_fields=["expired_count", "nearly_expired_count", "valid_count"])
+        except IntegrityError:
+            return None
+        return record
+
+
+# ===================== SỔ KHO (NHẬT KÝ BIẾN ĐỘNG TỒN) =====================
+# Mỗi lần StockItem.quantity thay đổi qua nhập / xuất / hoàn sẽ ghi thêm 1 dòng
+# (số lượng có dấu: + nhập, - xuất); lô mới tạo ngoài phiếu vào sổ là "Tồn đầu
+# kỳ". Sổ chỉ ghi thêm, không sửa / xoá – kể cả QuerySet.update() / delete();
+# lô bị xoá vẫn giữ id trong sổ (không ràng buộc khoá ngoại).
+#
+# Tồn tại ngày X = số dư ở mốc chốt sổ gần nhất <= X (StockCheckpoint)
+#                  + các dòng sổ sau mốc đó đến hết ngày X
+# -> chỉ cộng lại biến động từ lần chốt gần nhất, không quét toàn bộ lịch sử.
+class StockMovementQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        raise ValidationError("Sổ kho chỉ được ghi thêm, không sửa dòng đã ghi.")
+
+    def delete(self):
+        raise ValidationError("Sổ kho chỉ được ghi thêm, không xoá dòng đã ghi.")
+
+
+class StockMovement(models.Model):
+    TYPE_CHOICES = [
+        ("opening", "Tồn đầu kỳ"),
+        ("import", "Nhập kho"),
+        ("export", "Xuất kho"),
+        ("return", "Hoàn hàng"),
+        ("adjustment", "Điều chỉnh"),
+    ]
+
+    stock_item = models.ForeignKey(
+        StockItem,
+        on_delete=models.DO_NOTHING, db_constraint=False,
+        related_name="movements",
+        verbose_name="Lô hàng",
+    )
+    product = models.ForeignKey(
+        "SupplierProduct",
+        on_delete=models.DO_NOTHING, db_constraint=False,
+        related_name="stock_movements",
+        verbose_name="Sản phẩm NCC",
+    )
+    movement_type = models.CharField(max_length=20, choices=TYPE_CHOICES, verbose_name="Loại")
+    quantity = models.IntegerField(verbose_name="Số lượng (+/-)")
+    movement_date = models.DateField(default=date.today, verbose_name="Ngày")
+    reference = models.CharField(max_length=30, blank=True, default="", verbose_name="Chứng từ")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = StockMovementQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "Dòng sổ kho"
+        verbose_name_plural = "Sổ kho"
+        ordering = ["-movement_date", "-id"]
+        indexes = [
+            models.Index(fields=["stock_item", "movement_date"], name="movement_lot_date_idx"),
+            models.Index(fields=["product", "movement_date"], name="movement_product_date_idx"),
+            models.Index(fields=["movement_date"], name="movement_date_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.movement_date:%d/%m/%Y} {self.get_movement_type_display()} {self.quantity:+d}"
+
+    def save(self, *args, **kwargs):
+        if self.pk:
+            raise ValidationError("Sổ kho chỉ được ghi thêm, không sửa dòng đã ghi.")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValidationError("Sổ kho chỉ được ghi thêm, không xoá dòng đã ghi.")
+
+    @classmethod
+    def build(cls, stock_item, quantity, movement_type, reference="", movement_date=None):
+        # Dòng sổ chưa lưu – dùng cho bulk_create.
+        # movement_date = ngày nghiệp vụ của chứng từ (ngày nhập / xuất / hoàn),
+        # không phải ngày bấm lưu -> phiếu lùi ngày vẫn vào đúng ngày trong sổ
+        return cls(
+            stock_item_id=stock_item.pk,
+            product_id=stock_item.product_id,
+            movement_type=movement_type,
+            quantity=quantity,
+            movement_date=movement_date or date.today(),
+            reference=reference or "",
+        )
+
+    @classmethod
+    def record(cls, stock_item, quantity, movement_type, reference="", movement_date=None):
+        if not quantity:
+            return None
+        movement = cls.build(stock_item, quantity, movement_type, reference, movement_date)
+        movement.save()
+        count_stock_movements([movement])
+        return movement
+
+    @classmethod
+    def bulk_record(cls, movements):
+        # bulk_create các dòng StockMovement.build(...) + đếm vào /metrics
+        movements = cls.objects.bulk_create(movements)
+        count_stock_movements(movements)
+        return movements
+
+    @staticmethod
+    def _scope(stock_item=None, product=None, category=None):
+        scope = {}
+        if stock_item is not None:
+            scope["stock_item_id"] = getattr(stock_item, "pk", stock_item)
+        if product is not None:
+            scope["product_id"] = getattr(product, "pk", product)
+        if category is not None:
+            scope["product__category_id"] = getattr(category, "pk", category)
+        return scope
+
+    @classmethod
+    def balance_as_of(cls, day, stock_item=None, product=None, category=None):
+        """
+        Tồn cuối ngày `day` của 1 lô / 1 sản phẩm / 1 danh mục (bỏ trống = toàn kho).
+        """
+        scope = cls._scope(stock_item, product, category)
+        checkpoint = StockCheckpoint.latest_on_or_before(day)
+
+        balance = 0
+        movements = cls.objects.filter(movement_date__lte=day, **scope)
+        if checkpoint:
+            balance = checkpoint.lines.filter(**scope) \
+                                      .aggregate(total=models.Sum("quantity"))["total"] or 0
+            movements = movements.filter(movement_date__gt=checkpoint.checkpoint_date)
+
+        return balance + (movements.aggregate(total=models.Sum("quantity"))["total"] or 0)
+
+
+class StockCheckpoint(models.Model):
+    # Mốc chốt sổ: số dư từng lô tại CUỐI ngày checkpoint_date
+    checkpoint_date = models.DateField(unique=True, verbose_name="Ngày chốt")
+    movement_count = models.PositiveIntegerField(default=0, verbose_name="Số dòng sổ từ mốc trước")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Mốc chốt sổ kho"
+        verbose_name_plural = "Mốc chốt sổ kho"
+        ordering = ["-checkpoint_date"]
+
+    def __str__(self):
+        return f"Chốt sổ {self.checkpoint_date:%d/%m/%Y}"
+
+    @classmethod
+    def latest_on_or_before(cls, day):
+        return cls.objects.filter(checkpoint_date__lte=day).order_by("-checkpoint_date").first()
+
+    @classmethod
+    def create_for(cls, day):
+        """
+        Chốt số dư cuối ngày `day` = mốc trước đó + biến động từ mốc trước đến `day`.
+        Chỉ chốt ngày đã qua (sổ của ngày đó không còn ghi thêm).
+        Trả về None nếu ngày này đã chốt.
+        """
+        from collections import defaultdict
+        from django.db import IntegrityError, transaction
+
+        if day >= date.today():
+            raise ValidationError("Chỉ chốt sổ cho ngày đã qua.")
+
+        previous = cls.objects.filter(checkpoint_date__lt=day).order_by("-checkpoint_date").first()
+
+        balances = defaultdict(int)
+        movements = StockMovement.objects.filter(movement_date__lte=day)
+        if previous:
+            for lot_id, product_id, qty in previous.lines.values_list("stock_item_id", "product_id", "quantity"):
+                balances[(lot_id, product_id)] += qty
+            movements = movements.filter(movement_date__gt=previous.checkpoint_date)
+
+        movement_count = 0
+        grouped = movements.values("stock_item_id", "product_id") \
+                           .annotate(total=models.Sum("quantity"), n=models.Count("id")) \
+                           .order_by()
+        for row in grouped:
+            balances[(row["stock_item_id"], row["product_id"])] += row["total"]
+            movement_count += row["n"]
+
+        try:
+            with transaction.atomic():
+                checkpoint = cls.objects.create(checkpoint_date=day, movement_count=movement_count)
+                StockCheckpointLine.objects.bulk_create([
+                    StockCheckpointLine(checkpoint=checkpoint, stock_item_id=lot_id,
+                                        product_id=product_id, quantity=qty)
+                    for (lot_id, product_id), qty in balances.items()
+                    if qty
+                ], batch_size=1000)
+        except IntegrityError:
+            return None
+        return checkpoint
+
+
+class StockCheckpointLine(models.Model):
+    checkpoint = models.ForeignKey(StockCheckpoint, on_delete=models.CASCADE, related_name="lines")
+    stock_item = models.ForeignKey(
+        StockItem,
+        on_delete=models.DO_NOTHING, db_constraint=False,
+        related_name="+",
+    )
+    product = models.ForeignKey(
+        "SupplierProduct",
+        on_delete=models.DO_NOTHING, db_constraint=False,
+        related_name="+",
+    )
+    quantity = models.IntegerField()
+
+    class Meta:
+        unique_together = ("checkpoint", "stock_item")
+        indexes = [
+            models.Index(fields=["checkpoint", "product"], name="checkpoint_product_idx"),
+        ]
+
+
 # ===================== PHIẾU XUẤT KHO =====================
 from django.core.exceptions import ValidationError
 
 
-class ExportReceipt(models.Model):
+class ExportReceipt(ReceiptTotalsMixin, SearchTextMixin):
     export_code = models.CharField(max_length=20, primary_key=True, verbose_name="Mã phiếu xuất")
     export_date = models.DateField(default=date.today, verbose_name="Ngày xuất")
     receiver_name = models.CharField(max_length=100, blank=True, null=True, verbose_name="Người nhận")
@@ -320,49 +1119,58 @@ class ExportReceipt(models.Model):
     note = models.TextField(blank=True, null=True, verbose_name="Ghi chú")
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, verbose_name="Người tạo")
 
+    total_quantity = models.PositiveIntegerField(default=0, editable=False, verbose_name="Tổng số lượng")
+    total_price = models.DecimalField(max_digits=20, decimal_places=2, default=0, editable=False,
+                                      verbose_name="Tổng tiền")
+    total_discount = models.DecimalField(max_digits=20, decimal_places=2, default=0, editable=False,
+                                         verbose_name="Tổng chiết khấu")
+
     def __str__(self):
         return self.export_code
 
-    @property
-    def total_quantity(self):
-        return sum(item.quantity for item in self.items.all())
-
-    @property
-    def total_price(self):
-        return sum((item.total or 0) for item in self.items.all())
+    def search_parts(self):
+        return [self.export_code, self.destination, self.receiver_name, self.note]
 
-    @property
-    def total_discount(self):
-        total = Decimal("0.00")
-        for it in self.items.all():
-            base = (it.unit_price or 0) * (it.quantity or 0)
-            disc = base * (getattr(it, "discount_percent", 0) or 0) / 100
-            total += disc
-        return total
+    @staticmethod
+    def totals_expressions():
+        return {
+            "total_quantity": models.Sum("quantity"),
+            "total_price": models.Sum("total"),
+            "total_discount": models.Sum(line_discount_expression()),
+        }
 
     @staticmethod
     def generate_new_code():
-        prefix = "XK"
-        last = ExportReceipt.objects.filter(export_code__startswith=prefix).order_by("-export_code").first()
-
-        if not last:
-            return "XK0001"
-
-        last_number = last.export_code.replace(prefix, "")
-        if not last_number.isdigit():
-            return "XK0001"
+        return DocumentSequence.allocate("XK", ExportReceipt, "export_code")
 
-        new_number = int(last_number) + 1
-        return f"{prefix}{new_number:04d}"
+    @staticmethod
+    def preview_new_code():
+        return DocumentSequence.preview("XK", ExportReceipt, "export_code")
 
     def save(self, *args, **kwargs):
         if not self.export_code:
             self.export_code = ExportReceipt.generate_new_code()
+
+        old_date = None
+        if not self._state.adding:
+            old_date = ExportReceipt.objects.filter(pk=self.pk) \
+                                            .values_list("export_date", flat=True).first()
+
         super().save(*args, **kwargs)
 
+        # đổi ngày xuất -> số liệu theo ngày tính lại cho cả ngày cũ lẫn ngày mới
+        if old_date is not None and old_date != as_date(self.export_date):
+            DailySummary.refresh_days([old_date, self.export_date],
+                                      self.items.values_list("stock_item__product_id", flat=True))
+
     class Meta:
         verbose_name = "Phiếu xuất kho"
         verbose_name_plural = "Phiếu xuất kho"
+        indexes = [
+            models.Index(fields=["export_date"], name="export_date_idx"),
+            # ô gợi ý nơi nhận (export_list): DISTINCT đọc trên index, không đọc bảng
+            models.Index(fields=["destination"], name="export_destination_idx"),
+        ]
 
 
 class ExportItem(models.Model):
@@ -374,32 +1182,49 @@ class ExportItem(models.Model):
     unit = models.CharField(max_length=20)
     total = models.DecimalField(max_digits=20, decimal_places=2, default=0)
 
-    def save(self, *args, **kwargs):
-        # luôn dùng đơn giá của lô hàng
+    def fill_totals(self):
+        # luôn dùng đơn giá của lô hàng; cũng gọi trước bulk_create (FefoAllocation.commit)
         if self.stock_item and (not self.unit_price or self.unit_price == 0):
             self.unit_price = self.stock_item.unit_price
 
         base = self.quantity * self.unit_price
         self.total = base - (base * self.discount_percent / 100)
 
-        # trừ tồn kho
-        if self.pk:
-            old = ExportItem.objects.get(pk=self.pk)
-            delta = self.quantity - old.quantity
-        else:
-            delta = self.quantity
+    def save(self, *args, **kwargs):
+        self.fill_totals()
 
-        si = StockItem.objects.get(pk=self.stock_item_id)
-        if si.quantity < delta:
-            raise ValidationError("Không đủ tồn kho")
-        si.quantity -= delta
-        si.save()
+        from django.db import transaction
 
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            # trừ tồn kho
+            if self.pk:
+                old_qty = ExportItem.objects.filter(pk=self.pk) \
+                                            .values_list("quantity", flat=True).first() or 0
+                delta = self.quantity - old_qty
+            else:
+                delta = self.quantity
+
+            StockItem.decrease(self.stock_item_id, delta)
+
+            super().save(*args, **kwargs)
+
+            StockMovement.record(self.stock_item, -delta, "export", self.receipt_id,
+                                 self.receipt.export_date)
+
+            self.receipt.recalculate_totals()
+            DailySummary.refresh(self.receipt.export_date, [self.stock_item.product_id])
+
+    def delete(self, *args, **kwargs):
+        receipt = self.receipt
+        product_id = self.stock_item.product_id
+        result = super().delete(*args, **kwargs)
+        receipt.recalculate_totals()
+        DailySummary.refresh(receipt.export_date, [product_id])
+        return result
 
 
 # ===================== PHIẾU HOÀN =====================
-class ReturnReceipt(models.Model):
+class ReturnReceipt(ReceiptTotalsMixin, SearchTextMixin):
     return_code = models.CharField(max_length=20, primary_key=True)
     return_date = models.DateField(default=date.today)
     note = models.TextField(blank=True, null=True)
@@ -411,37 +1236,52 @@ class ReturnReceipt(models.Model):
         verbose_name="Phiếu xuất tương ứng"
     )
 
+    total_quantity = models.PositiveIntegerField(default=0, editable=False, verbose_name="Tổng số lượng")
+    total_price = models.DecimalField(max_digits=20, decimal_places=2, default=0, editable=False,
+                                      verbose_name="Tổng tiền")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["return_date"], name="return_date_idx"),
+        ]
+
     def __str__(self):
         return self.return_code
 
-    @property
-    def total_quantity(self):
-        return sum(i.quantity for i in self.items.all())
-
-    @property
-    def total_price(self):
-        return sum(i.total for i in self.items.all())
+    def search_parts(self):
+        return [self.return_code, self.note]
 
+    @staticmethod
+    def totals_expressions():
+        return {
+            "total_quantity": models.Sum("quantity"),
+            "total_price": models.Sum("total"),
+        }
 
     @staticmethod
     def generate_new_code():
-        prefix = "HH"
-        last = ReturnReceipt.objects.filter(return_code__startswith=prefix).order_by("-return_code").first()
+        return DocumentSequence.allocate("HH", ReturnReceipt, "return_code")
 
-        if not last:
-            return "HH0001"
-
-        last_number = last.return_code.replace(prefix, "")
-        if not last_number.isdigit():
-            return "HH0001"
+    @staticmethod
+    def preview_new_code():
+        return DocumentSequence.preview("HH", ReturnReceipt, "return_code")
 
-        new_number = int(last_number) + 1
-        return f"{prefix}{new_number:04d}"
     def save(self, *args, **kwargs):
         if not self.return_code:
             self.return_code = ReturnReceipt.generate_new_code()
+
+        old_date = None
+        if not self._state.adding:
+            old_date = ReturnReceipt.objects.filter(pk=self.pk) \
+                                            .values_list("return_date", flat=True).first()
+
         super().save(*args, **kwargs)
 
+        # đổi ngày hoàn -> số liệu theo ngày tính lại cho cả ngày cũ lẫn ngày mới
+        if old_date is not None and old_date != as_date(self.return_date):
+            DailySummary.refresh_days([old_date, self.return_date],
+                                      self.items.values_list("product_id", flat=True))
+
 
 class ReturnItem(models.Model):
     receipt = models.ForeignKey(
@@ -503,6 +1343,9 @@ class ReturnItem(models.Model):
 
         super().save(*args, **kwargs)
 
+        self.receipt.recalculate_totals()
+        DailySummary.refresh(self.receipt.return_date, [self.product_id])
+
         if self.quantity <= 0:
             return
 
@@ -518,26 +1361,154 @@ class ReturnItem(models.Model):
                 location=self.location,
                 unit_price=self.unit_price,
             )
+            # StockItem.save() đã ghi sổ "return" cho lô mới
             self.stock_item = lot
             super().save(update_fields=["stock_item"])
         else:
+            # StockItem.save() ghi phần chênh SL của lô thành dòng "return" của phiếu
             lot = self.stock_item
             lot.quantity = self.quantity
             lot.unit = self.unit
             lot.location = self.location
             lot.expiry_date = self.expiry_date
             lot.unit_price = self.unit_price
-            lot.save()
+            lot.save(movement=("return", self.receipt_id, self.receipt.return_date))
+
+    @classmethod
+    def returned_quantities(cls, export_item_ids, exclude_pks=()):
+        # {export_item_id: tổng SL đã hoàn} – 1 câu GROUP BY cho mọi dòng xuất
+        export_item_ids = {pk for pk in export_item_ids if pk}
+        if not export_item_ids:
+            return {}
+        rows = (
+            cls.objects.filter(export_item_id__in=export_item_ids)
+            .exclude(pk__in=[pk for pk in exclude_pks if pk])
+            .values("export_item_id")
+            .annotate(total=models.Sum("quantity"))
+            .order_by()
+        )
+        return {row["export_item_id"]: row["total"] or 0 for row in rows}
+
+    @classmethod
+    def bulk_return(cls, receipt, items):
+        """
+        Lưu nhiều dòng hoàn (chưa lưu) vào phiếu trong 1 transaction, cùng kết
+        quả với save() từng dòng: mỗi dòng 1 lô hoàn mới + 1 dòng sổ kho.
+        SL đã hoàn của mọi dòng xuất lấy bằng 1 câu GROUP BY rồi kiểm tra trong
+        bộ nhớ (cộng dồn cả các dòng cùng dòng xuất trong phiếu này); lô hoàn
+        được tạo trước nên dòng hoàn chỉ INSERT 1 lần, không save lại stock_item.
+        """
+        from django.db import transaction
+
+        items = list(items)
+
+        # Dòng xuất (kèm lô) chưa nạp -> lấy 1 lần
+        missing = {i.export_item_id for i in items
+                   if i.export_item_id and not cls.export_item.is_cached(i)}
+        if missing:
+            export_items = ExportItem.objects.select_related("stock_item").in_bulk(missing)
+            for item in items:
+                if item.export_item_id in export_items:
+                    item.export_item = export_items[item.export_item_id]
+
+        # ===== KIỂM TRA TOÀN BỘ DÒNG TRƯỚC KHI GHI =====
+        returned = cls.returned_quantities(i.export_item_id for i in items)
+        for n, item in enumerate(items, start=1):
+            item.receipt = receipt
+            if item.export_item_id:
+                # giống save(): thông tin hàng hoàn theo dòng xuất
+                ei = item.export_item
+                item.product_id = ei.stock_item.product_id
+                item.unit = ei.unit
+                item.unit_price = ei.unit_price
+                item.expiry_date = ei.stock_item.expiry_date
+                item.location = ei.stock_item.location
+
+                already = returned.get(ei.pk, 0)
+                if item.quantity + already > ei.quantity:
+                    raise ValidationError(
+                        f"Dòng {n}: số lượng hoàn vượt quá số lượng đã xuất "
+                        f"(còn được hoàn {max(ei.quantity - already, 0)})."
+                    )
+                returned[ei.pk] = already + item.quantity
+
+            if not item.product_id:
+                raise ValidationError(f"Dòng {n}: chưa chọn sản phẩm.")
+            if not item.quantity or item.quantity <= 0:
+                raise ValidationError(f"Dòng {n}: số lượng phải lớn hơn 0.")
+            item.total = item.quantity * item.unit_price
+
+        if not items:
+            return []
+
+        lots = [
+            StockItem(
+                source_type="return",
+                return_receipt=receipt,
+                product_id=item.product_id,
+                quantity=item.quantity,
+                unit=item.unit,
+                expiry_date=item.expiry_date,
+                location=item.location,
+                unit_price=item.unit_price,
+            )
+            for item in items
+        ]
+        for lot in lots:
+            lot.update_status()
+
+        with transaction.atomic():
+            # cần pk lô mới để gắn vào dòng hoàn (SQLite >= 3.35 / PostgreSQL trả về id)
+            StockItem.objects.bulk_create(lots)
+            for item, lot in zip(items, lots):
+                item.stock_item = lot
+            cls.objects.bulk_create(items)
+            StockMovement.bulk_record([
+                StockMovement.build(lot, lot.quantity, "return", receipt.pk, receipt.return_date)
+                for lot in lots
+            ])
+            index_documents("lot", [lot.pk for lot in lots])
+
+            receipt.recalculate_totals()
+            DailySummary.refresh(receipt.return_date, [i.product_id for i in items])
+            invalidate_dashboard()
+
+        return items
 
     def delete(self, *args, **kwargs):
-        # xóa luôn lô tồn kho hoàn nếu có
+        # xóa luôn lô tồn kho hoàn nếu có (sổ kho ghi giảm phần tồn còn lại của lô)
         if self.stock_item_id:
-            self.stock_item.delete()
-        super().delete(*args, **kwargs)
+            lot = self.stock_item
+            StockMovement.record(lot, -lot.quantity, "return", self.receipt_id,
+                                 self.receipt.return_date)
+            lot.delete()
+        receipt = self.receipt
+        result = super().delete(*args, **kwargs)
+        receipt.recalculate_totals()
+        DailySummary.refresh(receipt.return_date, [self.product_id])
+        return result
+
+
+# ===================== TỔNG THEO SUBQUERY =====================
+def subquery_total(queryset, group_by, aggregate=None, output_field=None):
+    """
+    Tổng của các dòng con (queryset đã lọc theo OuterRef) dùng như 1 cột:
+    COALESCE((SELECT SUM(...) ... GROUP BY <khóa cha>), 0).
+    Dùng thay cho annotate(Sum("items__...")) khi queryset cha còn JOIN / lọc
+    theo dòng con (tìm kiếm) -> không bị nhân dòng, không cần GROUP BY cha.
+    """
+    from django.db.models.functions import Coalesce
+
+    aggregate = aggregate if aggregate is not None else models.Sum("quantity")
+    output_field = output_field or models.IntegerField()
+    totals = queryset.order_by().values(group_by) \
+                     .annotate(total=aggregate).values("total")
+    return Coalesce(models.Subquery(totals, output_field=output_field), 0,
+                    output_field=output_field)
 
 
 # ===================== ĐƠN ĐẶT HÀNG (PO) =====================
-class PurchaseOrder(models.Model):
+class PurchaseOrder(ReceiptTotalsMixin, SearchTextMixin):
     STATUS_CHOICES = [
         ("pending", "Chờ duyệt"),
         ("approved", "Đã duyệt"),
@@ -552,24 +1523,30 @@ class PurchaseOrder(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending", verbose_name="Trạng thái")
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Người tạo")
 
+    total_quantity = models.PositiveIntegerField(default=0, editable=False, verbose_name="Tổng số lượng")
+    total_amount = models.DecimalField(max_digits=20, decimal_places=2, default=0, editable=False,
+                                       verbose_name="Tổng tiền")
+
     def __str__(self):
         return self.po_code
 
-    @staticmethod
-    def generate_new_code():
-
-        prefix = "PO"
-        last = PurchaseOrder.objects.filter(po_code__startswith=prefix).order_by("-po_code").first()
+    def search_parts(self):
+        return [self.po_code, self.note]
 
-        if not last:
-            return "PO001"
+    @staticmethod
+    def totals_expressions():
+        return {
+            "total_quantity": models.Sum("quantity"),
+            "total_amount": models.Sum("total"),
+        }
 
-        last_number = last.po_code.replace(prefix, "")
-        if not last_number.isdigit():
-            return "PO001"
+    @staticmethod
+    def generate_new_code():
+        return DocumentSequence.allocate("PO", PurchaseOrder, "po_code")
 
-        new_number = int(last_number) + 1
-        return f"{prefix}{new_number:03d}"
+    @staticmethod
+    def preview_new_code():
+        return DocumentSequence.preview("PO", PurchaseOrder, "po_code")
 
     def save(self, *args, **kwargs):
         if not self.po_code:
@@ -579,17 +1556,22 @@ class PurchaseOrder(models.Model):
     def __str__(self):
         return f"{self.po_code} ({self.get_status_display()})"
 
-    @property
-    def total_quantity(self):
-        return sum(item.quantity for item in self.items.all())
-
-    @property
-    def total_amount(self):
-        return sum(item.total for item in self.items.all())
-
     @property
     def total_value(self):
-        return sum((item.quantity * (item.unit_price or 0)) for item in self.items.all())
+        # dòng PO không có chiết khấu -> giá trị = tổng thành tiền
+        return self.total_amount
+
+    @staticmethod
+    def list_annotations():
+        # cột cho trang danh sách PO (tổng SL / tiền đã lưu sẵn trên PO)
+        return {
+            "item_count": subquery_total(
+                PurchaseOrderItem.objects.filter(po=models.OuterRef("pk")),
+                "po", models.Count("id"),
+            ),
+            "shipped_quantity": PurchaseOrderItem.shipped_subquery(asn__po="pk"),
+            "received_quantity": PurchaseOrderItem.received_subquery(import_receipt__asn__po="pk"),
+        }
 
     def save(self, *args, **kwargs):
         if not self.po_code:
@@ -600,6 +1582,11 @@ class PurchaseOrder(models.Model):
         verbose_name = "Đơn đặt hàng (PO)"
         verbose_name_plural = "Đơn đặt hàng (PO)"
         ordering = ["-created_date"]
+        indexes = [
+            models.Index(fields=["created_date"], name="po_created_date_idx"),
+            models.Index(fields=["status", "created_date"], name="po_status_date_idx"),
+            models.Index(fields=["supplier", "created_date"], name="po_supplier_date_idx"),
+        ]
 
 
 
@@ -651,12 +1638,68 @@ class PurchaseOrderItem(models.Model):
         self.total = (self.unit_price or 0) * (self.quantity or 0)
         super().save(*args, **kwargs)
 
+        self.po.recalculate_totals()
+
+    def delete(self, *args, **kwargs):
+        po = self.po
+        result = super().delete(*args, **kwargs)
+        po.recalculate_totals()
+        return result
+
+    # ---------- TIẾN ĐỘ PO: ĐẶT / ĐÃ GIAO (ASN) / ĐÃ NHẬP KHO ----------
+    @classmethod
+    def shipped_subquery(cls, group_by="asn__po", exclude_asn_items=(), exclude_asn=None, **outer):
+        qs = ASNItem.objects.filter(**{k: models.OuterRef(v) for k, v in outer.items()})
+        if exclude_asn_items:
+            qs = qs.exclude(pk__in=[pk for pk in exclude_asn_items if pk])
+        if exclude_asn is not None:
+            qs = qs.exclude(asn=exclude_asn)
+        return subquery_total(qs, group_by)
+
+    @classmethod
+    def received_subquery(cls, group_by="import_receipt__asn__po", **outer):
+        qs = ImportItem.objects.filter(**{k: models.OuterRef(v) for k, v in outer.items()})
+        return subquery_total(qs, group_by)
+
+    @classmethod
+    def fulfillment(cls, po, exclude_asn_items=(), exclude_asn=None):
+        """
+        Tiến độ từng sản phẩm của 1 PO trong 1 câu SQL (GROUP BY po, product
+        + 2 subquery tương quan), không phụ thuộc số dòng PO:
+            {product_id: {"ordered", "shipped", "received", "remaining"}}
+        shipped = tổng SL trên các ASN của PO (bỏ các dòng ASN đang sửa),
+        received = tổng SL đã nhập kho từ các ASN đó, remaining = ordered - shipped.
+        """
+        po_id = getattr(po, "pk", po)
+        rows = (
+            cls.objects.filter(po_id=po_id)
+            .values("po_id", "product_id")
+            .annotate(
+                ordered=models.Sum("quantity"),
+                shipped=cls.shipped_subquery(
+                    exclude_asn_items=exclude_asn_items, exclude_asn=exclude_asn,
+                    asn__po="po", product="product",
+                ),
+                received=cls.received_subquery(import_receipt__asn__po="po", product="product"),
+            )
+            .order_by()
+        )
+        return {
+            row["product_id"]: {
+                "ordered": row["ordered"],
+                "shipped": row["shipped"],
+                "received": row["received"],
+                "remaining": row["ordered"] - row["shipped"],
+            }
+            for row in rows
+        }
+
 
 # ===================== ASN (THÔNG BÁO GIAO HÀNG) =====================
 from django.db.models import Sum, F, ExpressionWrapper, DecimalField as DjDecimalField
 
 
-class ASN(models.Model):
+class ASN(SearchTextMixin):
     STATUS_CHOICES = [
         ("not_delivered", "Chưa giao"),
         ("delivering", "Đang giao"),
@@ -681,10 +1724,31 @@ class ASN(models.Model):
     def __str__(self):
         return f"{self.asn_code}" + (f" (PO: {self.po.po_code})" if self.po else "")
 
+    def search_parts(self):
+        return [self.asn_code, self.po_id, self.deliverer_name, self.note]
+
     @property
     def total_quantity(self):
         return sum(item.quantity for item in self.items.all())
 
+    @staticmethod
+    def list_annotations():
+        # cột cho trang danh sách ASN: 3 subquery trong cùng câu SELECT,
+        # thay cho items.count / total_value (1 aggregate mỗi ASN)
+        items = ASNItem.objects.filter(asn=models.OuterRef("pk"))
+        return {
+            "item_count": subquery_total(items, "asn", models.Count("id")),
+            "quantity_sum": subquery_total(items, "asn"),
+            "value_sum": subquery_total(
+                items, "asn",
+                Sum(ExpressionWrapper(
+                    F("quantity") * F("unit_price"),
+                    output_field=DjDecimalField(max_digits=20, decimal_places=2),
+                )),
+                output_field=DjDecimalField(max_digits=20, decimal_places=2),
+            ),
+        }
+
     @property
     def total_value(self):
         from django.db.models import Sum, F, ExpressionWrapper, DecimalField
@@ -700,18 +1764,11 @@ class ASN(models.Model):
 
     @staticmethod
     def generate_new_code():
-        prefix = "ASN"
-        last = ASN.objects.filter(asn_code__startswith=prefix).order_by("-asn_code").first()
-
-        if not last:
-            return "ASN0001"
-
-        last_number = last.asn_code.replace(prefix, "")
-        if not last_number.isdigit():
-            return "ASN0001"
+        return DocumentSequence.allocate("ASN", ASN, "asn_code")
 
-        new_number = int(last_number) + 1
-        return f"{prefix}{new_number:04d}"
+    @staticmethod
+    def preview_new_code():
+        return DocumentSequence.preview("ASN", ASN, "asn_code")
 
     def save(self, *args, **kwargs):
         if not self.asn_code:
@@ -727,6 +1784,11 @@ class ASN(models.Model):
     class Meta:
         verbose_name = "Phiếu giao hàng (ASN)"
         verbose_name_plural = "Phiếu giao hàng (ASN)"
+        indexes = [
+            models.Index(fields=["expected_date"], name="asn_expected_date_idx"),
+            models.Index(fields=["status", "expected_date"], name="asn_status_date_idx"),
+            models.Index(fields=["supplier", "expected_date"], name="asn_supplier_date_idx"),
+        ]
 
 
 class ASNItem(models.Model):
@@ -748,6 +1810,9 @@ class ASNItem(models.Model):
     unit_price = models.DecimalField(max_digits=15, decimal_places=2, default=0, verbose_name="Đơn giá")
     expiry_date = models.DateField(null=True, blank=True, verbose_name="Hạn sử dụng")
 
+    # {product_id: tiến độ} của PO – do ASNItemFormSet gán, None = tự truy vấn trong clean()
+    po_fulfillment = None
+
     @property
     def total_value(self):
         return (self.unit_price or 0) * (self.quantity or 0)
@@ -764,21 +1829,16 @@ class ASNItem(models.Model):
         # tổng số lượng giao (tất cả ASN cùng PO) không vượt số lượng đặt trong PO.
 
         if self.asn_id and self.product_id and self.asn.po_id:
-            po = self.asn.po
-
-            # SL đặt
-            ordered = PurchaseOrderItem.objects.filter(
-                po=po,
-                product=self.product,
-            ).aggregate(total=Sum("quantity"))["total"] or 0
-
-            # SL đã giao (các ASN khác)
-            delivered = ASNItem.objects.filter(
-                asn__po=po,
-                product=self.product,
-            ).exclude(pk=self.pk if self.pk else None).aggregate(
-                total=Sum("quantity")
-            )["total"] or 0
+            # Formset nạp sẵn tiến độ PO 1 lần cho mọi dòng (po_fulfillment);
+            # gọi lẻ thì tính riêng cho PO này, bỏ chính dòng đang sửa
+            fulfillment = self.po_fulfillment
+            if fulfillment is None:
+                fulfillment = PurchaseOrderItem.fulfillment(
+                    self.asn.po_id, exclude_asn_items=[self.pk]
+                )
+            line = fulfillment.get(self.product_id)
+            ordered = line["ordered"] if line else 0
+            delivered = line["shipped"] if line else 0
 
             if self.quantity + delivered > ordered:
                 raise ValidationError(
@@ -808,6 +1868,196 @@ class Report(models.Model):
         verbose_name_plural = "Báo cáo thống kê"
 
 
+# ===================== SỐ LIỆU TỔNG HỢP THEO NGÀY =====================
+# Mỗi (ngày, sản phẩm) 1 dòng: SL / giá trị nhập, xuất, hoàn + chiết khấu.
+# Dòng được tính lại từ phiếu mỗi khi dòng hàng của ngày đó thay đổi
+# (DailySummary.refresh) -> báo cáo 1 năm chỉ cộng vài trăm / vài nghìn dòng
+# thay vì toàn bộ ExportItem / ReturnItem / ImportItem.
+# Lệnh rebuild_daily_summary tính lại toàn bộ (hoặc 1 khoảng ngày).
+class DailySummary(models.Model):
+    day = models.DateField(verbose_name="Ngày")
+    product = models.ForeignKey(
+        "SupplierProduct",
+        on_delete=models.DO_NOTHING, db_constraint=False,
+        related_name="+",
+        verbose_name="Sản phẩm NCC",
+    )
+    # danh mục của sản phẩm lúc tổng hợp
+    category = models.ForeignKey(
+        Category,
+        on_delete=models.DO_NOTHING, db_constraint=False,
+        null=True, blank=True,
+        related_name="+",
+        verbose_name="Danh mục",
+    )
+
+    import_quantity = models.PositiveIntegerField(default=0, verbose_name="SL nhập")
+    import_value = models.DecimalField(max_digits=20, decimal_places=2, default=0, verbose_name="Giá trị nhập")
+    import_discount = models.DecimalField(max_digits=20, decimal_places=2, default=0, verbose_name="CK nhập")
+    export_quantity = models.PositiveIntegerField(default=0, verbose_name="SL xuất")
+    export_value = models.DecimalField(max_digits=20, decimal_places=2, default=0, verbose_name="Giá trị xuất")
+    export_discount = models.DecimalField(max_digits=20, decimal_places=2, default=0, verbose_name="CK xuất")
+    return_quantity = models.PositiveIntegerField(default=0, verbose_name="SL hoàn")
+    return_value = models.DecimalField(max_digits=20, decimal_places=2, default=0, verbose_name="Giá trị hoàn")
+
+    MEASURES = (
+        "import_quantity", "import_value", "import_discount",
+        "export_quantity", "export_value", "export_discount",
+        "return_quantity", "return_value",
+    )
+
+    class Meta:
+        verbose_name = "Số liệu theo ngày"
+        verbose_name_plural = "Số liệu theo ngày"
+        unique_together = ("day", "product")
+        indexes = [
+            models.Index(fields=["category", "day"], name="summary_category_day_idx"),
+            models.Index(fields=["product", "day"], name="summary_product_day_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.day:%d/%m/%Y} - SP {self.product_id}"
+
+    @staticmethod
+    def _source_rows(day_filter, product_ids=None):
+        # {(ngày, product_id): {measure: giá trị}} tính thẳng từ dòng phiếu
+        from collections import defaultdict
+        from django.db.models import Sum
+
+        sources = [
+            (ImportItem, "import_receipt__import_date", "product_id", {
+                "import_quantity": Sum("quantity"),
+                "import_value": Sum(line_total_expression()),
+                "import_discount": Sum(line_discount_expression()),
+            }),
+            (ExportItem, "receipt__export_date", "stock_item__product_id", {
+                "export_quantity": Sum("quantity"),
+                "export_value": Sum("total"),
+                "export_discount": Sum(line_discount_expression()),
+            }),
+            (ReturnItem, "receipt__return_date", "product_id", {
+                "return_quantity": Sum("quantity"),
+                "return_value": Sum("total"),
+            }),
+        ]
+
+        rows = defaultdict(dict)
+        for model, date_field, product_field, measures in sources:
+            qs = model.objects.filter(**{f"{date_field}__{k}": v for k, v in day_filter.items()})
+            if product_ids is not None:
+                qs = qs.filter(**{f"{product_field}__in": product_ids})
+            grouped = qs.values(date_field, product_field).annotate(**measures).order_by()
+            for row in grouped:
+                key = (row[date_field], row[product_field])
+                rows[key].update({name: row[name] or 0 for name in measures})
+        return rows
+
+    @classmethod
+    def _replace(cls, existing, rows):
+        from django.db import transaction
+
+        categories = dict(
+            SupplierProduct.objects.filter(pk__in={pk for _, pk in rows})
+                                   .values_list("pk", "category_id")
+        )
+        with transaction.atomic():
+            existing.delete()
+            cls.objects.bulk_create([
+                cls(day=day, product_id=product_id, category_id=categories.get(product_id), **measures)
+                for (day, product_id), measures in rows.items()
+                if any(measures.values())
+            ], batch_size=1000)
+
+    @classmethod
+    def refresh(cls, day, product_ids):
+        """Tính lại các dòng (day, sản phẩm) – gọi khi dòng phiếu của ngày đó thay đổi."""
+        product_ids = [pk for pk in set(product_ids) if pk is not None]
+        if not day or not product_ids:
+            return
+        rows = cls._source_rows({"exact": day}, product_ids)
+        cls._replace(cls.objects.filter(day=day, product_id__in=product_ids), rows)
+
+    @classmethod
+    def refresh_days(cls, days, product_ids):
+        """Tính lại nhiều ngày cho cùng các sản phẩm – phiếu đổi ngày (ngày cũ + ngày mới)."""
+        product_ids = list(product_ids)
+        for day in {as_date(day) for day in days}:
+            cls.refresh(day, product_ids)
+
+    @classmethod
+    def rebuild(cls, start=None, end=None):
+        """Tính lại toàn bộ bảng (hoặc khoảng ngày start..end). Trả về số dòng."""
+        day_filter = {}
+        existing = cls.objects.all()
+        if start:
+            day_filter["gte"] = start
+            existing = existing.filter(day__gte=start)
+        if end:
+            day_filter["lte"] = end
+            existing = existing.filter(day__lte=end)
+        if not day_filter:
+            day_filter["isnull"] = False
+
+        cls._replace(existing, cls._source_rows(day_filter))
+        return existing.count()
+
+    @classmethod
+    def totals(cls, start, end, **filters):
+        # Tổng các chỉ số trong khoảng ngày (lọc thêm product / category nếu cần)
+        from django.db.models import Sum
+
+        result = cls.objects.filter(day__range=[start, end], **filters) \
+                            .aggregate(**{name: Sum(name) for name in cls.MEASURES})
+        return {name: value or 0 for name, value in result.items()}
+
+
+# Xoá cả phiếu: dòng hàng bị xoá theo (CASCADE) mà không gọi delete() của từng
+# dòng -> ghi lại ngày + sản phẩm trước khi xoá, tính lại số liệu sau khi xoá.
+# Nối trong QuanlyConfig.ready() cho 3 loại phiếu (cả xoá hàng loạt ở admin).
+# {tên model phiếu: (cột ngày, đường tới sản phẩm từ dòng hàng)}
+DAILY_SUMMARY_RECEIPTS = {
+    "ImportReceipt": ("import_date", "product_id"),
+    "ExportReceipt": ("export_date", "stock_item__product_id"),
+    "ReturnReceipt": ("return_date", "product_id"),
+}
+
+
+def on_receipt_deleting(sender, instance, **kwargs):
+    date_field, product_path = DAILY_SUMMARY_RECEIPTS[sender.__name__]
+    instance._summary_refresh = (
+        getattr(instance, date_field),
+        list(instance.items.values_list(product_path, flat=True)),
+    )
+
+
+def on_receipt_deleted(sender, instance, **kwargs):
+    day, product_ids = getattr(instance, "_summary_refresh", (None, []))
+    DailySummary.refresh(as_date(day) if day else None, product_ids)
+
+
+# ===================== CHỈ MỤC TÌM KIẾM CHUNG =====================
+class SearchIndexEntry(models.Model):
+    # 1 dòng = 1 tiền tố của 1 từ (viết thường, bỏ dấu) trong 1 chứng từ /
+    # NCC / SP / lô. Ghi / đọc trong QuanLy/search_index.py
+    word = models.CharField(max_length=20, verbose_name="Từ")
+    doc_type = models.CharField(max_length=10, verbose_name="Loại")
+    doc_key = models.CharField(max_length=30, verbose_name="Khoá")
+    weight = models.PositiveSmallIntegerField(default=1, verbose_name="Trọng số")
+
+    class Meta:
+        verbose_name = "Chỉ mục tìm kiếm"
+        verbose_name_plural = "Chỉ mục tìm kiếm"
+        indexes = [
+            # ứng viên của từ dẫn, mới nhất trước, đủ cột để không phải đọc bảng
+            models.Index(fields=["word", "id", "doc_type", "doc_key", "weight"], name="search_word_idx"),
+            # kiểm tra các từ còn lại trên 1 tài liệu / xoá chỉ mục của tài liệu
+            models.Index(fields=["doc_type", "doc_key", "word", "weight"], name="search_doc_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.word} -> {self.doc_type}:{self.doc_key}"
+
+
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
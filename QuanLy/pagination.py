@@ -0,0 +1,144 @@
+# QuanLy/pagination.py
+import base64
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+# ===================== PHÂN TRANG KEYSET (CURSOR) =====================
+# Thay cho OFFSET: mỗi trang lọc "sau khóa cuối cùng của trang trước",
+# nên trang thứ 1000 tốn chi phí như trang đầu tiên.
+#
+# keys: danh sách (tên_field, giảm_dần) – field phải có trong queryset
+#       (field thật hoặc annotate) và tổ hợp các khóa phải là duy nhất
+#       (thường kết thúc bằng "id").
+
+PAGE_SIZE_CHOICES = (25, 50, 100, 200)
+DEFAULT_PAGE_SIZE = 50
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), cls=DjangoJSONEncoder, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, n_keys):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursor(cursor)
+
+    if not isinstance(values, list) or len(values) != n_keys:
+        raise InvalidCursor(cursor)
+    return values
+
+
+def parse_page_size(value, choices=PAGE_SIZE_CHOICES, default=DEFAULT_PAGE_SIZE):
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return size if size in choices else default
+
+
+def _keyset_q(keys, values, forward):
+    # (k1 > v1) OR (k1 = v1 AND k2 > v2) OR ... (đảo chiều theo desc / forward)
+    condition = Q()
+    equal_prefix = Q()
+    for (name, desc), value in zip(keys, values):
+        go_down = desc if forward else not desc
+        lookup = "lt" if go_down else "gt"
+        condition |= equal_prefix & Q(**{f"{name}__{lookup}": value})
+        equal_prefix &= Q(**{name: value})
+
+    # thêm k1 >= v1: thừa về logic nhưng cho DB nhảy thẳng tới vị trí trong
+    # index thay vì đọc lại index từ đầu rồi lọc biểu thức OR
+    (name, desc), value = keys[0], values[0]
+    go_down = desc if forward else not desc
+    return Q(**{f"{name}__{'lte' if go_down else 'gte'}": value}) & condition
+
+
+def _ordering(keys, forward):
+    result = []
+    for name, desc in keys:
+        go_down = desc if forward else not desc
+        result.append(f"-{name}" if go_down else name)
+    return result
+
+
+class KeysetPage:
+    def __init__(self, object_list, keys, page_size, has_next, has_previous):
+        self.object_list = object_list
+        self.keys = keys
+        self.page_size = page_size
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def _cursor_of(self, obj):
+        return encode_cursor(getattr(obj, name) for name, _ in self.keys)
+
+    @property
+    def next_cursor(self):
+        if not self.has_next or not self.object_list:
+            return ""
+        return self._cursor_of(self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if not self.has_previous or not self.object_list:
+            return ""
+        return self._cursor_of(self.object_list[0])
+
+
+def keyset_paginate(queryset, keys, page_size, after=None, before=None):
+    """
+    Trả về KeysetPage theo cursor `after` (trang sau) hoặc `before` (trang trước).
+    Cursor sai định dạng -> quay về trang đầu.
+    """
+    forward = not before
+    cursor = before or after
+    qs = queryset
+
+    if cursor:
+        try:
+            values = decode_cursor(cursor, len(keys))
+        except InvalidCursor:
+            cursor = None
+            forward = True
+        else:
+            qs = qs.filter(_keyset_q(keys, values, forward))
+
+    rows = list(qs.order_by(*_ordering(keys, forward))[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    if forward:
+        return KeysetPage(rows, keys, page_size,
+                          has_next=has_more, has_previous=bool(cursor))
+
+    rows.reverse()
+    return KeysetPage(rows, keys, page_size,
+                      has_next=True, has_previous=has_more)
+
+
+def approximate_count(queryset, limit=10000):
+    """
+    Đếm có chặn trên: chỉ quét tối đa `limit` + 1 dòng.
+    Trả về (số_lượng, chính_xác?) – vượt ngưỡng thì hiển thị "10.000+".
+    """
+    n = queryset.order_by()[:limit + 1].count()
+    if n > limit:
+        return limit, False
+    return n, True
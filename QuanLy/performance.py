@@ -0,0 +1,187 @@
+import json
+import logging
+import random
+import time
+from collections import namedtuple
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates, Template as BackendTemplate
+
+from .metrics import EXTERNAL_CALL_DURATION
+from .querybudget import query_origin
+
+
+# ===================== ĐO THỜI GIAN TỪNG REQUEST =====================
+# RequestTimingMiddleware giữ execute_wrapper DUY NHẤT của request: mỗi câu SQL
+# chỉ bấm giờ 1 lần vào RequestTimings, /metrics (MetricsMiddleware) và nhật ký
+# câu chậm (SlowQueryMiddleware) đọc lại từ đó sau khi view xong – 2 middleware
+# này đứng ngoài RequestTimingMiddleware trong MIDDLEWARE.
+#
+# Request được chọn mẫu còn chia thời gian thành: SQL (số câu + thời gian),
+# render template (backend
+# TimedDjangoTemplates, đã trừ thời gian SQL chạy trong lúc render) và gọi
+# ra ngoài (pdfkit, SMTP... bọc bằng external_call). Kết quả trả về ở header
+# Server-Timing (xem trong tab Network của trình duyệt) và 1 dòng log JSON
+# của logger "QuanLy.performance" (DEBUG, request chậm: WARNING). Thời gian
+# gọi ra ngoài còn được ghi vào /metrics (QuanLy/metrics.py) cho mọi request.
+#
+# settings:
+#   PERF_SAMPLE_RATE      tỉ lệ request được đo chi tiết (0..1), mặc định 1
+#   PERF_SLOW_REQUEST_MS  request chậm hơn mức này ghi log WARNING (kể cả
+#                         request không được chọn mẫu – khi đó chỉ có tổng thời gian)
+#   SLOW_QUERY_MS         câu chạy lâu hơn mức này được giữ lại cho nhật ký câu chậm
+
+logger = logging.getLogger("QuanLy.performance")
+
+_current = ContextVar("quanly_request_timings", default=None)
+REQUEST_ATTR = "_quanly_timings"
+
+SlowStatement = namedtuple("SlowStatement", "connection sql params duration_ms origin")
+
+
+class RequestTimings:
+    def __init__(self, slow_query_ms=None):
+        self.sql_count = 0
+        self.sql_ms = 0.0
+        self.sql_durations = []    # giây, từng câu (histogram /metrics)
+        self.slow_query_ms = slow_query_ms
+        self.slow_queries = []     # SlowStatement – nhật ký câu chậm đọc sau view
+        self.template_ms = 0.0
+        self.external_ms = {}      # {"pdfkit": ms, "smtp": ms}
+
+    def __call__(self, execute, sql, params, many, context):
+        # execute_wrapper của mọi kết nối DB trong request
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = execute(sql, params, many, context)
+            failed = False
+            return result
+        finally:
+            elapsed = time.perf_counter() - started
+            self.sql_durations.append(elapsed)
+            self.sql_ms += elapsed * 1000
+            self.sql_count += 1
+            # câu lỗi không vào nhật ký câu chậm; nơi gọi phải lấy ngay lúc này
+            if (not failed and self.slow_query_ms is not None
+                    and elapsed * 1000 >= self.slow_query_ms):
+                self.slow_queries.append(SlowStatement(
+                    context["connection"], sql, params, elapsed * 1000, query_origin(),
+                ))
+
+    def server_timing(self, total_ms):
+        parts = [
+            f'sql;dur={self.sql_ms:.1f};desc="{self.sql_count} queries"',
+            f"tpl;dur={self.template_ms:.1f}",
+        ]
+        parts += [f"ext-{name};dur={ms:.1f}" for name, ms in self.external_ms.items()]
+        parts.append(f"total;dur={total_ms:.1f}")
+        return ", ".join(parts)
+
+    def as_dict(self):
+        return {
+            "sql_count": self.sql_count,
+            "sql_ms": round(self.sql_ms, 1),
+            "template_ms": round(self.template_ms, 1),
+            "external_ms": {name: round(ms, 1) for name, ms in self.external_ms.items()},
+        }
+
+
+def current_timings():
+    """RequestTimings của request đang chạy, None nếu không được chọn mẫu."""
+    return _current.get()
+
+
+def request_timings(request):
+    """RequestTimings đã gom của request (mọi request, kể cả không chọn mẫu)."""
+    return getattr(request, REQUEST_ATTR, None)
+
+
+@contextmanager
+def external_call(name):
+    # with external_call("pdfkit"): pdfkit.from_string(...)
+    # luôn ghi vào /metrics; Server-Timing chỉ khi request được chọn mẫu
+    timings = _current.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        EXTERNAL_CALL_DURATION.observe(elapsed, call=name)
+        if timings is not None:
+            timings.external_ms[name] = timings.external_ms.get(name, 0.0) + elapsed * 1000
+
+
+# ---------- template ----------
+class TimedTemplate(BackendTemplate):
+    def render(self, context=None, request=None):
+        timings = _current.get()
+        if timings is None:
+            return super().render(context, request)
+        started, sql_before = time.perf_counter(), timings.sql_ms
+        try:
+            return super().render(context, request)
+        finally:
+            # QuerySet lười chạy SQL trong lúc render -> tính vào sql, không tính 2 lần
+            elapsed = (time.perf_counter() - started) * 1000
+            timings.template_ms += elapsed - (timings.sql_ms - sql_before)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Backend DjangoTemplates có đo thời gian render (TEMPLATES["BACKEND"])."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+# ---------- middleware ----------
+class RequestTimingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    @property
+    def slow_ms(self):
+        return getattr(settings, "PERF_SLOW_REQUEST_MS", 1000)
+
+    def __call__(self, request):
+        # SQL luôn được gom (cho /metrics + câu chậm); chọn mẫu chỉ quyết định
+        # đo template / gọi ra ngoài và header Server-Timing
+        sampled = random.random() < getattr(settings, "PERF_SAMPLE_RATE", 1.0)
+        timings = RequestTimings(slow_query_ms=getattr(settings, "SLOW_QUERY_MS", 200))
+        setattr(request, REQUEST_ATTR, timings)
+        token = _current.set(timings if sampled else None)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(timings))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total_ms = (time.perf_counter() - started) * 1000
+
+        if sampled:
+            response["Server-Timing"] = timings.server_timing(total_ms)
+            self.log(request, response, total_ms, timings)
+        elif total_ms >= self.slow_ms:
+            self.log(request, response, total_ms, None)
+        return response
+
+    def log(self, request, response, total_ms, timings):
+        match = getattr(request, "resolver_match", None)
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "view": match.view_name if match else None,
+            "status": response.status_code,
+            "total_ms": round(total_ms, 1),
+            **(timings.as_dict() if timings else {"sampled": False}),
+        }
+        level = logging.WARNING if total_ms >= self.slow_ms else logging.DEBUG
+        logger.log(level, json.dumps(record, ensure_ascii=False), extra={"performance": record})
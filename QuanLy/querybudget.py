@@ -0,0 +1,91 @@
+import sys
+from collections import Counter, namedtuple
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection
+from django.template.base import Template
+
+
+# ===================== GHI CÂU SQL KÈM NƠI GỌI =====================
+# Ghi mọi câu SQL chạy trên 1 kết nối kèm dòng code của dự án đã gây ra nó
+# (và template đang render nếu có), để khi số câu truy vấn của 1 trang tăng
+# theo dữ liệu thì thấy ngay câu nào lặp và lặp từ đâu.
+
+CapturedQuery = namedtuple("CapturedQuery", "sql origin")
+
+PROJECT_DIR = str(Path(settings.BASE_DIR).resolve())
+# các module đo đạc (execute_wrapper / backend template) không phải nơi gọi
+IGNORED_FILES = {
+    str(Path(__file__).resolve().with_name(name))
+    for name in ("querybudget.py", "performance.py", "slow_queries.py")
+}
+
+
+def _project_frame(path):
+    return (path.startswith(PROJECT_DIR) and "site-packages" not in path
+            and path not in IGNORED_FILES and not path.endswith("tests.py"))
+
+
+def query_origin():
+    """
+    'QuanLy/views.py:123 in stock_list' của frame dự án gần câu SQL nhất,
+    thêm ' [template.html]' nếu câu SQL chạy trong lúc render template.
+    """
+    origin, template = None, None
+    frame = sys._getframe(1)
+    while frame is not None and (origin is None or template is None):
+        code = frame.f_code
+        if origin is None and _project_frame(code.co_filename):
+            relative = Path(code.co_filename).relative_to(PROJECT_DIR).as_posix()
+            origin = f"{relative}:{frame.f_lineno} in {code.co_name}"
+        if template is None and code.co_name == "_render" \
+                and isinstance(frame.f_locals.get("self"), Template):
+            template = frame.f_locals["self"].origin.template_name
+        frame = frame.f_back
+    origin = origin or "?"
+    return f"{origin} [{template}]" if template else origin
+
+
+class QueryRecorder:
+    """
+    with QueryRecorder() as recorder: ...  -> recorder.queries là danh sách
+    CapturedQuery theo thứ tự chạy.
+    """
+
+    def __init__(self, using=connection):
+        self.connection = using
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(CapturedQuery(sql, query_origin()))
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._wrapper = self.connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._wrapper.__exit__(*exc_info)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def counts(self):
+        return Counter(self.queries)
+
+
+def grown_queries(before, after):
+    """[(số lần trước, số lần sau, CapturedQuery)] của các câu chạy nhiều lần hơn ở `after`."""
+    old, new = before.counts(), after.counts()
+    grown = [(old.get(query, 0), n, query) for query, n in new.items() if n > old.get(query, 0)]
+    return sorted(grown, key=lambda row: row[0] - row[1])
+
+
+def format_grown(before, after, limit=10):
+    lines = [f"{len(before)} -> {len(after)} câu truy vấn"]
+    for old, new, query in grown_queries(before, after)[:limit]:
+        lines.append(f"  {old} -> {new} lần  {query.origin}")
+        lines.append(f"      {query.sql[:300]}")
+    return "\n".join(lines)
@@ -0,0 +1,148 @@
+# QuanLy/roles.py
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+
+# ===================== NHÓM QUYỀN CỦA USER (CACHE) =====================
+# group_required, get_permission_flags và filter has_any_group đều cần biết
+# user thuộc nhóm nào. Danh sách tên nhóm được đọc 1 lần và gắn lên chính
+# object request.user (mỗi request có object user riêng) -> các chỗ kiểm tra
+# sau trong cùng request không chạy thêm câu SQL nào.
+#
+# ROLE_CACHE_IN_SESSION = True: lưu thêm vào session kèm mã phiên bản nhóm
+# của user. Mã phiên bản nằm trong cache ROLE_VERSION_CACHE – cache dùng chung
+# cho mọi worker (mặc định bảng cache trong CSDL, tạo lúc migrate), không phải
+# LocMemCache riêng từng tiến trình. Thêm/bớt nhóm (m2m_changed), đổi tên hay
+# xoá nhóm (post_save / post_delete của Group) xoá mã phiên bản của các user
+# liên quan; thiếu mã (bị xoá, cache bị dọn) = đọc lại nhóm từ CSDL.
+
+USER_ATTR = "_quanly_group_names"
+SESSION_KEY = "_quanly_group_names"
+
+
+def _version_cache():
+    return caches[getattr(settings, "ROLE_VERSION_CACHE", "default")]
+
+
+def _version_key(user_id):
+    return f"roles:version:{user_id}"
+
+
+def _roles_version(user_id):
+    # Chưa có mã -> cấp mã ngẫu nhiên mới: khác mọi mã đang nằm trong session
+    # (số đếm bắt đầu lại từ 1 thì trùng được bản cũ) nên session phải đọc lại
+    cache = _version_cache()
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+def invalidate_user_groups(user_ids):
+    keys = [_version_key(user_id) for user_id in user_ids]
+    if keys:
+        _version_cache().delete_many(keys)
+
+
+def _load_from_session(request, user, version):
+    session = getattr(request, "session", None)
+    if session is None:
+        return None
+    stored = session.get(SESSION_KEY)
+    if not stored or stored.get("user") != user.pk:
+        return None
+    if stored.get("version") != version:
+        return None
+    return frozenset(stored["groups"])
+
+
+def _save_to_session(request, user, names, version):
+    session = getattr(request, "session", None)
+    if session is None:
+        return
+    session[SESSION_KEY] = {
+        "user": user.pk,
+        "version": version,
+        "groups": sorted(names),
+    }
+
+
+def get_group_names(user, request=None):
+    """Tập tên nhóm của user, chỉ truy vấn 1 lần cho mỗi object user."""
+    if not getattr(user, "is_authenticated", False):
+        return frozenset()
+
+    names = getattr(user, USER_ATTR, None)
+    if names is not None:
+        return names
+
+    use_session = request is not None and getattr(settings, "ROLE_CACHE_IN_SESSION", False)
+    if use_session:
+        # lấy mã phiên bản TRƯỚC khi đọc CSDL: nhóm đổi giữa chừng thì mã bị xoá,
+        # bản vừa lưu vào session mang mã cũ và request sau tự đọc lại
+        version = _roles_version(user.pk)
+        names = _load_from_session(request, user, version)
+
+    if names is None:
+        names = frozenset(user.groups.values_list("name", flat=True))
+        if use_session:
+            _save_to_session(request, user, names, version)
+
+    setattr(user, USER_ATTR, names)
+    return names
+
+
+def clear_group_cache(user):
+    # Dùng khi đổi nhóm của chính user đang xử lý trong request
+    try:
+        delattr(user, USER_ATTR)
+    except AttributeError:
+        pass
+
+
+def user_in_groups(user, group_names, request=None):
+    return bool(get_group_names(user, request) & set(group_names))
+
+
+def on_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Nối trong QuanlyConfig.ready() cho User.groups.through
+    if action not in ("post_add", "post_remove", "post_clear", "pre_clear"):
+        return
+
+    if not reverse:
+        # user.groups.add(...) -> instance là User
+        clear_group_cache(instance)
+        invalidate_user_groups([instance.pk])
+    elif action == "pre_clear":
+        # group.user_set.clear(): pk_set rỗng -> lấy danh sách trước khi xoá
+        invalidate_user_groups(list(instance.user_set.values_list("pk", flat=True)))
+    elif pk_set:
+        invalidate_user_groups(pk_set)
+
+
+def on_group_saved(sender, instance, created, **kwargs):
+    # Đổi tên nhóm -> tên trong session của các thành viên đã cũ
+    if not created:
+        invalidate_user_groups(list(instance.user_set.values_list("pk", flat=True)))
+
+
+def on_group_deleting(sender, instance, **kwargs):
+    # Xoá nhóm xoá luôn dòng auth_user_groups mà không phát m2m_changed ->
+    # ghi lại thành viên trước khi xoá, bỏ phiên bản sau khi xoá xong
+    instance._quanly_member_ids = list(instance.user_set.values_list("pk", flat=True))
+
+
+def on_group_deleted(sender, instance, **kwargs):
+    invalidate_user_groups(getattr(instance, "_quanly_member_ids", []))
+
+
+def ensure_version_cache(sender=None, using=DEFAULT_DB_ALIAS, **kwargs):
+    """post_migrate: tạo bảng cache trong CSDL (ROLE_VERSION_CACHE), có rồi thì bỏ qua."""
+    from django.core.management import call_command
+    call_command("createcachetable", database=using, verbosity=0)
@@ -0,0 +1,244 @@
+# QuanLy/search.py
+import re
+import unicodedata
+
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connection, connections, models
+from django.db.models.expressions import RawSQL
+
+
+# ===================== TÌM KIẾM KHÔNG DẤU =====================
+# Mỗi bảng cần tìm (sản phẩm, NCC, danh mục, phiếu, PO, ASN) có cột search_text:
+# các trường chữ của chính dòng đó, viết thường + bỏ dấu tiếng Việt
+# ("Sữa tươi" -> "sua tuoi"), tính lại mỗi lần save().
+#
+# SQLite có FTS5 (>= 3.34, tokenizer trigram): migration 0020 tạo bảng
+# <bảng>_search (external content) + trigger đồng bộ theo cột search_text
+# (post_migrate cài lại nếu migration sau làm mất), lọc bằng MATCH và xếp
+# hạng bằng bm25(). CSDL khác / SQLite cũ: lọc search_text LIKE '%...%' trên
+# cột đã chuẩn hoá, xếp khớp đầu chuỗi lên trước.
+#
+# Quan hệ sang bảng khác (NCC của phiếu, sản phẩm trên dòng phiếu...) không
+# chép vào search_text mà lọc qua matching(<model>, q) -> đổi tên NCC / SP
+# không phải cập nhật lại các phiếu.
+
+TRIGRAM_MIN_LENGTH = 3      # tokenizer trigram không khớp được từ < 3 ký tự
+NO_RANK = 1e9               # dòng chỉ khớp qua bảng liên quan xếp sau cùng
+
+
+def normalize_text(*parts):
+    text = " ".join(str(p) for p in parts if p not in (None, ""))
+    text = text.lower().replace("đ", "d")
+    text = unicodedata.normalize("NFD", text)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def search_terms(query):
+    return normalize_text(query).split()
+
+
+class SearchTextMixin(models.Model):
+    # Model con phải khai báo search_parts() -> các giá trị chữ cần tìm của
+    # chính dòng đó; thiếu thì báo lỗi ngay khi nạp models.
+    search_text = models.TextField(blank=True, default="", editable=False)
+
+    class Meta:
+        abstract = True
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if not callable(getattr(cls, "search_parts", None)):
+            raise TypeError(f"{cls.__name__} dùng SearchTextMixin nhưng chưa khai báo search_parts()")
+
+    def build_search_text(self):
+        return normalize_text(*self.search_parts())
+
+    def save(self, *args, **kwargs):
+        self.search_text = self.build_search_text()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = set(update_fields) | {"search_text"}
+        super().save(*args, **kwargs)
+
+
+def search_models():
+    from django.apps import apps
+    return [m for m in apps.get_app_config("QuanLy").get_models() if issubclass(m, SearchTextMixin)]
+
+
+# ---------- FTS5 ----------
+_fts_tables = {}
+
+
+def fts_supported(conn=connection):
+    # FTS5 + tokenizer trigram: SQLite >= 3.34 biên dịch kèm FTS5
+    if conn.vendor != "sqlite":
+        return False
+    with conn.cursor() as cursor:
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE temp.quanly_fts_probe USING fts5(x, tokenize='trigram')")
+        except OperationalError:
+            return False
+        cursor.execute("DROP TABLE temp.quanly_fts_probe")
+    return True
+
+
+FTS_TRIGGER_SUFFIXES = ("_ai", "_ad", "_au")
+
+
+def install_fts(conn, db_table):
+    """
+    (Tạo lại) bảng FTS <db_table>_search theo cột search_text + trigger đồng bộ,
+    rồi nạp lại toàn bộ. Dùng trong lệnh rebuild_search_index và sau mỗi lần
+    migrate (ensure_fts) – ALTER trên SQLite dựng lại bảng gốc, xoá trigger.
+    """
+    fts = f"{db_table}_search"
+    statements = [
+        f'DROP TABLE IF EXISTS "{fts}"',
+        f'CREATE VIRTUAL TABLE "{fts}" USING fts5('
+        f"search_text, content='{db_table}', content_rowid='rowid', tokenize='trigram')",
+        f'DROP TRIGGER IF EXISTS "{fts}_ai"',
+        f'DROP TRIGGER IF EXISTS "{fts}_ad"',
+        f'DROP TRIGGER IF EXISTS "{fts}_au"',
+        f'CREATE TRIGGER "{fts}_ai" AFTER INSERT ON "{db_table}" BEGIN '
+        f'INSERT INTO "{fts}"(rowid, search_text) VALUES (new.rowid, new.search_text); END',
+        f'CREATE TRIGGER "{fts}_ad" AFTER DELETE ON "{db_table}" BEGIN '
+        f'INSERT INTO "{fts}"("{fts}", rowid, search_text) VALUES (\'delete\', old.rowid, old.search_text); END',
+        f'CREATE TRIGGER "{fts}_au" AFTER UPDATE OF search_text ON "{db_table}" BEGIN '
+        f'INSERT INTO "{fts}"("{fts}", rowid, search_text) VALUES (\'delete\', old.rowid, old.search_text); '
+        f'INSERT INTO "{fts}"(rowid, search_text) VALUES (new.rowid, new.search_text); END',
+        f'INSERT INTO "{fts}"("{fts}") VALUES (\'rebuild\')',
+    ]
+    with conn.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+    reset_fts_cache()
+
+
+def ensure_fts(sender=None, using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    post_migrate: cài lại bảng FTS + trigger cho bảng nào bị migration làm mất
+    (SQLite dựng lại bảng khi ALTER -> trigger bị xoá, rowid có thể đổi).
+    Bảng còn đủ thì bỏ qua, không nạp lại chỉ mục.
+    """
+    conn = connections[using]
+    if not fts_supported(conn):
+        return
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")
+        existing = {row[0] for row in cursor.fetchall()}
+    for model in search_models():
+        db_table = model._meta.db_table
+        fts = f"{db_table}_search"
+        if db_table not in existing:
+            continue
+        if {fts, *(fts + suffix for suffix in FTS_TRIGGER_SUFFIXES)} - existing:
+            install_fts(conn, db_table)
+    reset_fts_cache()
+
+
+def fts_table(model):
+    # Tên bảng FTS của model nếu CSDL hiện tại có (kiểm tra 1 lần / CSDL)
+    if connection.vendor != "sqlite":
+        return None
+    key = connection.settings_dict["NAME"]
+    if key not in _fts_tables:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE '%\\_search' ESCAPE '\\'"
+            )
+            _fts_tables[key] = {row[0] for row in cursor.fetchall()}
+    name = f"{model._meta.db_table}_search"
+    return name if name in _fts_tables[key] else None
+
+
+def reset_fts_cache():
+    _fts_tables.clear()
+
+
+def _match_expression(terms):
+    return " AND ".join('"%s"' % t.replace('"', '""') for t in terms)
+
+
+class FtsRank(models.Func):
+    """bm25() của dòng hiện tại trong bảng FTS (âm, càng nhỏ càng khớp)."""
+    output_field = models.FloatField()
+
+    def __init__(self, fts, db_table, pk_column, match):
+        super().__init__(models.F("pk"))
+        self.fts, self.db_table, self.pk_column, self.match = fts, db_table, pk_column, match
+
+    def as_sql(self, compiler, connection, **extra_context):
+        # rowid lấy qua pk của dòng ngoài -> đúng cả khi queryset bị đặt bí danh (subquery)
+        pk_sql, pk_params = compiler.compile(self.source_expressions[0])
+        fts = self.fts
+        sql = (
+            f'(SELECT bm25("{fts}") FROM "{fts}" WHERE "{fts}" MATCH %s AND "{fts}".rowid = '
+            f'(SELECT r.rowid FROM "{self.db_table}" r WHERE r."{self.pk_column}" = {pk_sql}))'
+        )
+        return sql, [self.match, *pk_params]
+
+
+def _conditions(model, terms):
+    # (điều kiện lọc, biểu thức xếp hạng – nhỏ hơn là khớp hơn)
+    table = fts_table(model)
+    long_terms = [t for t in terms if len(t) >= TRIGRAM_MIN_LENGTH]
+    short_terms = [t for t in terms if len(t) < TRIGRAM_MIN_LENGTH]
+
+    condition = models.Q()
+    for term in short_terms if table and long_terms else terms:
+        condition &= models.Q(search_text__contains=term)
+
+    if table and long_terms:
+        db_table = model._meta.db_table
+        pk_column = model._meta.pk.column
+        match = _match_expression(long_terms)
+        condition &= models.Q(pk__in=RawSQL(
+            f'SELECT "{pk_column}" FROM "{db_table}" WHERE rowid IN '
+            f'(SELECT rowid FROM "{table}" WHERE "{table}" MATCH %s)',
+            [match],
+        ))
+        rank = FtsRank(table, db_table, pk_column, match)
+    else:
+        # khớp đầu chuỗi (thường là mã) trước, khớp giữa chuỗi sau
+        rank = models.Case(
+            models.When(condition & models.Q(search_text__startswith=terms[0]), then=models.Value(0.0)),
+            models.When(condition, then=models.Value(1.0)),
+            default=None,
+            output_field=models.FloatField(),
+        )
+    return condition, rank
+
+
+def matching(model, query):
+    """pk các dòng của model khớp query – dùng làm subquery: field__in=matching(...)."""
+    terms = search_terms(query)
+    if not terms:
+        return model.objects.none().values("pk")
+    condition, _ = _conditions(model, terms)
+    return model.objects.filter(condition).values("pk")
+
+
+def apply_search(queryset, query, also=()):
+    """
+    Lọc queryset theo search_text của chính nó, hoặc theo các điều kiện `also`
+    (Q / Exists trên bảng liên quan). Gắn search_rank để xếp kết quả
+    (xem ordered_by_rank). Không JOIN bảng con nên không cần .distinct().
+    """
+    terms = search_terms(query)
+    if not terms:
+        return queryset
+
+    condition, rank = _conditions(queryset.model, terms)
+    for extra in also:
+        condition |= extra
+    return queryset.filter(condition).annotate(
+        search_rank=models.functions.Coalesce(rank, models.Value(NO_RANK))
+    )
+
+
+def ordered_by_rank(queryset, *ordering):
+    # Có tìm kiếm -> khớp tốt nhất lên trước, sau đó theo thứ tự thường của trang
+    if "search_rank" in queryset.query.annotations:
+        return queryset.order_by("search_rank", *ordering)
+    return queryset.order_by(*ordering)
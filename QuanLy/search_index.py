@@ -0,0 +1,296 @@
+# QuanLy/search_index.py
+import re
+from collections import namedtuple
+
+from django.apps import apps as global_apps
+from django.db import models, transaction
+from django.urls import reverse
+from django.utils.http import urlencode
+
+from .search import normalize_text, search_terms
+
+
+# ===================== TÌM KIẾM CHUNG (CHỈ MỤC ĐẢO) =====================
+# /api/search tìm 1 lần trên mọi loại chứng từ: phiếu nhập / xuất / hoàn, PO,
+# ASN, NCC, sản phẩm, lô. Bảng SearchIndexEntry lưu (token, loại, khoá, trọng số)
+# với token là mọi tiền tố >= 2 ký tự của từng từ đã bỏ dấu ("sua" -> "su",
+# "sua") -> tìm khi đang gõ dở cũng là so khớp bằng, không quét khoảng.
+#
+# Truy vấn: lấy từ hiếm nhất (đếm trên index, có chặn trên) làm từ dẫn, đọc
+# các dòng mới nhất của nó theo index (word, id, ...); các từ còn lại lọc bằng
+# EXISTS trên index (doc_type, doc_key, word) trước LIMIT CANDIDATE_LIMIT. Chi
+# phí không phụ thuộc tổng số tài liệu (xem lệnh benchmark_search). Đổi lại,
+# khi mọi từ đều rất phổ biến chỉ xếp hạng trong CANDIDATE_LIMIT tài liệu mới
+# nhất khớp đủ từ.
+#
+# Đồng bộ: post_save / post_delete của các model bên dưới (nối trong
+# QuanlyConfig.ready) + index_documents() sau các đường bulk_create lô.
+# Sửa tên / mã sản phẩm -> lập lại chỉ mục các lô của sản phẩm đó.
+
+CODE_WEIGHT = 3         # từ trong mã chứng từ / mã SP / MST...
+TEXT_WEIGHT = 1         # từ trong tên, ghi chú, địa chỉ...
+EXACT_BONUS = 2         # token là nguyên từ (không chỉ là tiền tố) nhân trọng số
+MIN_PREFIX = 2
+MAX_WORD_LENGTH = 20    # từ / mã dài hơn chỉ lập chỉ mục 20 ký tự đầu
+CANDIDATE_LIMIT = 1000
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 50
+
+DocType = namedtuple("DocType", "model label codes texts related")
+
+# loại -> (model, nhãn, trường mã, trường chữ, select_related khi hiển thị)
+DOC_TYPES = {
+    "import": DocType("ImportReceipt", "Phiếu nhập", ["import_code"], ["note"], ["supplier"]),
+    "export": DocType("ExportReceipt", "Phiếu xuất", ["export_code"],
+                      ["destination", "receiver_name", "note"], []),
+    "return": DocType("ReturnReceipt", "Phiếu hoàn", ["return_code"], ["note"], []),
+    "po": DocType("PurchaseOrder", "Đơn đặt hàng", ["po_code"], ["note"], ["supplier"]),
+    "asn": DocType("ASN", "Phiếu giao hàng (ASN)", ["asn_code", "po_id"],
+                   ["deliverer_name", "note"], ["supplier"]),
+    "supplier": DocType("Supplier", "Nhà cung ứng", ["supplier_code", "tax_code", "phone"],
+                        ["company_name", "contact_name", "address"], []),
+    "product": DocType("SupplierProduct", "Sản phẩm", ["product_code"], ["name"], ["supplier"]),
+    "lot": DocType("StockItem", "Lô hàng",
+                   ["product__product_code", "import_receipt__import_code", "return_receipt__return_code"],
+                   ["product__name", "location"],
+                   ["product", "import_receipt", "return_receipt"]),
+}
+
+_WORD_SPLIT = re.compile(r"[^0-9a-z]+")
+
+
+def doc_type_of(model):
+    for name, doc in DOC_TYPES.items():
+        if doc.model == model.__name__:
+            return name
+    return None
+
+
+def document_words(row, doc):
+    # {token: trọng số} của 1 tài liệu (row: dict values() theo trường mã / chữ)
+    return tokenize(
+        normalize_text(*(row[f] for f in doc.codes)),
+        normalize_text(*(row[f] for f in doc.texts)),
+    )
+
+
+def tokenize(code_text, text):
+    # chữ đã chuẩn hoá -> {tiền tố: trọng số}, giữ trọng số cao nhất mỗi token
+    tokens = {}
+    for source, weight in ((code_text, CODE_WEIGHT), (text, TEXT_WEIGHT)):
+        for word in _WORD_SPLIT.split(source):
+            word = word[:MAX_WORD_LENGTH]
+            for length in range(MIN_PREFIX, len(word) + 1):
+                token = word[:length]
+                score = weight * EXACT_BONUS if length == len(word) else weight
+                tokens[token] = max(tokens.get(token, 0), score)
+    return tokens
+
+
+def _entry_model(apps):
+    return apps.get_model("QuanLy", "SearchIndexEntry")
+
+
+def index_documents(doc_type, keys, apps=global_apps, batch_size=2000):
+    """
+    (Lập lại) chỉ mục cho các tài liệu theo pk: 1 SELECT values() các trường
+    cần tìm, xoá dòng cũ, bulk_create dòng mới. Dùng được trong migration
+    (truyền apps lịch sử) vì chỉ đọc trường, không gọi method model.
+    """
+    doc = DOC_TYPES[doc_type]
+    model = apps.get_model("QuanLy", doc.model)
+    Entry = _entry_model(apps)
+    keys = list(keys)
+    if not keys:
+        return 0
+
+    entries = []
+    rows = model.objects.filter(pk__in=keys).values("pk", *doc.codes, *doc.texts)
+    for row in rows.iterator(chunk_size=batch_size):
+        key = str(row["pk"])
+        entries.extend(
+            Entry(word=word, doc_type=doc_type, doc_key=key, weight=weight)
+            for word, weight in document_words(row, doc).items()
+        )
+
+    with transaction.atomic():
+        remove_documents(doc_type, keys, apps=apps)
+        Entry.objects.bulk_create(entries, batch_size=batch_size)
+    return len(entries)
+
+
+def remove_documents(doc_type, keys, apps=global_apps):
+    _entry_model(apps).objects.filter(
+        doc_type=doc_type, doc_key__in=[str(k) for k in keys]
+    ).delete()
+
+
+def rebuild_index(apps=global_apps, chunk_size=2000):
+    # Toàn bộ chỉ mục (migration / lệnh rebuild_search_index)
+    _entry_model(apps).objects.all().delete()
+    total = 0
+    for doc_type, doc in DOC_TYPES.items():
+        pks = list(apps.get_model("QuanLy", doc.model).objects.values_list("pk", flat=True))
+        for start in range(0, len(pks), chunk_size):
+            total += index_documents(doc_type, pks[start:start + chunk_size], apps=apps)
+    return total
+
+
+# ---------- đồng bộ qua signal ----------
+def on_document_saved(sender, instance, raw=False, **kwargs):
+    if raw:     # loaddata: chạy rebuild_search_index sau khi nạp
+        return
+    index_documents(doc_type_of(sender), [instance.pk])
+    if doc_type_of(sender) == "product":
+        # lô mang mã / tên sản phẩm
+        lots = global_apps.get_model("QuanLy", "StockItem").objects.filter(product=instance)
+        index_documents("lot", lots.values_list("pk", flat=True))
+
+
+def on_document_deleted(sender, instance, **kwargs):
+    remove_documents(doc_type_of(sender), [instance.pk])
+
+
+def connect_signals():
+    from django.db.models.signals import post_delete, post_save
+
+    for doc_type, doc in DOC_TYPES.items():
+        model = global_apps.get_model("QuanLy", doc.model)
+        post_save.connect(on_document_saved, sender=model, dispatch_uid=f"search_index_save_{doc_type}")
+        post_delete.connect(on_document_deleted, sender=model, dispatch_uid=f"search_index_delete_{doc_type}")
+
+
+# ---------- truy vấn ----------
+def query_terms(query):
+    words = _WORD_SPLIT.split(" ".join(search_terms(query)))
+    return list(dict.fromkeys(w[:MAX_WORD_LENGTH] for w in words if len(w) >= MIN_PREFIX))
+
+
+def ranked_documents(query, types=None, limit=DEFAULT_LIMIT):
+    """
+    [(doc_type, doc_key, score)] khớp đủ mọi từ trong query (khớp đầu từ),
+    điểm = tổng trọng số các từ, hoà điểm thì tài liệu lập chỉ mục sau
+    (mới hơn) lên trước. 1 câu SQL (+ 1 câu đếm mỗi từ khi query nhiều từ).
+    """
+    Entry = _entry_model(global_apps)
+    terms = query_terms(query)
+    if not terms:
+        return []
+
+    entries = Entry.objects.all()
+    if types:
+        entries = entries.filter(doc_type__in=types)
+
+    driver = _rarest_term(entries, terms)
+    others = [t for t in terms if t != driver]
+
+    # ứng viên: dòng mới nhất của từ dẫn (index (word, id, ...) đủ cột, không
+    # đọc bảng). Các từ còn lại lọc bằng EXISTS trên index (doc_type, doc_key,
+    # word) ngay trong SQL, trước LIMIT -> tài liệu cũ khớp đủ từ không bị
+    # các tài liệu mới chỉ khớp từ dẫn đẩy ra ngoài CANDIDATE_LIMIT.
+    def term_rows(term):
+        return Entry.objects.filter(
+            doc_type=models.OuterRef("doc_type"),
+            doc_key=models.OuterRef("doc_key"),
+            word=term,
+        )
+
+    candidates = entries.filter(word=driver)
+    for term in others:
+        candidates = candidates.filter(models.Exists(term_rows(term)))
+    candidates = candidates.annotate(**{
+        f"term_{n}": models.Subquery(term_rows(term).values("weight")[:1])
+        for n, term in enumerate(others)
+    }).order_by("-id").values_list(
+        "id", "doc_type", "doc_key", "weight", *[f"term_{n}" for n in range(len(others))]
+    )[:CANDIDATE_LIMIT]
+
+    hits = [
+        (weight + sum(term_weights), entry_id, doc_type, doc_key)
+        for entry_id, doc_type, doc_key, weight, *term_weights in candidates
+    ]
+    hits.sort(reverse=True)
+    return [(doc_type, doc_key, score) for score, _, doc_type, doc_key in hits[:limit]]
+
+
+def _rarest_term(entries, terms):
+    # Từ có ít dòng chỉ mục nhất (đếm trên index (word, ...), dừng ở
+    # CANDIDATE_LIMIT + 1 dòng mỗi từ) – độ dài không nói lên độ hiếm:
+    # "dalat" có thể có ở hàng nghìn tài liệu, "sua" chỉ ở 1.
+    if len(terms) == 1:
+        return terms[0]
+    return min(terms, key=lambda term: entries.filter(word=term)[:CANDIDATE_LIMIT + 1].count())
+
+
+def _describe(doc_type, obj):
+    # (tiêu đề, mô tả phụ, link) của 1 kết quả
+    if doc_type == "import":
+        supplier = obj.supplier.company_name if obj.supplier else ""
+        return (obj.import_code, f"{obj.import_date:%d/%m/%Y} · {supplier}".rstrip(" ·"),
+                _list_url("import_list", obj.import_code))
+    if doc_type == "export":
+        return (obj.export_code, f"{obj.export_date:%d/%m/%Y} · {obj.destination}",
+                _list_url("export_list", obj.export_code))
+    if doc_type == "return":
+        return (obj.return_code, f"{obj.return_date:%d/%m/%Y}",
+                _list_url("return_list", obj.return_code))
+    if doc_type == "po":
+        return (obj.po_code, f"{obj.supplier.company_name} · {obj.get_status_display()}",
+                reverse("po_edit", args=[obj.po_code]))
+    if doc_type == "asn":
+        return (obj.asn_code, f"{obj.supplier.company_name} · {obj.get_status_display()}",
+                reverse("asn_edit", args=[obj.asn_code]))
+    if doc_type == "supplier":
+        return (obj.company_name, obj.supplier_code, reverse("edit_supplier", args=[obj.supplier_code]))
+    if doc_type == "product":
+        return (f"{obj.product_code} - {obj.name}", obj.supplier.company_name,
+                _list_url("stock_list", obj.product_code))
+    if doc_type == "lot":
+        code = (obj.import_receipt.import_code if obj.import_receipt
+                else obj.return_receipt.return_code if obj.return_receipt else "")
+        return (f"{obj.product.product_code} - {obj.product.name}",
+                " · ".join(p for p in [code, obj.location or "", f"Tồn {obj.quantity} {obj.unit}"] if p),
+                _list_url("stock_list", code or obj.product.product_code))
+    raise ValueError(doc_type)
+
+
+def _list_url(name, q):
+    return f"{reverse(name)}?{urlencode({'q': q})}"
+
+
+def global_search(query, types=None, limit=DEFAULT_LIMIT):
+    """
+    Kết quả đã xếp hạng cho /api/search: 1 câu trên chỉ mục + tối đa 1 câu
+    in_bulk cho mỗi loại có mặt trong kết quả.
+    """
+    ranked = ranked_documents(query, types, limit)
+
+    by_type = {}
+    for doc_type, key, _ in ranked:
+        by_type.setdefault(doc_type, []).append(key)
+
+    objects = {}
+    for doc_type, keys in by_type.items():
+        doc = DOC_TYPES[doc_type]
+        model = global_apps.get_model("QuanLy", doc.model)
+        objects[doc_type] = {
+            str(pk): obj
+            for pk, obj in model.objects.select_related(*doc.related).in_bulk(keys).items()
+        }
+
+    hits = []
+    for doc_type, key, score in ranked:
+        obj = objects[doc_type].get(key)
+        if obj is None:     # chỉ mục cũ hơn dữ liệu (vừa xoá) -> bỏ qua
+            continue
+        title, subtitle, url = _describe(doc_type, obj)
+        hits.append({
+            "type": doc_type,
+            "type_label": DOC_TYPES[doc_type].label,
+            "key": key,
+            "title": title,
+            "subtitle": subtitle,
+            "url": url,
+            "score": score,
+        })
+    return hits
@@ -0,0 +1,149 @@
+import hashlib
+import re
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+from .performance import request_timings
+
+
+# ===================== NHẬT KÝ CÂU SQL CHẬM =====================
+# Câu SQL được bấm giờ 1 lần bởi RequestTimingMiddleware (QuanLy/performance.py);
+# câu nào chạy lâu hơn SLOW_QUERY_MS được giữ lại kèm dòng code gọi. Sau khi
+# request xong, SlowQueryMiddleware (đứng ngoài RequestTimingMiddleware) ghi
+# chúng vào vòng đệm trong bộ nhớ (giữ SLOW_QUERY_LOG_SIZE câu gần nhất, mỗi
+# tiến trình 1 vòng đệm) kèm câu SQL đã chuẩn hoá, dấu vân tay tham số, view
+# + dòng code gọi và kế hoạch truy vấn (EXPLAIN QUERY PLAN trên SQLite,
+# EXPLAIN trên CSDL khác). Trang /slow-queries/ (chỉ superuser) gom theo câu
+# SQL, xếp theo tổng thời gian.
+#
+# EXPLAIN không chạy giữa các câu của view mà sau khi view trả response, và
+# mỗi câu (theo dấu vân tay) chỉ EXPLAIN lại sau SLOW_QUERY_EXPLAIN_INTERVAL
+# giây – các lần chậm khác dùng lại kế hoạch đã có -> câu chậm lặp lại nhiều
+# không nhân đôi tải CSDL.
+
+_lock = threading.Lock()
+_entries = deque(maxlen=getattr(settings, "SLOW_QUERY_LOG_SIZE", 500))
+_plans = {}     # dấu vân tay -> (thời điểm EXPLAIN, kế hoạch)
+
+_IN_LIST = re.compile(r"IN \((?:%s, )*%s\)")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_sql(sql):
+    # IN (%s, %s, ...) dài ngắn khác nhau vẫn là 1 câu; hằng số -> ?
+    sql = _IN_LIST.sub("IN (...)", sql)
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    return _SPACES.sub(" ", sql).strip()
+
+
+def fingerprint(value):
+    return hashlib.sha1(repr(value).encode("utf-8")).hexdigest()[:12]
+
+
+def explain(connection, sql, params):
+    # chỉ EXPLAIN câu đọc, không chạy lại câu ghi
+    if not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+        return ""
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}", params)
+            return "\n".join(" | ".join(str(col) for col in row) for row in cursor.fetchall())
+    except DatabaseError as e:
+        return f"(không EXPLAIN được: {e})"
+
+
+def record(statement, view, pending=None):
+    # statement: performance.SlowStatement; pending: danh sách câu chờ EXPLAIN
+    normalized = normalize_sql(statement.sql)
+    entry = {
+        "fingerprint": fingerprint(normalized),
+        "sql": normalized,
+        "params_fingerprint": fingerprint(statement.params),
+        "view": view,
+        "origin": statement.origin,
+        "duration_ms": round(statement.duration_ms, 1),
+        "plan": "",
+        "at": timezone.now(),
+    }
+    interval = getattr(settings, "SLOW_QUERY_EXPLAIN_INTERVAL", 300)
+    now = time.monotonic()
+    with _lock:
+        explained_at, plan = _plans.get(entry["fingerprint"], (None, ""))
+        entry["plan"] = plan
+        if pending is not None and (explained_at is None or now - explained_at >= interval):
+            # giữ chỗ ngay -> cùng câu chậm lần nữa trong request / request khác không xếp hàng lại
+            _plans[entry["fingerprint"]] = (now, plan)
+            pending.append((statement.connection, statement.sql, statement.params, entry))
+        _entries.append(entry)
+    return entry
+
+
+def explain_pending(pending):
+    # Chạy sau khi view xong (ngoài execute_wrapper): EXPLAIN các câu đang chờ
+    for connection, sql, params, entry in pending:
+        plan = explain(connection, sql, params)
+        with _lock:
+            entry["plan"] = plan
+            _plans[entry["fingerprint"]] = (time.monotonic(), plan)
+
+
+def slow_query_entries():
+    with _lock:
+        return list(_entries)
+
+
+def clear_slow_queries():
+    with _lock:
+        _entries.clear()
+        _plans.clear()
+
+
+def slow_query_summary():
+    """Gom các lần chạy theo câu SQL đã chuẩn hoá, câu tốn nhiều thời gian nhất trước."""
+    groups = {}
+    for entry in slow_query_entries():
+        group = groups.get(entry["fingerprint"])
+        if group is None:
+            group = groups[entry["fingerprint"]] = {
+                "fingerprint": entry["fingerprint"], "sql": entry["sql"],
+                "count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                "views": set(), "params": set(), "slowest": entry,
+            }
+        group["count"] += 1
+        group["total_ms"] += entry["duration_ms"]
+        group["views"].add(entry["view"] or "-")
+        group["params"].add(entry["params_fingerprint"])
+        if entry["duration_ms"] >= group["max_ms"]:
+            group["max_ms"] = entry["duration_ms"]
+            group["slowest"] = entry
+    for group in groups.values():
+        group["avg_ms"] = group["total_ms"] / group["count"]
+        group["views"] = sorted(group["views"])
+    return sorted(groups.values(), key=lambda g: g["total_ms"], reverse=True)
+
+
+class SlowQueryMiddleware:
+    # Đặt TRƯỚC RequestTimingMiddleware: đọc câu chậm đã gom sau khi request xong,
+    # EXPLAIN chạy ngoài execute_wrapper (không tính vào SQL của request)
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        timings = request_timings(request)
+        if timings is not None and timings.slow_queries:
+            match = getattr(request, "resolver_match", None)
+            view = match.view_name if match else None
+            pending = []
+            for statement in timings.slow_queries:
+                record(statement, view, pending)
+            explain_pending(pending)
+        return response
@@ -1,6 +1,8 @@
 from django import template
 from django.forms.boundfield import BoundField
 
+from QuanLy.roles import user_in_groups
+
 register = template.Library()
 # 1) Tổng chiết khấu
 @register.filter(name="total_discount")
@@ -48,7 +50,7 @@ def has_any_group(user, group_names):
     if not names:
         return False
 
-    return user.groups.filter(name__in=names).exists() or user.is_superuser
+    return user.is_superuser or user_in_groups(user, names)
 
 
 # 5) Thêm CSS class cho field
@@ -0,0 +1,26 @@
+# QuanLy/testing.py
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from .metrics import clear_metrics
+
+
+# ===================== TEST RUNNER =====================
+# MetricsMiddleware ghi file mmap vào METRICS_DIR ở mọi request, kể cả request
+# của test client -> khi chạy test, METRICS_DIR trỏ sang thư mục tạm (xoá khi
+# xong), không ghi vào BASE_DIR/metrics của máy chạy.
+class QuanLyTestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._metrics_dir = tempfile.TemporaryDirectory(prefix="quanly-metrics-")
+        self._metrics_override = override_settings(METRICS_DIR=self._metrics_dir.name)
+        self._metrics_override.enable()
+        clear_metrics()
+
+    def teardown_test_environment(self, **kwargs):
+        clear_metrics()
+        self._metrics_override.disable()
+        self._metrics_dir.cleanup()
+        super().teardown_test_environment(**kwargs)
@@ -1,3 +1,1917 @@
-from django.test import TestCase
+import io
+import json
+import random
+import re
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.exceptions import ValidationError
+from django.db import OperationalError, connection, transaction
+from django.db.models import F, Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver, reverse
+from unittest import mock, skipUnless
+
+from .allocation import LOT_BATCH, allocate_fefo
+from .dashboard import dashboard_cache_stats, get_dashboard_metrics
+from .querybudget import QueryRecorder, format_grown
+from .models import (
+    Category, Supplier, SupplierProduct, StockItem,
+    ImportReceipt, ImportItem,
+    ExportReceipt, ExportItem,
+    ReturnReceipt, ReturnItem,
+    StockMovement, StockCheckpoint, StockStatusRefresh,
+    PurchaseOrder, PurchaseOrderItem, ASN, ASNItem, DailySummary, DocumentSequence,
+)
+
+
+# ===================== DỮ LIỆU MẪU =====================
+def make_supplier(code="NCC01"):
+    return Supplier.objects.create(
+        supplier_code=code, company_name=f"Công ty {code}",
+        contact_name="Liên hệ", phone="0900000000", tax_code="0100000000",
+    )
+
+
+def make_product(supplier, code="SP01", name="Sữa tươi", **kwargs):
+    return SupplierProduct.objects.create(
+        supplier=supplier, product_code=code, name=name,
+        unit_price=kwargs.pop("unit_price", 10000), **kwargs
+    )
+
+
+def make_lot(product, quantity, **kwargs):
+    return StockItem.objects.create(
+        product=product, quantity=quantity,
+        unit=kwargs.pop("unit", "Thùng"), unit_price=kwargs.pop("unit_price", 10000),
+        **kwargs
+    )
+
+
+# ===================== XUẤT KHO: TRỪ TỒN ĐỒNG THỜI =====================
+class ExportItemStockTests(TestCase):
+    def setUp(self):
+        self.product = make_product(make_supplier())
+        self.lot = make_lot(self.product, 10)
+        self.receipt = ExportReceipt.objects.create(destination="Cửa hàng 1")
+
+    def test_decrement_and_edit(self):
+        item = ExportItem.objects.create(receipt=self.receipt, stock_item=self.lot, quantity=4, unit="Thùng")
+        self.lot.refresh_from_db()
+        self.assertEqual(self.lot.quantity, 6)
+
+        # sửa SL dòng xuất 4 -> 1: trả lại 3
+        item.quantity = 1
+        item.save()
+        self.lot.refresh_from_db()
+        self.assertEqual(self.lot.quantity, 9)
+
+    def test_oversell_rejected_without_side_effects(self):
+        with self.assertRaises(ValidationError):
+            ExportItem.objects.create(receipt=self.receipt, stock_item=self.lot, quantity=11, unit="Thùng")
+        self.lot.refresh_from_db()
+        self.assertEqual(self.lot.quantity, 10)
+        self.assertFalse(ExportItem.objects.exists())
+
+
+class ConcurrentExportTests(TransactionTestCase):
+    WORKERS = 50
+
+    def _run_exporters(self, lot_pk, receipt_pk):
+        start = threading.Barrier(self.WORKERS)
+        results = []
+
+        def worker():
+            start.wait()
+            try:
+                # nhân viên thử lại khi DB đang bị khóa ghi (SQLite)
+                while True:
+                    try:
+                        with transaction.atomic():
+                            ExportItem.objects.create(
+                                receipt_id=receipt_pk, stock_item_id=lot_pk,
+                                quantity=1, unit="Thùng",
+                            )
+                        results.append("ok")
+                        return
+                    except ValidationError:
+                        results.append("rejected")
+                        return
+                    except OperationalError:
+                        time.sleep(random.uniform(0.01, 0.05))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.WORKERS)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_no_lost_updates(self):
+        lot = make_lot(make_product(make_supplier()), 100)
+        receipt = ExportReceipt.objects.create(destination="Cửa hàng 1")
+
+        results = self._run_exporters(lot.pk, receipt.pk)
+
+        lot.refresh_from_db()
+        self.assertEqual(results.count("ok"), self.WORKERS)
+        self.assertEqual(lot.quantity, 100 - self.WORKERS)
+        self.assertEqual(ExportItem.objects.filter(stock_item=lot).count(), self.WORKERS)
+
+    def test_no_oversell(self):
+        lot = make_lot(make_product(make_supplier()), 30)
+        receipt = ExportReceipt.objects.create(destination="Cửa hàng 1")
+
+        results = self._run_exporters(lot.pk, receipt.pk)
+
+        lot.refresh_from_db()
+        self.assertEqual(results.count("ok"), 30)
+        self.assertEqual(results.count("rejected"), self.WORKERS - 30)
+        self.assertEqual(lot.quantity, 0)
+        receipt.refresh_from_db()
+        self.assertEqual(receipt.total_quantity, 30)
+
+
+# ===================== PHÂN BỔ LÔ FEFO =====================
+class FefoAllocationTests(TestCase):
+    def setUp(self):
+        self.product = make_product(make_supplier())
+        today = date.today()
+        self.expired = make_lot(self.product, 100, expiry_date=today - timedelta(days=1))
+        self.soon = make_lot(self.product, 5, expiry_date=today + timedelta(days=3))
+        self.later = make_lot(self.product, 7, expiry_date=today + timedelta(days=60))
+        self.no_expiry = make_lot(self.product, 50)
+
+    def test_splits_by_expiry_and_skips_expired(self):
+        allocation = allocate_fefo([(self.product, 6), (self.product.pk, 10)])
+
+        self.assertEqual(
+            [(i.stock_item_id, i.quantity) for i in allocation.items],
+            [(self.soon.pk, 5), (self.later.pk, 1), (self.later.pk, 6), (self.no_expiry.pk, 4)],
+        )
+        self.assertTrue(allocation.is_complete)
+
+        shortage = allocate_fefo([(self.product, 70)])
+        self.assertEqual(shortage.shortages, {self.product.pk: 8})
+
+    def test_reads_only_the_lots_it_needs(self):
+        today = date.today()
+        extra = [make_lot(self.product, 1, expiry_date=today + timedelta(days=100 + n))
+                 for n in range(LOT_BATCH * 3)]
+
+        with CaptureQueriesContext(connection) as ctx:
+            allocation = allocate_fefo([(self.product, 8)])
+        self.assertEqual([(i.stock_item_id, i.quantity) for i in allocation.items],
+                         [(self.soon.pk, 5), (self.later.pk, 3)])
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+        # câu SELECT trả đúng LOT_BATCH lô đầu, không phải toàn bộ lô còn hàng
+        sql = ctx.captured_queries[0]["sql"]
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+            self.assertEqual(len(cursor.fetchall()), LOT_BATCH)
+            if connection.vendor == "sqlite":
+                cursor.execute("EXPLAIN QUERY PLAN " + sql)
+                plan = [row[-1] for row in cursor.fetchall()]
+                self.assertTrue(any("stock_fefo_idx" in step for step in plan), plan)
+                self.assertFalse([step for step in plan if step.startswith("SCAN")], plan)
+
+        # cần nhiều lô hơn lượt đầu -> đọc tiếp từ sau lô cuối, không trùng / sót
+        with CaptureQueriesContext(connection) as ctx:
+            allocation = allocate_fefo([(self.product, 5 + 7 + len(extra) + 10)])
+        self.assertTrue(allocation.is_complete)
+        self.assertEqual(
+            [i.stock_item_id for i in allocation.items],
+            [self.soon.pk, self.later.pk] + [lot.pk for lot in extra] + [self.no_expiry.pk],
+        )
+        self.assertEqual(len(ctx.captured_queries), 2)
+
+    def test_commit_is_all_or_nothing(self):
+        receipt = ExportReceipt.objects.create(destination="Cửa hàng 1")
+        allocation = allocate_fefo([(self.product, 10)])
+
+        # lô cận hạn bị phiếu khác xuất mất sau khi đề xuất
+        other = ExportReceipt.objects.create(destination="Cửa hàng 2")
+        ExportItem.objects.create(receipt=other, stock_item=self.later, quantity=6, unit="Thùng")
+        with self.assertRaises(ValidationError):
+            allocation.commit(receipt)
+        self.soon.refresh_from_db()
+        self.assertEqual(self.soon.quantity, 5)
+        self.assertFalse(receipt.items.exists())
+
+        allocate_fefo([(self.product, 10)]).commit(receipt)
+        receipt.refresh_from_db()
+        self.assertEqual(receipt.total_quantity, 10)
+        self.assertEqual(
+            sorted(StockItem.objects.filter(product=self.product).values_list("quantity", flat=True)),
+            [0, 0, 46, 100],
+        )
+        # sổ kho: tồn đầu kỳ của 4 lô - 6 (phiếu kia) - 10 = đúng tồn hiện tại
+        self.assertEqual(StockMovement.balance_as_of(date.today(), product=self.product), 146)
+
+    def post_export(self, lines):
+        data = {
+            "export_code": ExportReceipt.preview_new_code(),
+            "export_date": date.today().isoformat(),
+            "destination": "Cửa hàng 1",
+            "receiver_phone": "0900000000",
+            "items-TOTAL_FORMS": str(len(lines)),
+            "items-INITIAL_FORMS": "0",
+        }
+        for i, (lot, qty) in enumerate(lines):
+            data.update({
+                f"items-{i}-stock_item": str(lot.pk),
+                f"items-{i}-quantity": str(qty),
+                f"items-{i}-unit_price": "0",
+                f"items-{i}-discount_percent": "10",
+                f"items-{i}-unit": "Thùng",
+                f"items-{i}-total": "0",
+            })
+        return self.client.post(reverse("create_export"), data)
+
+    def test_create_export_saves_through_commit(self):
+        from .allocation import FefoAllocation
+
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "x"))
+        with mock.patch.object(FefoAllocation, "commit", autospec=True,
+                               side_effect=FefoAllocation.commit) as commit:
+            response = self.post_export([(self.soon, 5), (self.later, 3)])
+        self.assertRedirects(response, reverse("export_list"), fetch_redirect_response=False)
+        commit.assert_called_once()
+
+        receipt = ExportReceipt.objects.get()
+        self.assertEqual(sorted(receipt.items.values_list("stock_item_id", "quantity", "unit_price", "total")),
+                         sorted([(self.soon.pk, 5, 10000, 45000), (self.later.pk, 3, 10000, 27000)]))
+        self.assertEqual((receipt.total_quantity, receipt.total_price), (8, 72000))
+        self.assertEqual(StockMovement.balance_as_of(date.today(), product=self.product), 154)
+
+        # 2 dòng cùng lô cộng lại vượt tồn (lô còn 4) -> không lưu phiếu, không trừ tồn
+        response = self.post_export([(self.later, 3), (self.later, 2)])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(ExportReceipt.objects.count(), 1)
+        self.later.refresh_from_db()
+        self.assertEqual(self.later.quantity, 4)
+
+
+class StockLotPickerTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "x"))
+        supplier = make_supplier()
+        self.milk = make_product(supplier, "SP01", "Sữa tươi")
+        self.rice = make_product(supplier, "GAO01", "Gạo")
+        today = date.today()
+        self.no_expiry = make_lot(self.milk, 3)
+        self.later = make_lot(self.milk, 4, expiry_date=today + timedelta(days=60))
+        self.soon = make_lot(self.milk, 5, expiry_date=today + timedelta(days=3))
+        make_lot(self.milk, 0, expiry_date=today + timedelta(days=1))
+        make_lot(self.rice, 8)
+
+    def test_prefix_search_in_fefo_order_with_cursor(self):
+        url = reverse("api_stock_lots")
+        first = self.client.get(url, {"q": "sp", "page_size": 10}).json()
+        self.assertEqual([r["id"] for r in first["results"]],
+                         [self.soon.pk, self.later.pk, self.no_expiry.pk])
+        self.assertEqual(first["next_cursor"], "")
+
+        self.assertEqual(len(self.client.get(url, {"q": "gạo"}).json()["results"]), 1)
+
+        # 2 trang x 10 lô, cursor nối tiếp không trùng / sót
+        for days in range(10, 22):
+            make_lot(self.milk, 1, expiry_date=date.today() + timedelta(days=days))
+        expected = list(
+            StockItem.picker_queryset("Sữa").order_by("fefo_date", "id").values_list("id", flat=True)
+        )
+        first = self.client.get(url, {"q": "Sữa", "page_size": 10}).json()
+        second = self.client.get(url, {"q": "Sữa", "page_size": 10,
+                                       "after": first["next_cursor"]}).json()
+        self.assertEqual([r["id"] for r in first["results"] + second["results"]], expected)
+        self.assertEqual(len(expected), 15)
+        self.assertEqual(second["next_cursor"], "")
+
+
+    def test_formset_loads_submitted_lots_in_one_query(self):
+        from .forms import ExportItemFormSet
+
+        lots = [make_lot(self.rice, 10) for _ in range(5)]
+        data = {
+            "items-TOTAL_FORMS": str(len(lots) + 1),
+            "items-INITIAL_FORMS": "0",
+        }
+        for i, lot in enumerate(lots):
+            data.update({
+                f"items-{i}-stock_item": str(lot.pk),
+                f"items-{i}-quantity": "1",
+                f"items-{i}-unit_price": "10000",
+                f"items-{i}-discount_percent": "0",
+                f"items-{i}-unit": "Thùng",
+                f"items-{i}-total": "10000",
+            })
+        # dòng chọn lô không tồn tại
+        data.update({
+            f"items-{len(lots)}-stock_item": "999999",
+            f"items-{len(lots)}-quantity": "1",
+            f"items-{len(lots)}-unit": "Thùng",
+        })
+
+        formset = ExportItemFormSet(data, prefix="items")
+        with CaptureQueriesContext(connection) as ctx:
+            valid = formset.is_valid()
+        self.assertFalse(valid)
+        self.assertIn("stock_item", formset.forms[-1].errors)
+        self.assertEqual([f.cleaned_data["stock_item"].pk for f in formset.forms[:-1]],
+                         [lot.pk for lot in lots])
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+
+# ===================== SỔ KHO =====================
+class StockLedgerTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(category_code="DM01", name="Sữa")
+        self.product = make_product(make_supplier(), category=self.category)
+
+    def test_save_paths_write_ledger(self):
+        receipt = ImportReceipt.objects.create(supplier=self.product.supplier)
+        ImportItem.objects.create(import_receipt=receipt, product=self.product,
+                                  quantity=20, unit_price=10000, unit="Thùng")
+        lot = StockItem.objects.get(product=self.product)
+
+        export = ExportReceipt.objects.create(destination="Cửa hàng 1")
+        item = ExportItem.objects.create(receipt=export, stock_item=lot, quantity=8, unit="Thùng")
+        item.quantity = 5
+        item.save()
+
+        ret = ReturnReceipt.objects.create(export_receipt=export)
+        ReturnItem.objects.create(receipt=ret, export_item=item, quantity=2)
+
+        self.assertEqual(
+            list(StockMovement.objects.order_by("id").values_list("movement_type", "quantity")),
+            [("import", 20), ("export", -8), ("export", 3), ("return", 2)],
+        )
+        on_hand = sum(StockItem.objects.values_list("quantity", flat=True))
+        self.assertEqual(StockMovement.balance_as_of(date.today()), on_hand)
+        self.assertEqual(StockMovement.balance_as_of(date.today(), stock_item=lot), 15)
+
+    def test_balance_from_checkpoint_plus_replay(self):
+        lot = make_lot(self.product, 0)
+        other = make_lot(make_product(self.product.supplier, code="SP02"), 0)
+        today = date.today()
+
+        def move(stock_item, qty, days_ago):
+            StockMovement.objects.create(
+                stock_item=stock_item, product_id=stock_item.product_id, movement_type="import",
+                quantity=qty, movement_date=today - timedelta(days=days_ago),
+            )
+
+        move(lot, 10, 10)
+        move(other, 4, 9)
+        move(lot, -3, 8)
+        StockCheckpoint.create_for(today - timedelta(days=7))
+        move(lot, 5, 5)
+        move(lot, -1, 1)
+
+        # có mốc chốt: chỉ cộng biến động sau mốc, không quét lại lịch sử trước mốc
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(StockMovement.balance_as_of(today - timedelta(days=6), stock_item=lot), 7)
+        replay = [q["sql"] for q in ctx.captured_queries if "QuanLy_stockmovement" in q["sql"]]
+        self.assertEqual(len(replay), 1)
+        self.assertIn(f"\"movement_date\" > '{today - timedelta(days=7)}'", replay[0])
+
+        self.assertEqual(StockMovement.balance_as_of(today - timedelta(days=3), product=self.product), 12)
+        self.assertEqual(StockMovement.balance_as_of(today, category=self.category), 11)
+        self.assertEqual(StockMovement.balance_as_of(today), 15)
+
+    def test_ledger_is_append_only(self):
+        make_lot(self.product, 5)
+        movement = StockMovement.objects.get()
+        movement.quantity = 6
+        with self.assertRaises(ValidationError):
+            movement.save()
+        with self.assertRaises(ValidationError):
+            movement.delete()
+        # sửa / xoá hàng loạt qua QuerySet cũng bị chặn
+        with self.assertRaises(ValidationError):
+            StockMovement.objects.filter(pk=movement.pk).update(quantity=6)
+        with self.assertRaises(ValidationError):
+            StockMovement.objects.all().delete()
+        self.assertEqual(StockMovement.objects.values_list("quantity", flat=True).get(), 5)
+
+    def test_new_lot_enters_ledger(self):
+        # lô tạo ngoài phiếu (form tồn kho, admin) -> "Tồn đầu kỳ"; lô hết hàng không ghi
+        lot = make_lot(self.product, 12)
+        make_lot(self.product, 0)
+        lot.location = "Kệ B2"
+        lot.save()      # sửa lô có sẵn không ghi thêm dòng mở sổ
+
+        self.assertEqual(list(StockMovement.objects.values_list("stock_item_id", "movement_type", "quantity")),
+                         [(lot.pk, "opening", 12)])
+
+    def test_editing_lot_quantity_records_adjustment(self):
+        lot = make_lot(self.product, 12)
+        lot.quantity = 9
+        lot.save()
+        lot.quantity = 10
+        lot.save()
+
+        self.assertEqual(
+            list(StockMovement.objects.order_by("id").values_list("movement_type", "quantity")),
+            [("opening", 12), ("adjustment", -3), ("adjustment", 1)],
+        )
+        on_hand = sum(StockItem.objects.values_list("quantity", flat=True))
+        self.assertEqual(StockMovement.balance_as_of(date.today()), on_hand)
+        self.assertEqual(StockMovement.balance_as_of(date.today(), stock_item=lot), 10)
+
+    def test_backdated_receipts_land_on_business_date(self):
+        day = date.today() - timedelta(days=10)
+        receipt = ImportReceipt.objects.create(supplier=self.product.supplier, import_date=day)
+        ImportItem.objects.create(import_receipt=receipt, product=self.product,
+                                  quantity=20, unit_price=10000, unit="Thùng")
+        ImportItem.objects.create(import_receipt=receipt, product=self.product,
+                                  quantity=5, unit_price=10000, unit="Thùng")
+        lot = StockItem.objects.get(product=self.product)
+        export = ExportReceipt.objects.create(destination="Cửa hàng 1", export_date=day + timedelta(days=2))
+        item = ExportItem.objects.create(receipt=export, stock_item=lot, quantity=8, unit="Thùng")
+        ret = ReturnReceipt.objects.create(export_receipt=export, return_date=day + timedelta(days=4))
+        ReturnItem.objects.create(receipt=ret, export_item=item, quantity=2)
+
+        self.assertEqual(
+            list(StockMovement.objects.order_by("id").values_list("movement_type", "movement_date")),
+            [("import", day), ("import", day), ("export", day + timedelta(days=2)),
+             ("return", day + timedelta(days=4))],
+        )
+        self.assertEqual(StockMovement.balance_as_of(day + timedelta(days=1), product=self.product), 25)
+        self.assertEqual(StockMovement.balance_as_of(day + timedelta(days=3), product=self.product), 17)
+        StockCheckpoint.create_for(day + timedelta(days=3))
+        self.assertEqual(StockMovement.balance_as_of(date.today(), product=self.product), 19)
+
+
+# ===================== NHẬP KHO: LƯU GỘP =====================
+class BulkReceiveTests(TestCase):
+    def setUp(self):
+        supplier = make_supplier()
+        self.supplier = supplier
+        self.products = [make_product(supplier, f"SP{n:02d}", f"Sản phẩm {n}") for n in range(4)]
+
+    def _lines(self, n):
+        # lặp sản phẩm + HSD để có dòng gộp vào cùng lô
+        expiry = date.today() + timedelta(days=20)
+        return [
+            dict(
+                product=self.products[i % 4],
+                quantity=i + 1,
+                unit_price=1000 + i,
+                unit="Thùng" if i % 2 else "Hộp",
+                location=f"Kệ {i}",
+                expiry_date=expiry if i % 3 else None,
+            )
+            for i in range(n)
+        ]
+
+    def _snapshot(self, receipt):
+        lots = StockItem.objects.filter(import_receipt=receipt).order_by("product_id", "expiry_date")
+        receipt.refresh_from_db()
+        return (
+            list(lots.values_list("product_id", "expiry_date", "quantity", "unit",
+                                  "location", "unit_price", "status")),
+            receipt.total_quantity, receipt.total_price,
+            sorted(StockMovement.objects.filter(reference=str(receipt.pk))
+                   .values_list("product_id", "quantity")),
+        )
+
+    def test_same_stock_as_row_by_row(self):
+        slow = ImportReceipt.objects.create(import_code="PN-A", supplier=self.supplier)
+        for line in self._lines(12):
+            ImportItem.objects.create(import_receipt=slow, **line)
+
+        fast = ImportReceipt.objects.create(import_code="PN-B", supplier=self.supplier)
+        ImportItem.bulk_receive(fast, [ImportItem(**line) for line in self._lines(12)])
+
+        self.assertEqual(self._snapshot(slow), self._snapshot(fast))
+
+    def test_query_count_does_not_grow_with_lines(self):
+        counts = []
+        for n, code in ((5, "PN-C"), (60, "PN-D")):
+            receipt = ImportReceipt.objects.create(import_code=code, supplier=self.supplier)
+            items = [ImportItem(**line) for line in self._lines(n)]
+            with CaptureQueriesContext(connection) as ctx:
+                ImportItem.bulk_receive(receipt, items)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_invalid_line_writes_nothing(self):
+        receipt = ImportReceipt.objects.create(import_code="PN-E", supplier=self.supplier)
+        lines = [ImportItem(**line) for line in self._lines(3)]
+        lines[2].quantity = 0
+        with self.assertRaises(ValidationError):
+            ImportItem.bulk_receive(receipt, lines)
+        self.assertFalse(ImportItem.objects.exists())
+        self.assertFalse(StockItem.objects.exists())
+
+
+# ===================== HOÀN HÀNG: LƯU GỘP =====================
+class BulkReturnTests(TestCase):
+    def setUp(self):
+        supplier = make_supplier()
+        export = ExportReceipt.objects.create(destination="Cửa hàng 1")
+        self.export_items = []
+        for n in range(6):
+            product = make_product(supplier, f"SP{n:02d}", f"Sản phẩm {n}")
+            lot = make_lot(product, 50, location=f"Kệ {n}",
+                           expiry_date=date.today() + timedelta(days=10 * n))
+            self.export_items.append(ExportItem.objects.create(
+                receipt=export, stock_item=lot, quantity=10, unit="Thùng", unit_price=2000 + n,
+            ))
+
+    def _snapshot(self, receipt):
+        receipt.refresh_from_db()
+        return (
+            list(ReturnItem.objects.filter(receipt=receipt).order_by("export_item_id").values_list(
+                "export_item_id", "product_id", "quantity", "unit", "unit_price",
+                "expiry_date", "location", "total", "stock_item__quantity", "stock_item__status",
+            )),
+            receipt.total_quantity, receipt.total_price,
+            sorted(StockMovement.objects.filter(reference=str(receipt.pk))
+                   .values_list("product_id", "quantity")),
+        )
+
+    def test_same_result_as_row_by_row(self):
+        slow = ReturnReceipt.objects.create(return_code="PH-A")
+        for ei in self.export_items:
+            ReturnItem.objects.create(receipt=slow, export_item=ei, quantity=3)
+
+        fast = ReturnReceipt.objects.create(return_code="PH-B")
+        ReturnItem.bulk_return(fast, [ReturnItem(export_item=ei, quantity=3) for ei in self.export_items])
+
+        self.assertEqual(self._snapshot(slow), self._snapshot(fast))
+
+    def test_over_return_counts_previous_and_same_batch(self):
+        first = ReturnReceipt.objects.create(return_code="PH-C")
+        ReturnItem.bulk_return(first, [ReturnItem(export_item=self.export_items[0], quantity=6)])
+
+        second = ReturnReceipt.objects.create(return_code="PH-D")
+        with self.assertRaises(ValidationError):
+            # 6 đã hoàn + 3 + 2 > 10
+            ReturnItem.bulk_return(second, [
+                ReturnItem(export_item=self.export_items[0], quantity=3),
+                ReturnItem(export_item=self.export_items[0], quantity=2),
+            ])
+        self.assertFalse(ReturnItem.objects.filter(receipt=second).exists())
+        self.assertEqual(StockItem.objects.filter(source_type="return").count(), 1)
+
+    def test_query_count_does_not_grow_with_lines(self):
+        counts = []
+        for n, code in ((1, "PH-E"), (6, "PH-F")):
+            receipt = ReturnReceipt.objects.create(return_code=code)
+            items = [ReturnItem(export_item_id=ei.pk, quantity=1) for ei in self.export_items[:n]]
+            with CaptureQueriesContext(connection) as ctx:
+                ReturnItem.bulk_return(receipt, items)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+# ===================== TIẾN ĐỘ PO =====================
+class PurchaseOrderFulfillmentTests(TestCase):
+    def setUp(self):
+        self.supplier = make_supplier()
+        self.products = [make_product(self.supplier, f"SP{n:02d}", f"Sản phẩm {n}") for n in range(30)]
+        self.po = PurchaseOrder.objects.create(supplier=self.supplier)
+        for product in self.products:
+            PurchaseOrderItem.objects.create(po=self.po, product=product, quantity=10)
+
+        self.asn = ASN.objects.create(
+            po=self.po, supplier=self.supplier, deliverer_name="Tài xế",
+            deliverer_phone="0900000000", expected_date=date.today(),
+        )
+        self.shipped = ASNItem.objects.create(asn=self.asn, product=self.products[0], quantity=4, unit="Thùng")
+        receipt = ImportReceipt.objects.create(import_code="PN-PO", supplier=self.supplier, asn=self.asn)
+        ImportItem.objects.create(import_receipt=receipt, asn_item=self.shipped, product=self.products[0],
+                                  quantity=3, unit_price=1000, unit="Thùng")
+
+    def test_projection(self):
+        with self.assertNumQueries(1):
+            fulfillment = PurchaseOrderItem.fulfillment(self.po)
+        self.assertEqual(fulfillment[self.products[0].pk],
+                         {"ordered": 10, "shipped": 4, "received": 3, "remaining": 6})
+        self.assertEqual(fulfillment[self.products[1].pk]["remaining"], 10)
+
+        # sửa chính dòng ASN: không tính SL cũ của dòng đó
+        self.shipped.quantity = 10
+        self.shipped.full_clean()
+        self.shipped.quantity = 11
+        with self.assertRaises(ValidationError):
+            self.shipped.full_clean()
+
+    def _post_data(self, quantities):
+        data = {"items-TOTAL_FORMS": str(len(quantities)), "items-INITIAL_FORMS": "0"}
+        for i, (product, qty) in enumerate(quantities):
+            data.update({
+                f"items-{i}-product": str(product.pk),
+                f"items-{i}-quantity": str(qty),
+                f"items-{i}-unit": "Thùng",
+                f"items-{i}-unit_price": "1000",
+            })
+        return data
+
+    def test_asn_formset_queries_do_not_grow_with_lines(self):
+        from .forms import ASNItemFormSet
+
+        counts = []
+        for n in (2, 30):
+            asn = ASN.objects.create(
+                po=self.po, supplier=self.supplier, deliverer_name="Tài xế",
+                deliverer_phone="0900000000", expected_date=date.today(),
+            )
+            formset = ASNItemFormSet(
+                self._post_data([(p, 1) for p in self.products[1:n]]),
+                instance=asn, prefix="items", form_kwargs={"po": self.po},
+            )
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertTrue(formset.is_valid(), formset.errors)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_asn_formset_rejects_split_over_delivery(self):
+        from .forms import ASNItemFormSet
+
+        asn = ASN.objects.create(
+            po=self.po, supplier=self.supplier, deliverer_name="Tài xế",
+            deliverer_phone="0900000000", expected_date=date.today(),
+        )
+        # còn 6: 4 + 4 trên 2 dòng
+        formset = ASNItemFormSet(
+            self._post_data([(self.products[0], 4), (self.products[0], 4)]),
+            instance=asn, prefix="items", form_kwargs={"po": self.po},
+        )
+        self.assertFalse(formset.is_valid())
+        self.assertTrue(formset.non_form_errors())
+
+
+# ===================== TRANG TỒN KHO: PHÂN TRANG KEYSET =====================
+class StockListPaginationTests(TestCase):
+    RANKS = {"nearly_expired": 0, "valid": 1, "expired": 2}
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "x"))
+        product = make_product(make_supplier())
+        today = date.today()
+        receipts = [ImportReceipt.objects.create(import_date=today - timedelta(days=n)) for n in range(4)]
+        # 3 trạng thái x 4 ngày nhập + lô hoàn (không có phiếu nhập); trùng khóa -> id phân định
+        for n in range(57):
+            make_lot(product, 1, import_receipt=receipts[n % 4] if n % 5 else None,
+                     expiry_date=today + timedelta(days=(5, 90, -3)[n % 3]))
+
+    def expected_ids(self):
+        def key(lot):
+            received = lot.import_receipt.import_date if lot.import_receipt else date.min
+            return self.RANKS[lot.status], -received.toordinal(), -lot.pk
+        return [lot.pk for lot in sorted(StockItem.objects.select_related("import_receipt"), key=key)]
+
+    def page(self, **params):
+        response = self.client.get(reverse("stock_list"), {"page_size": 25, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.context["page"]
+
+    def test_cursor_round_trip(self):
+        from .pagination import InvalidCursor, decode_cursor, encode_cursor
+
+        cursor = encode_cursor([1, date(2024, 3, 5), 42])
+        self.assertEqual(decode_cursor(cursor, 3), [1, "2024-03-05", 42])
+        with self.assertRaises(InvalidCursor):
+            decode_cursor(cursor, 2)
+        with self.assertRaises(InvalidCursor):
+            decode_cursor("không-phải-cursor", 3)
+
+    def test_pages_follow_stable_order_both_ways(self):
+        expected = self.expected_ids()
+
+        pages = [self.page()]
+        while pages[-1].has_next:
+            pages.append(self.page(after=pages[-1].next_cursor))
+        self.assertEqual([len(p) for p in pages], [25, 25, 7])
+        self.assertEqual([lot.pk for p in pages for lot in p], expected)
+
+        # quay lại từ trang cuối bằng cursor "before"
+        back = [pages[-1]]
+        while back[-1].has_previous:
+            back.append(self.page(before=back[-1].previous_cursor))
+        self.assertEqual([lot.pk for p in reversed(back) for lot in p], expected)
+
+        # cursor hỏng -> trang đầu
+        self.assertEqual([lot.pk for lot in self.page(after="!!")], expected[:25])
+
+    def test_stored_sort_keys_follow_status_and_import_date(self):
+        lot = StockItem.objects.filter(import_receipt__isnull=False, status="valid").first()
+        StockItem.refresh_statuses(today=date.today() + timedelta(days=365))
+        lot.refresh_from_db()
+        self.assertEqual((lot.status, lot.status_rank), ("expired", 2))
+
+        receipt = lot.import_receipt
+        receipt.import_date = date(2020, 1, 1)
+        receipt.save()
+        lot.refresh_from_db()
+        self.assertEqual(lot.sort_date, date(2020, 1, 1))
+        self.assertEqual(StockItem.objects.filter(import_receipt=None).first().sort_date, date.min)
+
+
+# ===================== HẠN DÙNG: CẬP NHẬT THEO NGÀY =====================
+class StockStatusRefreshTests(TestCase):
+    def setUp(self):
+        product = make_product(make_supplier())
+        self.today = date.today()
+        # hôm nay: còn hạn / cận hạn / (giả lập) đang ghi cận hạn nhưng HSD còn xa / không HSD
+        self.valid = make_lot(product, 1, expiry_date=self.today + timedelta(days=40))
+        self.nearly = make_lot(product, 1, expiry_date=self.today + timedelta(days=5))
+        self.stale = make_lot(product, 1, expiry_date=self.today + timedelta(days=100))
+        StockItem.objects.filter(pk=self.stale.pk).update(status="nearly_expired", status_rank=0)
+        self.no_expiry = make_lot(product, 1)
+
+    def statuses(self):
+        return {
+            name: StockItem.objects.values_list("status", "status_rank").get(pk=lot.pk)
+            for name, lot in (("valid", self.valid), ("nearly", self.nearly),
+                              ("stale", self.stale), ("no_expiry", self.no_expiry))
+        }
+
+    def test_three_transitions_in_one_pass(self):
+        counts = StockItem.refresh_statuses(self.today + timedelta(days=15))
+
+        self.assertEqual(counts, {"expired": 1, "nearly_expired": 1, "valid": 1})
+        self.assertEqual(self.statuses(), {
+            "valid": ("nearly_expired", 0),     # còn 25 ngày
+            "nearly": ("expired", 2),           # quá hạn 10 ngày
+            "stale": ("valid", 1),              # còn 85 ngày
+            "no_expiry": ("valid", 1),
+        })
+
+        # chạy lại cùng ngày: không còn dòng nào đổi
+        self.assertEqual(StockItem.refresh_statuses(self.today + timedelta(days=15)),
+                         {"expired": 0, "nearly_expired": 0, "valid": 0})
+
+    def test_command_runs_once_per_run_date(self):
+        run_date = (self.today + timedelta(days=15)).isoformat()
+
+        out = io.StringIO()
+        call_command("refresh_stock_status", date=run_date, stdout=out)
+        record = StockStatusRefresh.objects.get()
+        self.assertEqual(
+            (record.run_date.isoformat(), record.expired_count, record.nearly_expired_count, record.valid_count),
+            (run_date, 1, 1, 1),
+        )
+
+        # cùng run_date: bỏ qua, không ghi thêm bản ghi nào
+        StockItem.objects.filter(pk=self.valid.pk).update(status="valid", status_rank=1)
+        out = io.StringIO()
+        call_command("refresh_stock_status", date=run_date, stdout=out)
+        self.assertIn("bỏ qua", out.getvalue())
+        self.assertEqual(StockStatusRefresh.objects.count(), 1)
+        self.assertEqual(self.statuses()["valid"][0], "valid")
+
+        # --force: chạy lại, thay bản ghi cũ
+        call_command("refresh_stock_status", date=run_date, force=True, stdout=io.StringIO())
+        record = StockStatusRefresh.objects.get()
+        self.assertEqual((record.expired_count, record.nearly_expired_count, record.valid_count), (0, 1, 0))
+        self.assertEqual(self.statuses()["valid"][0], "nearly_expired")
+
+        with self.assertRaises(CommandError):
+            call_command("refresh_stock_status", date="17/10/2026")
+
+
+# ===================== ĐÁNH SỐ CHỨNG TỪ =====================
+class DocumentSequenceTests(TestCase):
+    def allocate(self, prefix="PN", today=None):
+        return DocumentSequence.allocate(prefix, ImportReceipt, "import_code", today=today)
+
+    def test_sequential_allocation_and_preview(self):
+        self.assertEqual(DocumentSequence.preview("PN", ImportReceipt, "import_code"), "PN0001")
+        self.assertEqual([self.allocate() for _ in range(3)], ["PN0001", "PN0002", "PN0003"])
+        # xem trước không cấp số
+        self.assertEqual(DocumentSequence.preview("PN", ImportReceipt, "import_code"), "PN0004")
+        self.assertEqual(self.allocate(), "PN0004")
+        self.assertEqual(DocumentSequence.objects.get(prefix="PN").last_value, 4)
+
+    def test_seeds_from_existing_codes_numerically(self):
+        supplier = make_supplier()
+        for code in ("PO999", "PO1000", "POABC"):
+            PurchaseOrder.objects.create(po_code=code, supplier=supplier)
+        self.assertEqual(PurchaseOrder.generate_new_code(), "PO1001")
+        self.assertEqual(PurchaseOrder.generate_new_code(), "PO1002")
+
+    @override_settings(DOCUMENT_SEQUENCES={"PN": {"period": "day", "width": 2}})
+    def test_period_rollover_and_width_overflow(self):
+        day = date(2024, 10, 17)
+        self.assertEqual([self.allocate(today=day) for _ in range(2)], ["PN24101701", "PN24101702"])
+        # sang ngày mới: đánh lại từ 1, bộ đếm ngày cũ giữ nguyên
+        self.assertEqual(self.allocate(today=day + timedelta(days=1)), "PN24101801")
+        self.assertEqual(self.allocate(today=day), "PN24101703")
+
+        DocumentSequence.objects.filter(prefix="PN", period="241017").update(last_value=99)
+        self.assertEqual(self.allocate(today=day), "PN241017100")
+
+
+class ConcurrentDocumentSequenceTests(TransactionTestCase):
+    WORKERS = 20
+
+    def test_concurrent_allocation_is_unique_and_gapless(self):
+        # các luồng cùng tạo bộ đếm lần đầu (nhánh IntegrityError) rồi cùng tăng
+        start = threading.Barrier(self.WORKERS)
+        codes = []
+
+        def worker():
+            start.wait()
+            try:
+                while True:
+                    try:
+                        with transaction.atomic():
+                            codes.append(DocumentSequence.allocate("XK", ExportReceipt, "export_code"))
+                        return
+                    except OperationalError:
+                        # SQLite đang khóa ghi -> thử lại
+                        time.sleep(random.uniform(0.01, 0.05))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.WORKERS)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(sorted(codes), [f"XK{n:04d}" for n in range(1, self.WORKERS + 1)])
+        self.assertEqual(DocumentSequence.objects.get(prefix="XK").last_value, self.WORKERS)
+
+
+# ===================== TỔNG TIỀN PHIẾU (LƯU SẴN) =====================
+class ReceiptTotalsTests(TestCase):
+    def setUp(self):
+        self.product = make_product(make_supplier())
+        self.receipt = ImportReceipt.objects.create()
+
+    def add_import_line(self, quantity, unit_price, discount_percent=0):
+        return ImportItem.objects.create(
+            import_receipt=self.receipt, product=self.product, quantity=quantity,
+            unit_price=unit_price, discount_percent=discount_percent, unit="Thùng",
+        )
+
+    def stored(self, receipt, *names):
+        return type(receipt).objects.values_list(*names).get(pk=receipt.pk)
+
+    def test_totals_follow_line_save_and_delete(self):
+        self.add_import_line(3, 10000)
+        line = self.add_import_line(2, 5000, discount_percent=10)
+        self.assertEqual(self.stored(self.receipt, "total_quantity", "total_price"), (5, Decimal("39000")))
+
+        line.delete()
+        self.assertEqual(self.stored(self.receipt, "total_quantity", "total_price"), (3, Decimal("30000")))
+
+        export = ExportReceipt.objects.create(destination="Cửa hàng 1")
+        lot = StockItem.objects.get(import_receipt=self.receipt)
+        # đơn giá lô = đơn giá dòng nhập sau cùng (5000)
+        item = ExportItem.objects.create(receipt=export, stock_item=lot, quantity=2, unit="Thùng",
+                                         discount_percent=50)
+        self.assertEqual(self.stored(export, "total_quantity", "total_price", "total_discount"),
+                         (2, Decimal("5000"), Decimal("5000")))
+        item.quantity = 1
+        item.save()
+        self.assertEqual(self.stored(export, "total_quantity", "total_price"), (1, Decimal("2500")))
+        item.delete()
+        self.assertEqual(self.stored(export, "total_quantity", "total_price"), (0, Decimal("0")))
+
+    def test_verify_reports_mismatch_and_command_repairs_it(self):
+        self.add_import_line(3, 10000)
+        ImportReceipt.objects.filter(pk=self.receipt.pk).update(total_quantity=99)
+
+        out = io.StringIO()
+        with self.assertRaises(CommandError):
+            call_command("recalculate_receipt_totals", verify=True, stdout=out)
+        self.assertIn(f"{self.receipt.pk}: total_quantity: 99 ≠ 3", out.getvalue())
+        self.assertEqual(self.stored(self.receipt, "total_quantity"), (99,))   # --verify không ghi
+
+        call_command("recalculate_receipt_totals", stdout=io.StringIO())
+        self.assertEqual(self.stored(self.receipt, "total_quantity", "total_price"), (3, Decimal("30000")))
+
+        out = io.StringIO()
+        call_command("recalculate_receipt_totals", verify=True, stdout=out)
+        self.assertIn("đều khớp", out.getvalue())
+
+    def test_receipt_class_must_declare_totals(self):
+        from .models import ReceiptTotalsMixin
+
+        with self.assertRaises(TypeError):
+            type("NoTotals", (ReceiptTotalsMixin,), {})
+
+
+# ===================== DANH SÁCH PO / ASN: SỐ CÂU TRUY VẤN CỐ ĐỊNH =====================
+class ListQueryCountTests(TestCase):
+    MAX_QUERIES = 8
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "x"))
+        self.supplier = make_supplier()
+        self.products = [make_product(self.supplier, f"SP{n:02d}", f"Sản phẩm {n}") for n in range(3)]
+
+    def _add_documents(self, n):
+        for _ in range(n):
+            po = PurchaseOrder.objects.create(supplier=self.supplier)
+            asn = ASN.objects.create(
+                po=po, supplier=self.supplier, deliverer_name="Tài xế",
+                deliverer_phone="0900000000", expected_date=date.today(),
+            )
+            for product in self.products:
+                PurchaseOrderItem.objects.create(po=po, product=product, quantity=5, unit_price=1000)
+                ASNItem.objects.create(asn=asn, product=product, quantity=2, unit="Thùng", unit_price=1500)
+
+    def _count(self, url_name):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, 200)
+        return response, len(ctx.captured_queries)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        self._add_documents(2)
+        small = {name: self._count(name)[1] for name in ("po_list", "asn_list")}
+        self._add_documents(15)
+        for name in ("po_list", "asn_list"):
+            response, count = self._count(name)
+            self.assertEqual(count, small[name], name)
+            self.assertLessEqual(count, self.MAX_QUERIES, name)
+
+    def test_annotated_totals(self):
+        self._add_documents(1)
+        asn = ASN.objects.annotate(**ASN.list_annotations()).get()
+        self.assertEqual((asn.item_count, asn.quantity_sum, asn.value_sum), (3, 6, 9000))
+        self.assertEqual(asn.value_sum, asn.total_value)
+
+        po = PurchaseOrder.objects.annotate(**PurchaseOrder.list_annotations()).get()
+        self.assertEqual((po.item_count, po.shipped_quantity, po.received_quantity), (3, 6, 0))
+
+        # tìm theo tên SP (JOIN dòng hàng) không làm sai số dòng
+        response = self.client.get(reverse("asn_list"), {"q": "Sản phẩm 1"})
+        self.assertEqual([a.item_count for a in response.context["asns"]], [3])
+
+
+# ===================== INDEX: KHÔNG QUÉT TOÀN BẢNG =====================
+@skipUnless(connection.vendor == "sqlite", "Kiểm tra theo định dạng EXPLAIN QUERY PLAN của SQLite")
+class QueryPlanTests(TestCase):
+    # Gọi các trang danh sách / báo cáo với bộ lọc thật, bắt đúng câu SQL view
+    # sinh ra (CaptureQueriesContext) rồi EXPLAIN lại từng câu SELECT.
+    # "SCAN <bảng>" không kèm index = đọc toàn bảng -> lỗi; trừ câu không có
+    # WHERE (ô chọn danh mục / NCC, tổng tồn kho) vốn đọc hết bảng có chủ đích.
+    FULL_SCAN = re.compile(r"\bSCAN (QuanLy_\w+)$")
+    # Tìm tự do ở trang tồn kho có vế vị trí icontains (không dùng được index):
+    # trang đi theo stock_list_keyset_idx, câu đếm đã chặn ở 10001 dòng.
+    ALLOWED_SCANS = {("stock_list/search", "QuanLy_stockitem")}
+    # Trang phân trang keyset phải đọc theo đúng thứ tự index: sắp xếp lại bằng
+    # B-tree tạm = đọc hết tập lọc rồi mới cắt LIMIT, trang sau không rẻ hơn trang đầu
+    TEMP_SORT = "USE TEMP B-TREE FOR ORDER BY"
+    PAGINATED = ("stock_list", "api_stock_lots")
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "x"))
+        supplier = make_supplier()
+        product = make_product(supplier)
+        receipt = ImportReceipt.objects.create(supplier=supplier, import_date=date(2026, 1, 10))
+        ImportItem.objects.create(import_receipt=receipt, product=product, quantity=5, unit_price=1000,
+                                  unit="Thùng", location="Kệ A1", expiry_date=date(2026, 6, 1))
+        lot = StockItem.objects.get()
+        ExportItem.objects.create(receipt=ExportReceipt.objects.create(destination="Cửa hàng 1"),
+                                  stock_item=lot, quantity=1, unit="Thùng")
+        # con trỏ trang sau của trang tồn kho (khóa views.STOCK_LIST_KEYS)
+        from .pagination import encode_cursor
+        self.cursor = encode_cursor([lot.status_rank, lot.sort_date, lot.pk])
+        # con trỏ trang sau của ô chọn lô (khóa FEFO (fefo_date, id))
+        self.lots_cursor = encode_cursor([lot.fefo_date, lot.pk])
+
+    def view_requests(self):
+        month = {"date_from": "2026-01-01", "date_to": "2026-01-31"}
+        return {
+            "stock_list/filters": ("stock_list", {"status": "valid", "location": "Kệ A1", "category": "Sữa"}),
+            "stock_list/keyset": ("stock_list", {"after": self.cursor}),
+            "stock_list/keyset_back": ("stock_list", {"before": self.cursor, "status": "valid"}),
+            "stock_list/search": ("stock_list", {"q": "sua"}),
+            "import_list": ("import_list", {**month, "supplier": "NCC01"}),
+            "import_list/search": ("import_list", {"q": "sua tuoi", **month}),
+            "export_list": ("export_list", month),
+            "export_list/search": ("export_list", {"q": "sua tuoi", **month}),
+            "return_list/search": ("return_list", {"q": "sua", **month}),
+            "po_list": ("po_list", {**month, "status": "pending", "supplier": "NCC01"}),
+            "asn_list": ("asn_list", {**month, "status": "delivered", "supplier": "NCC01"}),
+            "reports": ("reports", {"start_date": "2026-01-01", "end_date": "2026-01-31"}),
+            "create_export/lots": ("api_stock_lots", {}),
+            "create_export/lots_keyset": ("api_stock_lots", {"after": self.lots_cursor}),
+            "create_export/lots_search": ("api_stock_lots", {"q": "sp"}),
+            "api_search": ("api_search", {"q": "sua"}),
+        }
+
+    def captured_selects(self, url_name, params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse(url_name), params)
+        self.assertEqual(response.status_code, 200)
+        return [q["sql"] for q in ctx.captured_queries if q["sql"].startswith("SELECT")]
+
+    def full_scans(self, sql):
+        # SQL bắt được đã điền sẵn tham số -> chạy lại được với EXPLAIN QUERY PLAN
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql)
+            plan = [row[-1] for row in cursor.fetchall()]
+        return {m.group(1) for m in map(self.FULL_SCAN.search, plan) if m}, plan
+
+    def test_no_full_table_scans(self):
+        for name, (url_name, params) in self.view_requests().items():
+            with self.subTest(name):
+                for sql in self.captured_selects(url_name, params):
+                    if " WHERE " not in sql:
+                        continue
+                    scans, plan = self.full_scans(sql)
+                    scans -= {table for view, table in self.ALLOWED_SCANS if view == name}
+                    self.assertEqual(scans, set(), f"{name}: {sql}\n" + "\n".join(plan))
+                    if url_name in self.PAGINATED and " LIMIT " in sql:
+                        self.assertFalse(any(self.TEMP_SORT in line for line in plan),
+                                         f"{name}: {sql}\n" + "\n".join(plan))
+
+    def test_stock_list_pages_walk_the_keyset_index(self):
+        for params in ({}, {"after": self.cursor}, {"before": self.cursor}):
+            with self.subTest(params):
+                page_sql = next(sql for sql in self.captured_selects("stock_list", params)
+                                if "ORDER BY" in sql and "LIMIT" in sql and "QuanLy_stockitem" in sql)
+                _, plan = self.full_scans(page_sql)
+                self.assertTrue(any("stock_list_keyset_idx" in line for line in plan), "\n".join(plan))
+                self.assertFalse(any("TEMP B-TREE" in line for line in plan), "\n".join(plan))
+
+
+# ===================== DANH MỤC: SỐ CÂU TRUY VẤN CỐ ĐỊNH =====================
+class CategoriesViewTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "x"))
+        self.supplier = make_supplier()
+        self.n = 0
+
+    def add_category(self, prices):
+        # 1 danh mục, mỗi giá là 1 lần nhập cùng mã SP (ngày nhập tăng dần)
+        self.n += 1
+        category = Category.objects.create(category_code=f"DM{self.n:02d}", name=f"Danh mục {self.n}")
+        product = make_product(self.supplier, code=f"SP{self.n:02d}", category=category)
+        for day, price in enumerate(prices, start=1):
+            receipt = ImportReceipt.objects.create(supplier=self.supplier, import_date=date(2026, 1, day))
+            ImportItem.objects.create(import_receipt=receipt, product=product,
+                                      quantity=1, unit_price=price, unit="Thùng")
+        return category
+
+    def get_categories(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("categories"))
+        self.assertEqual(response.status_code, 200)
+        return response, len(ctx)
+
+    def test_latest_import_price_per_product(self):
+        category = self.add_category([10000, 12000, 11000])
+        response, _ = self.get_categories()
+
+        listed = {c.pk: c.products_from_imports for c in response.context["categories"]}
+        self.assertEqual(
+            [(p["product_code"], p["unit_price"]) for p in listed[category.pk]],
+            [("SP01", 11000)],
+        )
+
+    def test_query_count_does_not_grow_with_categories(self):
+        self.add_category([10000])
+        _, baseline = self.get_categories()
+
+        for _ in range(10):
+            self.add_category([10000, 20000])
+        _, queries = self.get_categories()
+
+        self.assertEqual(queries, baseline)
+
+
+# ===================== SỐ LIỆU THEO NGÀY =====================
+class DailySummaryTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(category_code="DM01", name="Sữa")
+        self.product = make_product(make_supplier(), category=self.category)
+        self.day = date(2026, 3, 2)
+
+        receipt = ImportReceipt.objects.create(supplier=self.product.supplier, import_date=self.day)
+        ImportItem.objects.create(import_receipt=receipt, product=self.product, quantity=20,
+                                  unit_price=10000, discount_percent=10, unit="Thùng")
+        self.lot = StockItem.objects.get(product=self.product)
+        self.export = ExportReceipt.objects.create(destination="Cửa hàng 1", export_date=self.day)
+
+    def snapshot(self):
+        return list(DailySummary.objects.order_by("day", "product_id")
+                    .values("day", "product_id", "category_id", *DailySummary.MEASURES))
+
+    def test_incremental_matches_rebuild(self):
+        item = ExportItem.objects.create(receipt=self.export, stock_item=self.lot, quantity=5,
+                                         unit="Thùng", discount_percent=20)
+        ret = ReturnReceipt.objects.create(export_receipt=self.export, return_date=self.day)
+        ReturnItem.objects.create(receipt=ret, export_item=item, quantity=1)
+        item.quantity = 4
+        item.save()
+
+        row = DailySummary.objects.get(day=self.day, product=self.product)
+        self.assertEqual((row.import_quantity, row.import_value, row.import_discount), (20, 180000, 20000))
+        self.assertEqual((row.export_quantity, row.export_value, row.export_discount), (4, 32000, 8000))
+        self.assertEqual((row.return_quantity, row.return_value), (1, 10000))
+        self.assertEqual(row.category_id, "DM01")
+
+        incremental = self.snapshot()
+        DailySummary.rebuild()
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_deleting_receipts_matches_rebuild(self):
+        item = ExportItem.objects.create(receipt=self.export, stock_item=self.lot, quantity=5, unit="Thùng")
+        ret = ReturnReceipt.objects.create(export_receipt=self.export, return_date=self.day)
+        ReturnItem.objects.create(receipt=ret, export_item=item, quantity=1)
+        other = ImportReceipt.objects.create(supplier=self.product.supplier, import_date=self.day)
+        ImportItem.objects.create(import_receipt=other, product=self.product, quantity=7,
+                                  unit_price=10000, unit="Thùng")
+
+        ret.delete()
+        self.export.delete()
+        # xoá hàng loạt (admin) không gọi delete() của từng phiếu
+        ImportReceipt.objects.filter(pk=other.pk).delete()
+
+        row = DailySummary.objects.get(day=self.day, product=self.product)
+        self.assertEqual((row.import_quantity, row.export_quantity, row.return_quantity), (20, 0, 0))
+        incremental = self.snapshot()
+        DailySummary.rebuild()
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_deleting_last_line_clears_export_measures(self):
+        item = ExportItem.objects.create(receipt=self.export, stock_item=self.lot, quantity=5, unit="Thùng")
+        item.delete()
+
+        row = DailySummary.objects.get(day=self.day, product=self.product)
+        self.assertEqual((row.export_quantity, row.export_value), (0, 0))
+
+    def test_moving_receipt_date_refreshes_both_days(self):
+        item = ExportItem.objects.create(receipt=self.export, stock_item=self.lot, quantity=5, unit="Thùng")
+        ret = ReturnReceipt.objects.create(export_receipt=self.export, return_date=self.day)
+        ReturnItem.objects.create(receipt=ret, export_item=item, quantity=1)
+        moved = self.day + timedelta(days=3)
+
+        for receipt, field in ((ImportReceipt.objects.get(), "import_date"),
+                               (self.export, "export_date"), (ret, "return_date")):
+            setattr(receipt, field, moved)
+            receipt.save()
+
+        self.assertEqual(DailySummary.objects.filter(day=self.day).count(), 0)
+        row = DailySummary.objects.get(day=moved, product=self.product)
+        self.assertEqual((row.import_quantity, row.export_quantity, row.return_quantity), (20, 5, 1))
+
+        incremental = self.snapshot()
+        DailySummary.rebuild()
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_reports_read_summary(self):
+        ExportItem.objects.create(receipt=self.export, stock_item=self.lot, quantity=5, unit="Thùng")
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "x"))
+
+        response = self.client.get(reverse("reports"), {"start_date": "2026-03-01", "end_date": "2026-03-31"})
+
+        self.assertEqual(response.context["total_revenue"], 50000)
+        self.assertEqual(response.context["top_products"][0]["total_qty"], 5)
+        self.assertEqual(response.context["total_imports"], 1)
+
+
+# ===================== TRANG CHỦ: CACHE SỐ LIỆU =====================
+class DashboardMetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.today = date.today()
+        self.lot = make_lot(make_product(make_supplier()), 10)
+
+    def test_computed_in_two_queries_then_served_from_cache(self):
+        with self.assertNumQueries(2):
+            metrics = get_dashboard_metrics(self.today)
+        self.assertEqual(metrics["stock_total"], 10)
+        self.assertEqual(metrics["total_products"], 1)
+
+        with self.assertNumQueries(0):
+            get_dashboard_metrics(self.today)
+
+        stats = dashboard_cache_stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["hit_rate"]), (1, 1, 0.5))
+
+    def test_receipt_write_invalidates_after_commit(self):
+        get_dashboard_metrics(self.today)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            receipt = ExportReceipt.objects.create(destination="Cửa hàng 1", export_date=self.today)
+            ExportItem.objects.create(receipt=receipt, stock_item=self.lot, quantity=4, unit="Thùng")
+
+        metrics = get_dashboard_metrics(self.today)
+        self.assertEqual(metrics["stock_total"], 6)
+        self.assertEqual(metrics["export_count_today"], 1)
+        self.assertEqual(dashboard_cache_stats()["misses"], 2)
+
+
+class RoleCacheTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import Group
+        self.manager = Group.objects.create(name="Cửa hàng trưởng")
+        self.staff = Group.objects.create(name="Nhân viên")
+        self.user = User.objects.create_user("nv01", password="x")
+        self.user.groups.add(self.staff)
+        make_supplier()
+
+    def _group_queries(self, queries):
+        return [q for q in queries if "auth_user_groups" in q["sql"]]
+
+    def test_suppliers_page_loads_groups_once(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("suppliers"))
+        self.assertEqual(response.status_code, 200)
+        # decorator + 2 lần get_permission_flags + has_any_group trong base.html
+        self.assertEqual(len(self._group_queries(ctx.captured_queries)), 1)
+
+    def test_membership_change_is_seen(self):
+        from .roles import get_group_names
+        self.assertEqual(get_group_names(self.user), {"Nhân viên"})
+        self.user.groups.add(self.manager)
+        self.assertEqual(get_group_names(self.user), {"Nhân viên", "Cửa hàng trưởng"})
+
+    def test_session_cache_invalidated_on_group_change(self):
+        self.client.force_login(self.user)
+        with self.settings(ROLE_CACHE_IN_SESSION=True):
+            self.client.get(reverse("suppliers"))
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.get(reverse("suppliers"))
+            self.assertEqual(self._group_queries(ctx.captured_queries), [])
+
+            # bỏ user khỏi nhóm từ phía Group -> phiên bản nhóm đổi, request sau bị chặn
+            self.staff.user_set.remove(self.user)
+            response = self.client.get(reverse("suppliers"))
+            self.assertEqual(response.status_code, 403)
+
+    def test_session_cache_invalidated_on_group_rename_and_delete(self):
+        self.client.force_login(self.user)
+        with self.settings(ROLE_CACHE_IN_SESSION=True):
+            self.assertEqual(self.client.get(reverse("suppliers")).status_code, 200)
+
+            self.staff.name = "Nhân viên kho"
+            self.staff.save()
+            self.assertEqual(self.client.get(reverse("suppliers")).status_code, 403)
+
+            self.user.groups.add(self.manager)
+            self.assertEqual(self.client.get(reverse("suppliers")).status_code, 200)
+            self.manager.delete()
+            self.assertEqual(self.client.get(reverse("suppliers")).status_code, 403)
+
+    def test_missing_version_reloads_from_db(self):
+        from django.core.cache import caches
+        self.client.force_login(self.user)
+        with self.settings(ROLE_CACHE_IN_SESSION=True):
+            self.client.get(reverse("suppliers"))
+
+            # nhóm đổi mà không qua signal, rồi mất mã phiên bản (cache bị dọn)
+            User.groups.through.objects.filter(user=self.user).delete()
+            caches["roles"].clear()
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(reverse("suppliers"))
+            self.assertEqual(len(self._group_queries(ctx.captured_queries)), 1)
+            self.assertEqual(response.status_code, 403)
+
+
+# ===================== TÌM KIẾM KHÔNG DẤU =====================
+class SearchTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "x"))
+        self.supplier = make_supplier()
+        self.milk = make_product(self.supplier, "SP01", "Sữa tươi Đà Lạt")
+        self.bread = make_product(self.supplier, "SP02", "Bánh mì")
+
+    def receipt_with(self, product, **kwargs):
+        receipt = ImportReceipt.objects.create(supplier=self.supplier, **kwargs)
+        ImportItem.objects.create(import_receipt=receipt, product=product,
+                                  quantity=1, unit_price=1000, unit="Thùng")
+        return receipt
+
+    def test_normalize_text(self):
+        from .search import normalize_text
+        self.assertEqual(normalize_text("  Sữa TƯƠI ", None, "Đà  Lạt"), "sua tuoi da lat")
+
+    def test_search_text_maintained_on_save(self):
+        self.assertEqual(self.milk.search_text, "sp01 sua tuoi da lat")
+        self.milk.name = "Sữa chua"
+        self.milk.save(update_fields=["name"])
+        self.milk.refresh_from_db()
+        self.assertEqual(self.milk.search_text, "sp01 sua chua")
+
+        from .search import matching
+        self.assertFalse(matching(SupplierProduct, "tươi").exists())
+        self.assertTrue(matching(SupplierProduct, "sua chua").exists())
+
+    def test_list_finds_text_typed_without_diacritics(self):
+        by_note = self.receipt_with(self.bread, note="Giao lúc sáng")
+        by_product = self.receipt_with(self.milk)
+        self.receipt_with(self.bread)
+
+        response = self.client.get(reverse("import_list"), {"q": "sua tuoi"})
+        self.assertEqual(list(response.context["imports"]), [by_product])
+
+        response = self.client.get(reverse("import_list"), {"q": "GIAO LUC"})
+        self.assertEqual(list(response.context["imports"]), [by_note])
+
+    def test_own_fields_rank_before_related_matches(self):
+        # "banh" khớp ghi chú của phiếu cũ và SP trên dòng hàng của phiếu mới
+        own = self.receipt_with(self.milk, note="Bánh quy tặng kèm")
+        related = self.receipt_with(self.bread)
+
+        response = self.client.get(reverse("import_list"), {"q": "banh"})
+        self.assertEqual(list(response.context["imports"]), [own, related])
+
+    def test_short_terms_and_other_lists(self):
+        lot = make_lot(self.milk, 5)
+        make_lot(self.bread, 5)
+
+        response = self.client.get(reverse("stock_list"), {"q": "sữa"})
+        self.assertEqual([s.pk for s in response.context["stocks"]], [lot.pk])
+
+        # từ < 3 ký tự không dùng được trigram -> lọc LIKE trên cột chuẩn hoá
+        response = self.client.get(reverse("asn_list"), {"q": "mi"})
+        self.assertEqual(response.status_code, 200)
+        category = Category.objects.create(category_code="DM01", name="Đồ uống")
+        response = self.client.get(reverse("categories"), {"q": "do uong"})
+        self.assertEqual(list(response.context["categories"]), [category])
+
+    def test_model_without_search_parts_is_rejected(self):
+        from .search import SearchTextMixin
+        with self.assertRaises(TypeError):
+            type("NoParts", (SearchTextMixin,), {"__module__": __name__})
+
+    def test_post_migrate_reinstalls_missing_fts_triggers(self):
+        from .search import ensure_fts, fts_supported, install_fts, matching
+        if not fts_supported(connection):
+            self.skipTest("CSDL không có FTS5 trigram")
+
+        # bảng gốc bị dựng lại khi migrate trên SQLite -> trigger đồng bộ mất theo
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER "QuanLy_supplierproduct_search_ai"')
+        make_product(self.supplier, "SP03", "Trà xanh")
+        self.assertFalse(matching(SupplierProduct, "tra xanh").exists())
+
+        with mock.patch("QuanLy.search.install_fts", side_effect=install_fts) as install:
+            ensure_fts(using=connection.alias)
+        # chỉ bảng thiếu trigger được cài lại (kèm nạp lại chỉ mục)
+        self.assertEqual([c.args[1] for c in install.call_args_list], ["QuanLy_supplierproduct"])
+        self.assertTrue(matching(SupplierProduct, "tra xanh").exists())
+        make_product(self.supplier, "SP04", "Trà đào")
+        self.assertTrue(matching(SupplierProduct, "tra dao").exists())
+
+
+# ===================== TÌM KIẾM CHUNG (/api/search) =====================
+class GlobalSearchTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "x"))
+        self.supplier = make_supplier()
+        self.milk = make_product(self.supplier, "SP01", "Sữa tươi Đà Lạt")
+
+    def search(self, **params):
+        response = self.client.get(reverse("api_search"), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()["results"]
+
+    def test_typed_hits_with_links(self):
+        receipt = ImportReceipt.objects.create(supplier=self.supplier, note="Giao thiếu SP01")
+        ImportItem.objects.create(import_receipt=receipt, product=self.milk,
+                                  quantity=3, unit_price=1000, unit="Thùng", location="Kệ A1")
+
+        hits = self.search(q="sp01")
+        self.assertEqual({h["type"] for h in hits}, {"import", "product", "lot"})
+        # "SP01" là mã của sản phẩm và lô -> xếp trên phiếu chỉ nhắc tới trong ghi chú
+        self.assertEqual(hits[-1]["type"], "import")
+        self.assertEqual(hits[-1]["url"], f"{reverse('import_list')}?q={receipt.import_code}")
+
+        self.assertEqual([h["type"] for h in self.search(q="ke a1")], ["lot"])
+        self.assertEqual([h["key"] for h in self.search(q=receipt.import_code, type="import")],
+                         [str(receipt.pk)])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.assertEqual([h["title"] for h in self.search(q="sua tuoi")], ["SP01 - Sữa tươi Đà Lạt"])
+
+        self.milk.name = "Sữa chua"
+        self.milk.save()
+        self.assertEqual(self.search(q="tuoi"), [])
+        self.assertEqual(len(self.search(q="chua")), 1)
+
+        self.milk.delete()
+        self.assertEqual(self.search(q="chua"), [])
+
+    def test_bulk_received_lots_are_indexed(self):
+        receipt = ImportReceipt.objects.create(supplier=self.supplier)
+        ImportItem.bulk_receive(receipt, [
+            ImportItem(product=self.milk, quantity=2, unit_price=1000, unit="Thùng", location="Kho lạnh"),
+        ])
+        hits = self.search(q="kho lanh")
+        self.assertEqual([(h["type"], h["key"]) for h in hits],
+                         [("lot", str(StockItem.objects.get().pk))])
+
+    def test_old_document_matching_every_term_is_found(self):
+        from .models import SearchIndexEntry
+        from .search_index import CANDIDATE_LIMIT, ranked_documents, tokenize
+
+        def index(key, text):
+            return [SearchIndexEntry(word=word, doc_type="product", doc_key=key, weight=weight)
+                    for word, weight in tokenize("", text).items()]
+
+        # 1 tài liệu cũ "sua dalat" + 1.200 tài liệu mới hơn chỉ chung từ "dalat"
+        SearchIndexEntry.objects.all().delete()
+        entries = index("old", "sua dalat")
+        for n in range(CANDIDATE_LIMIT + 200):
+            entries += index(f"new{n}", "banh dalat")
+        SearchIndexEntry.objects.bulk_create(entries, batch_size=2000)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual([key for _, key, _ in ranked_documents("sua dalat")], ["old"])
+        # từ dẫn là từ hiếm ("sua"), không phải từ dài nhất
+        self.assertIn("\"word\" = 'sua'", ctx.captured_queries[-1]["sql"].split("EXISTS")[0])
+
+        # cả 2 từ đều phổ biến: lọc từ còn lại trong SQL trước LIMIT vẫn thấy tài liệu cũ
+        entries = []
+        for n in range(CANDIDATE_LIMIT + 200):
+            entries += index(f"sua{n}", "sua tuoi")
+        SearchIndexEntry.objects.bulk_create(entries, batch_size=2000)
+        self.assertEqual([key for _, key, _ in ranked_documents("sua dalat")], ["old"])
+
+    def test_benchmark_goes_through_the_endpoint(self):
+        from .models import SearchIndexEntry
+        from .search_index import global_search
+        before = SearchIndexEntry.objects.count()
+        out = io.StringIO()
+        with mock.patch("QuanLy.search_index.global_search", wraps=global_search) as search:
+            call_command("benchmark_search", documents=200, queries=5, budget_ms=10_000, stdout=out)
+        self.assertEqual(search.call_count, 5)
+        self.assertIn("p95", out.getvalue())
+        self.assertEqual(SearchIndexEntry.objects.count(), before)     # đã rollback
+
+    def test_invalid_type(self):
+        response = self.client.get(reverse("api_search"), {"q": "sua", "type": "abc"})
+        self.assertEqual(response.status_code, 400)
+
+
+# ===================== SINH DỮ LIỆU GIẢ LẬP =====================
+class SeedWarehouseTests(TestCase):
+    def seed(self, **options):
+        options = {"lots": 300, "chunk_size": 100, "end_date": "2026-03-31", "days": 90, **options}
+        call_command("seed_warehouse", stdout=io.StringIO(), **options)
+
+    def snapshot(self):
+        return (
+            list(ImportReceipt.objects.order_by("pk").values_list("import_code", "import_date", "total_price")),
+            list(StockItem.objects.order_by("pk").values_list("product_id", "quantity", "expiry_date")),
+            list(ExportItem.objects.order_by("pk").values_list("receipt_id", "stock_item_id", "quantity")),
+        )
+
+    def test_stock_and_totals_are_consistent(self):
+        self.seed(return_ratio=0.3)
+
+        self.assertEqual(ImportItem.objects.count(), 300)
+        self.assertTrue(ReturnItem.objects.exists())
+        self.assertFalse(StockItem.objects.annotate(ledger=Sum("movements__quantity"))
+                                          .exclude(ledger=F("quantity")).exists())
+        for model in (ImportReceipt, ExportReceipt, ReturnReceipt, PurchaseOrder):
+            self.assertEqual(model.mismatched_totals(), [], model.__name__)
+        self.assertEqual(ASN.objects.filter(importreceipt__isnull=True, status="delivered").count(), 0)
+        self.assertTrue(DailySummary.objects.exists())
+
+        # mã cấp sau khi seed nối tiếp, không trùng
+        last = ImportReceipt.objects.order_by("-pk").values_list("import_code", flat=True).first()
+        self.assertGreater(DocumentSequence.allocate("PN", ImportReceipt, "import_code"), last)
+
+    def test_same_seed_same_data(self):
+        with transaction.atomic():
+            self.seed(skip_search_index=True)
+            first = self.snapshot()
+            transaction.set_rollback(True)
+
+        self.seed(skip_search_index=True)
+        self.assertEqual(self.snapshot(), first)
+
+    def test_refuses_non_empty_database(self):
+        make_supplier()
+        with self.assertRaises(CommandError):
+            self.seed()
+
+
+# ===================== KỊCH BẢN BENCHMARK =====================
+class BenchmarkScenarioTests(TestCase):
+    def seeded_scenarios(self):
+        from .benchmarks import build_scenarios
+
+        call_command("seed_warehouse", lots=200, chunk_size=100, end_date="2026-03-31", days=60,
+                     stdout=io.StringIO())
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "x"))
+        return {s.name: s for s in build_scenarios()}
+
+    def test_scenarios_run_on_seeded_data(self):
+        from .benchmarks import response_problem
+
+        for scenario in self.seeded_scenarios().values():
+            with self.subTest(scenario.name):
+                response = getattr(self.client, scenario.method)(scenario.url, scenario.data)
+                # kịch bản ghi phải lưu được (redirect), không rơi vào form lỗi
+                self.assertEqual(response.status_code, 302 if scenario.writes else 200)
+                self.assertIsNone(response_problem(scenario, response))
+
+    def test_failed_runs_are_not_timed(self):
+        from .benchmarks import response_problem
+
+        scenarios = self.seeded_scenarios()
+
+        # form lỗi: 200 thay vì redirect
+        broken = scenarios["create_import/post"]
+        broken = broken._replace(data={**broken.data, "items-0-quantity": "abc"})
+        response = self.client.post(broken.url, broken.data)
+        self.assertEqual(response_problem(broken, response), "HTTP 200, cần 302")
+
+        # phiếu hoàn không lưu được dòng nào vẫn redirect -> nhận ra qua thông báo cảnh báo
+        empty = scenarios["create_return/post"]
+        empty = empty._replace(data={k: "" if k.endswith("-quantity") else v for k, v in empty.data.items()})
+        response = self.client.post(empty.url, empty.data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response_problem(empty, response), "Chưa có sản phẩm hợp lệ.")
+
+    def test_compare_results(self):
+        from .benchmarks import compare_results, summarize
+
+        def run(p95, queries):
+            return {"datasets": {"10000": {"scenarios": {"stock_list": {"p95_ms": p95, "queries": queries}}}}}
+
+        self.assertEqual(summarize([5, 1, 3, 2, 4])["p50_ms"], 3)
+        self.assertEqual(compare_results(run(100, 8), run(115, 8)), [])
+        self.assertEqual(len(compare_results(run(100, 8), run(130, 8))), 1)
+        self.assertEqual(len(compare_results(run(1, 8), run(2, 8))), 0)       # dưới min_delta_ms
+        self.assertEqual(compare_results(run(100, 8), run(100, 9))[0][:2], ("10000", "stock_list"))
+
+
+# ===================== NGÂN SÁCH SỐ CÂU TRUY VẤN: MỌI URL =====================
+class QueryBudgetTests(TestCase):
+    # Gọi mọi URL có tên trong QuanLy/urls.py ở 2 quy mô dữ liệu; số câu truy vấn
+    # phải giữ nguyên khi thêm chứng từ / dòng hàng. URL nào tăng -> in các câu
+    # SQL chạy thêm kèm dòng code (và template) gây ra.
+    SIZES = ((2, 2), (4, 5))        # (số chứng từ mỗi loại, số dòng mỗi chứng từ)
+
+    def setUp(self):
+        # superuser trùng mã NCC -> vào được cả trang của Nhà cung ứng (create_asn / asn_edit)
+        self.user = User.objects.create_superuser("NCC01", "admin@example.com", "x")
+        self.supplier = make_supplier("NCC01")
+        self.n = 0
+
+    def populate(self, documents, lines):
+        today = date.today()
+        for _ in range(documents):
+            self.n += 1
+            category = Category.objects.create(category_code=f"DM{self.n:02d}", name=f"Danh mục {self.n}")
+            make_supplier(f"NCC{self.n + 1:02d}")
+            products = [
+                make_product(self.supplier, f"SP{self.n:02d}{k:02d}", f"Sản phẩm {self.n}-{k}", category=category)
+                for k in range(lines)
+            ]
+
+            po = PurchaseOrder.objects.create(supplier=self.supplier, created_by=self.user)
+            asn = ASN.objects.create(
+                po=po, supplier=self.supplier, created_by=self.user, deliverer_name="Tài xế",
+                deliverer_phone="0900000000", expected_date=today,
+            )
+            receipt = ImportReceipt.objects.create(supplier=self.supplier, asn=asn, created_by=self.user)
+            for product in products:
+                PurchaseOrderItem.objects.create(po=po, product=product, quantity=10, unit_price=1000)
+                ASNItem.objects.create(asn=asn, product=product, quantity=10, unit="Thùng", unit_price=1000)
+                ImportItem.objects.create(import_receipt=receipt, product=product, quantity=10, unit_price=1000,
+                                          unit="Thùng", location="Kệ A1", expiry_date=today + timedelta(days=90))
+
+            export = ExportReceipt.objects.create(destination="Cửa hàng 1", created_by=self.user)
+            export_items = [
+                ExportItem.objects.create(receipt=export, stock_item=lot, quantity=2, unit="Thùng")
+                for lot in StockItem.objects.filter(import_receipt=receipt).order_by("pk")
+            ]
+            ret = ReturnReceipt.objects.create(export_receipt=export, created_by=self.user)
+            for export_item in export_items:
+                ReturnItem.objects.create(receipt=ret, export_item=export_item, quantity=1)
+
+        return {"category": category, "product": products[0], "po": po, "asn": asn,
+                "import": receipt, "export": export, "return": ret}
+
+    def url_args(self, latest):
+        # tham số đường dẫn / query string; URL không có ở đây gọi không tham số
+        return {
+            "edit_category": ({"pk": latest["category"].pk}, {}),
+            "delete_category": ({"pk": latest["category"].pk}, {}),
+            "edit_supplier": ({"pk": self.supplier.pk}, {}),
+            "supplier_history": ({"pk": self.supplier.pk}, {}),
+            "create_import": ({}, {"asn": latest["asn"].pk}),
+            "import_export_pdf": ({"code": latest["import"].import_code}, {}),
+            "export_export_pdf": ({"code": latest["export"].export_code}, {}),
+            "return_export_pdf": ({"code": latest["return"].return_code}, {}),
+            "po_edit": ({"code": latest["po"].pk}, {}),
+            "po_export_pdf": ({"code": latest["po"].pk}, {}),
+            "asn_edit": ({"code": latest["asn"].pk}, {}),
+            "asn_export_pdf": ({"code": latest["asn"].pk}, {}),
+            "api_supplier_products": ({"supplier_id": self.supplier.pk}, {}),
+            "api_po_details": ({"po_id": latest["po"].pk}, {}),
+            "api_export_items": ({"export_code": latest["export"].pk}, {}),
+            "api_asn_items": ({"asn_code": latest["asn"].pk}, {}),
+            "api_fefo_allocation": ({}, {"product": latest["product"].pk, "quantity": 3}),
+            "api_search": ({}, {"q": "Sản phẩm"}),
+        }
+
+    def measure(self, latest):
+        names = sorted({p.name for p in get_resolver("QuanLy.urls").url_patterns if p.name})
+        args = self.url_args(latest)
+        recorders = {}
+        for name in names:
+            kwargs, params = args.get(name, ({}, {}))
+            url = reverse(name, kwargs=kwargs)
+            self.client.force_login(self.user)       # logout (GET) đăng xuất phiên
+            cache.clear()
+            self.client.get(url, params)             # chạy nóng: cache FTS, ContentType...
+            self.client.force_login(self.user)
+            with QueryRecorder() as recorder:
+                response = self.client.get(url, params)
+            self.assertLess(response.status_code, 500, name)
+            recorders[name] = recorder
+        return recorders
+
+    # PDF: chỉ đo phần dựng HTML, không gọi wkhtmltopdf
+    @mock.patch("QuanLy.views.pdfkit")
+    def test_query_count_does_not_grow_with_data(self, pdfkit):
+        pdfkit.from_string.return_value = b"%PDF"
+
+        small = self.measure(self.populate(*self.SIZES[0]))
+        large = self.measure(self.populate(*self.SIZES[1]))
+
+        self.assertEqual(small.keys(), large.keys())
+        for name, recorder in large.items():
+            with self.subTest(name):
+                self.assertEqual(len(recorder), len(small[name]),
+                                 f"{name}: {format_grown(small[name], recorder)}")
+
+    def test_recorder_reports_repeated_query_origin(self):
+        product = make_product(self.supplier)
+        for n in range(3):
+            make_lot(product, 10 + n)
+
+        with QueryRecorder() as before:
+            StockItem.objects.first().product.name
+        with QueryRecorder() as after:
+            [lot.product.name for lot in StockItem.objects.order_by("pk")]
+
+        report = format_grown(before, after)
+        self.assertIn("2 -> 4 câu truy vấn", report)
+        self.assertIn("1 -> 3 lần", report)
+
+        # nơi gọi = dòng code dự án gần câu SQL nhất
+        cache.clear()
+        with QueryRecorder() as recorder:
+            get_dashboard_metrics(date.today())
+        self.assertTrue(recorder.queries)
+        self.assertTrue(all(q.origin.startswith("QuanLy/dashboard.py:") for q in recorder.queries))
+
+
+# ===================== ĐO THỜI GIAN REQUEST (Server-Timing) =====================
+class RequestTimingTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "x"))
+        self.product = make_product(make_supplier())
+
+    def test_server_timing_header_and_log(self):
+        with self.assertLogs("QuanLy.performance", "DEBUG") as logs:
+            response = self.client.get(reverse("suppliers"))
+
+        timing = response["Server-Timing"]
+        self.assertRegex(timing, r'sql;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn("tpl;dur=", timing)
+        self.assertIn("total;dur=", timing)
+
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual((record["view"], record["status"]), ("suppliers", 200))
+        self.assertGreater(record["sql_count"], 0)
+        self.assertEqual(logs.records[-1].performance, record)
+
+    @mock.patch("QuanLy.views.pdfkit")
+    def test_external_call_time(self, pdfkit):
+        pdfkit.from_string.return_value = b"%PDF"
+        po = PurchaseOrder.objects.create(supplier=self.product.supplier)
+        response = self.client.get(reverse("po_export_pdf", args=[po.pk]))
+        self.assertIn("ext-pdfkit;dur=", response["Server-Timing"])
+
+    @override_settings(PERF_SAMPLE_RATE=0, PERF_SLOW_REQUEST_MS=0)
+    def test_unsampled_slow_request_logged_without_detail(self):
+        with self.assertLogs("QuanLy.performance", "WARNING") as logs:
+            response = self.client.get(reverse("suppliers"))
+        self.assertFalse(response.has_header("Server-Timing"))
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertFalse(record["sampled"])
+        self.assertNotIn("sql_count", record)
+
+
+# ===================== CÂU SQL CHẬM =====================
+class SlowQueryLogTests(TestCase):
+    def setUp(self):
+        from .slow_queries import clear_slow_queries
+        clear_slow_queries()
+        self.addCleanup(clear_slow_queries)
+        self.admin = User.objects.create_superuser("admin", "admin@example.com", "x")
+        make_lot(make_product(make_supplier()), 10)
+
+    def test_normalize_sql(self):
+        from .slow_queries import normalize_sql
+        self.assertEqual(
+            normalize_sql('SELECT "a" FROM "t"\n  WHERE "id" IN (%s, %s, %s) AND "x" = \'ab\' LIMIT 21'),
+            'SELECT "a" FROM "t" WHERE "id" IN (...) AND "x" = ? LIMIT ?',
+        )
+
+    @override_settings(SLOW_QUERY_MS=0)
+    def test_records_and_ranks_slow_queries(self):
+        from .slow_queries import slow_query_entries
+
+        self.client.force_login(self.admin)
+        self.client.get(reverse("stock_list"))
+
+        entries = [e for e in slow_query_entries() if e["view"] == "stock_list"]
+        self.assertTrue(entries)
+        table = StockItem._meta.db_table
+        select = next(e for e in entries if e["sql"].startswith("SELECT") and f'FROM "{table}"' in e["sql"])
+        self.assertIn(table, select["plan"])                  # đã EXPLAIN (sau khi view xong)
+        self.assertEqual(len(select["params_fingerprint"]), 12)
+
+        response = self.client.get(reverse("slow_queries"))
+        self.assertEqual(response.status_code, 200)
+        totals = [g["total_ms"] for g in response.context["groups"]]
+        self.assertEqual(totals, sorted(totals, reverse=True))
+
+        # chỉ còn câu của chính request xoá (ghi sau khi view xong)
+        self.client.post(reverse("slow_queries"))
+        self.assertEqual({e["view"] for e in slow_query_entries()}, {"slow_queries"})
+
+    @override_settings(SLOW_QUERY_MS=0)
+    def test_explain_runs_after_the_view_once_per_query(self):
+        from . import slow_queries
+
+        self.client.force_login(self.admin)
+        inside_view = []
+
+        def explain(connection, sql, params):
+            # execute_wrapper của middleware còn gắn = view chưa xong
+            inside_view.append(bool(connection.execute_wrappers))
+            return "plan"
+
+        with mock.patch.object(slow_queries, "explain", side_effect=explain):
+            self.client.get(reverse("stock_list"))
+            first = len(inside_view)
+            self.client.get(reverse("stock_list"))      # cùng các câu -> dùng lại kế hoạch
+
+        self.assertTrue(first)
+        self.assertEqual(len(inside_view), first)
+        self.assertFalse(any(inside_view))
+        entries = [e for e in slow_queries.slow_query_entries() if e["view"] == "stock_list"]
+        self.assertEqual(first, len({e["fingerprint"] for e in entries}))
+        self.assertTrue(all(e["plan"] == "plan" for e in entries if e["sql"].startswith("SELECT")))
+
+    def test_superuser_only(self):
+        self.client.force_login(User.objects.create_user("nv01", password="x"))
+        self.assertEqual(self.client.get(reverse("slow_queries")).status_code, 403)
+
+
+# ===================== 1 EXECUTE_WRAPPER CHO MỖI REQUEST =====================
+class SqlCollectorTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "x"))
+        make_product(make_supplier())
+
+    def test_one_wrapper_feeds_timing_metrics_and_slow_queries(self):
+        from .performance import RequestTimings, request_timings
+
+        wrappers, seen = [], []
+
+        def view_wrapper(execute, sql, params, many, context):
+            wrappers.append(list(context["connection"].execute_wrappers))
+            return execute(sql, params, many, context)
+
+        with override_settings(SLOW_QUERY_MS=0), connection.execute_wrapper(view_wrapper):
+            with mock.patch("QuanLy.metrics.SQL_QUERY_DURATION.observe_many") as observe:
+                response = self.client.get(reverse("suppliers"))
+
+        # câu của view: ngoài wrapper của test chỉ có đúng 1 wrapper đo đạc;
+        # EXPLAIN câu chậm chạy sau đó, không còn wrapper nào của middleware
+        measured = [stack[1:] for stack in wrappers if len(stack) > 1]
+        self.assertTrue(measured)
+        for stack in measured:
+            self.assertEqual([type(w) for w in stack], [RequestTimings])
+        timings = request_timings(response.wsgi_request)
+        self.assertEqual(timings.sql_count, len(measured))
+        self.assertEqual(observe.call_args.args[0], timings.sql_durations)
+        self.assertEqual(len(timings.slow_queries), timings.sql_count)
+
+
+# ===================== SỐ LIỆU PROMETHEUS =====================
+class MetricsTests(TestCase):
+    def setUp(self):
+        from .metrics import clear_metrics
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.metrics_dir = directory.name
+        override = override_settings(METRICS_DIR=self.metrics_dir, METRICS_TOKEN="bi-mat")
+        override.enable()
+        self.addCleanup(override.disable)
+        clear_metrics()
+        self.addCleanup(clear_metrics)
+        self.product = make_product(make_supplier())
+
+    def scrape(self, **extra):
+        response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer bi-mat", **extra)
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode("utf-8")
+
+    def test_values_from_every_process_file_are_summed(self):
+        from .metrics import MmapedValues, collect, read_file
+
+        files = []
+        for pid in (101, 102):
+            values = MmapedValues(f"{self.metrics_dir}/quanly_{pid}.db")
+            self.addCleanup(values.close)
+            files.append(values)
+        files[0].inc([('["x_total", []]', 2)])
+        files[1].inc([('["x_total", []]', 3), ('["y_total", []]', 1.5)])
+        # khoá dài buộc file phải nới rộng
+        files[1].inc([(f'["z_total", [["k", "{i:0>2000}"]]]', 1) for i in range(100)])
+
+        self.assertEqual(read_file(f"{self.metrics_dir}/quanly_101.db"), [('["x_total", []]', 2.0)])
+        samples = collect()
+        self.assertEqual(samples["x_total"][()], 5.0)
+        self.assertEqual(samples["y_total"][()], 1.5)
+        self.assertEqual(len(samples["z_total"]), 100)
+
+    def test_request_and_sql_metrics(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "x"))
+        self.client.get(reverse("suppliers"))
+        self.client.logout()
+
+        body = self.scrape()
+        self.assertIn('quanly_http_requests_total{method="GET",status="200",view="suppliers"} 1', body)
+        self.assertIn('quanly_http_request_duration_seconds_bucket{le="+Inf",view="suppliers"} 1', body)
+        self.assertRegex(body, r'quanly_sql_queries_total\{view="suppliers"\} [1-9]')
+        self.assertIn("# TYPE quanly_sql_query_duration_seconds histogram", body)
+
+        # bucket cộng dồn, không giảm dần
+        buckets = [
+            float(line.rsplit(" ", 1)[1]) for line in body.splitlines()
+            if line.startswith('quanly_sql_query_duration_seconds_bucket') and 'view="suppliers"' in line
+        ]
+        self.assertEqual(buckets, sorted(buckets))
+
+    def test_stock_movements_counted_after_commit(self):
+        lot = make_lot(self.product, 10)
+        with self.captureOnCommitCallbacks(execute=True):
+            StockMovement.record(lot, -4, "export", "PX1")
+            StockMovement.bulk_record([
+                StockMovement.build(lot, 3, "return", "PH1"),
+                StockMovement.build(lot, 2, "return", "PH2"),
+            ])
+
+        body = self.scrape()
+        self.assertIn('quanly_stock_units_total{direction="out",type="export"} 4', body)
+        self.assertIn('quanly_stock_movements_total{direction="in",type="return"} 2', body)
+        self.assertIn('quanly_stock_units_total{direction="in",type="return"} 5', body)
+
+    def test_rolled_back_receipt_not_counted(self):
+        from .metrics import count_receipt
+
+        with self.captureOnCommitCallbacks(execute=True):
+            count_receipt("import", 3)
+        try:
+            with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+                count_receipt("import", 7)
+                raise ValueError
+        except ValueError:
+            pass
+
+        body = self.scrape()
+        self.assertIn('quanly_receipts_created_total{type="import"} 1', body)
+        self.assertIn('quanly_receipt_lines_bucket{le="5.0",type="import"} 1', body)
+        self.assertIn('quanly_receipt_lines_sum{type="import"} 3', body)
+
+    def test_access_needs_token_allowed_ip_or_superuser(self):
+        url = reverse("metrics")
+        # mặc định không mở cho IP nào, kể cả 127.0.0.1 (sau proxy mọi request đều từ đó)
+        self.assertEqual(self.client.get(url, REMOTE_ADDR="127.0.0.1").status_code, 403)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION="Bearer sai").status_code, 403)
+        with override_settings(METRICS_TOKEN=""):
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION="Bearer ").status_code, 403)
+        with override_settings(METRICS_ALLOWED_IPS=["10.0.0.9"]):
+            self.assertEqual(self.client.get(url, REMOTE_ADDR="10.0.0.9").status_code, 200)
+
+        self.client.force_login(User.objects.create_user("nv01", password="x"))
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "x"))
+        self.assertEqual(self.client.get(url).status_code, 200)
@@ -57,10 +57,19 @@ urlpatterns = [
     # ===================== BÁO CÁO =====================
     path('reports/', views.reports, name='reports'),
 
+    # ===================== CÂU SQL CHẬM (superuser) =====================
+    path('slow-queries/', views.slow_queries, name='slow_queries'),
+
+    # ===================== SỐ LIỆU PROMETHEUS =====================
+    path('metrics', views.metrics, name='metrics'),
+
     # ===================== API ENDPOINTS =====================
     path('api/supplier-products/<str:supplier_id>/', views.api_supplier_products, name='api_supplier_products'),
     path('api/po-details/<str:po_id>/', views.api_po_details, name='api_po_details'),
     path('api/export-items/<str:export_code>/', views.api_export_items, name='api_export_items'),
+    path('api/stock-lots/', views.api_stock_lots, name='api_stock_lots'),
+    path('api/fefo-allocation/', views.api_fefo_allocation, name='api_fefo_allocation'),
+    path('api/search/', views.api_search, name='api_search'),
     path('api/asn-items/<str:asn_code>/', views.api_asn_items, name='api_asn_items'),
     path("api/asn-items/<str:asn_code>/", views.api_asn_items, name="api_asn_items"),
     path('suppliers/<str:pk>/history/', views.supplier_history, name='supplier_history'),
@@ -1,9 +1,16 @@
 from django.db import transaction
 from decimal import Decimal
+import hmac
 import pdfkit
 from django.template.loader import render_to_string
 from django.http import HttpResponse
 from .decorators import group_required, get_permission_flags
+from .roles import user_in_groups
+from .dashboard import get_dashboard_metrics, dashboard_cache_stats
+from .metrics import count_receipt
+from .performance import external_call
+from .search import apply_search, matching, ordered_by_rank
+from django.db.models import Exists, OuterRef
 from datetime import date, timedelta
 
 # ===================== DASHBOARD TRANG CHỦ =====================
@@ -11,29 +18,26 @@ from datetime import date, timedelta
 def index(request):
     today = timezone.localdate()
 
-    import_today = ImportReceipt.objects.filter(import_date=today).count()
-    export_today = ExportReceipt.objects.filter(export_date=today).count()
-    return_today = ReturnReceipt.objects.filter(return_date=today).count()
-    stock_total = StockItem.objects.aggregate(total=Sum("quantity"))["total"] or 0
-    expired = StockItem.objects.filter(status="expired").count()
-    nearly_expired = StockItem.objects.filter(status="nearly_expired").count()
-    total_products = SupplierProduct.objects.values("product_code").distinct().count()
+    # Số liệu tính 1 lần rồi lưu cache, làm mới khi có phiếu / tồn kho thay đổi
+    metrics = get_dashboard_metrics(today)
 
     context = {
         "today": today.strftime("%d/%m/%Y"),
 
         # tổng tồn kho
-        "stock_total": stock_total,
+        "stock_total": metrics["stock_total"],
 
         # tổng quan hôm nay
-        "import_count_today": import_today,
-        "export_count_today": export_today,
-        "return_count_today": return_today,
+        "import_count_today": metrics["import_count_today"],
+        "export_count_today": metrics["export_count_today"],
+        "return_count_today": metrics["return_count_today"],
 
-        "expired": expired,
-        "nearly_expired": nearly_expired,
-        "total_products": total_products,
+        "expired": metrics["expired"],
+        "nearly_expired": metrics["nearly_expired"],
+        "total_products": metrics["total_products"],
     }
+    if request.user.is_superuser:
+        context["dashboard_cache"] = dashboard_cache_stats()
     return render(request, "index.html", context)
 
 
@@ -48,11 +52,11 @@ def home_redirect(request):
         return redirect('index')
 
     # Cửa hàng trưởng / Nhân viên
-    if user.groups.filter(name__in=['Cửa hàng trưởng', 'Nhân viên']).exists():
+    if user_in_groups(user, ['Cửa hàng trưởng', 'Nhân viên'], request):
         return redirect('index')
 
     # Nhà cung ứng
-    if user.groups.filter(name='Nhà cung ứng').exists():
+    if user_in_groups(user, ['Nhà cung ứng'], request):
         return redirect('asn_list')
 
     # Unknown role → logout
@@ -69,42 +73,19 @@ def categories(request):
 
     data = Category.objects.all()
 
-    # BỘ LỌC TÌM KIẾM — không phân biệt hoa/thường + tìm trong sản phẩm
+    # BỘ LỌC TÌM KIẾM — không phân biệt hoa/thường, có/không dấu + tìm trong sản phẩm
     if q:
-        search = q.lower()
-        data = data.annotate(
-            name_l=Lower("name"),
-            code_l=Lower("category_code"),
-            desc_l=Lower("description"),
-        ).filter(
-            Q(name_l__contains=search) |
-            Q(code_l__contains=search) |
-            Q(desc_l__contains=search) |
-            Q(products__name__icontains=search) |
-            Q(products__product_code__icontains=search)
-        ).distinct()
-
-
-
-    # Lấy danh sách sản phẩm duy nhất từ phiếu nhập
-    for category in data:
-        import_items = ImportItem.objects.filter(
-            product__category=category
-        ).select_related("product").order_by(
-            "product__product_code", "-import_receipt__import_date"
-        )
+        data = ordered_by_rank(apply_search(data, q, also=[
+            Exists(SupplierProduct.objects.filter(
+                category=OuterRef("pk"), pk__in=matching(SupplierProduct, q)
+            )),
+        ]))
 
-        unique_products = {}
-        for item in import_items:
-            code = item.product.product_code
-            if code not in unique_products:
-                unique_products[code] = {
-                    "product_code": code,
-                    "name": item.product.name,
-                    "unit_price": item.unit_price,
-                }
 
-        category.products_from_imports = list(unique_products.values())
+
+    # Sản phẩm (không trùng mã) từ phiếu nhập + đơn giá nhập gần nhất,
+    # lấy cho tất cả danh mục trong 1 câu truy vấn
+    data = Category.attach_products_from_imports(data)
 
     return render(request, "categories.html", {
         "categories": data,
@@ -160,7 +141,7 @@ def suppliers(request):
 
     city = request.GET.get("city", "")
     user = request.user
-    perms = get_permission_flags(user)
+    perms = get_permission_flags(user, request)
 
     if perms["is_supplier"]:
         # username của user NCC = supplier_code
@@ -168,8 +149,10 @@ def suppliers(request):
     else:
         suppliers = Supplier.objects.all()
 
+    # danh sách SP của từng NCC (popup) nạp 1 lần
+    suppliers = suppliers.prefetch_related("products__category")
 
-    perms = get_permission_flags(request.user)
+    perms = get_permission_flags(request.user, request)
 
     context = {
         "suppliers": suppliers,
@@ -244,7 +227,7 @@ def add_supplier(request):
 @transaction.atomic
 def edit_supplier(request, pk):
     user = request.user
-    perms = get_permission_flags(user)
+    perms = get_permission_flags(user, request)
 
     if perms["is_supplier"] and pk != user.username:
         return redirect("suppliers")  # silent redirect
@@ -304,8 +287,14 @@ def edit_supplier(request, pk):
 # ===================== TỒN KHO =====================
 from .models import StockItem, Category
 from .forms import (CategoryForm, StockItemForm)
+from .pagination import (
+    PAGE_SIZE_CHOICES, parse_page_size, keyset_paginate, approximate_count,
+)
 from django.db import models
 
+# Khóa phân trang keyset của trang tồn kho (tên cột, giảm dần?)
+STOCK_LIST_KEYS = [("status_rank", False), ("sort_date", True), ("id", True)]
+
 @group_required('Cửa hàng trưởng', 'Nhân viên')
 @login_required(login_url='login')
 def stock_list(request):
@@ -329,47 +318,71 @@ def stock_list(request):
         "return_receipt"
     )
 
-    # Tìm kiếm theo nhiều trường
+    # Tìm kiếm theo nhiều trường (mã phiếu / SP qua chỉ mục không dấu).
+    # Trang dùng phân trang keyset theo hạn dùng nên giữ thứ tự đó, không xếp theo độ khớp.
     if query:
         stocks = stocks.filter(
-            models.Q(import_receipt__import_code__icontains=query) |
-            models.Q(return_receipt__return_code__icontains=query) |
-            models.Q(product__product_code__icontains=query) |
-            models.Q(product__name__icontains=query) |
+            models.Q(import_receipt__in=matching(ImportReceipt, query)) |
+            models.Q(return_receipt__in=matching(ReturnReceipt, query)) |
+            models.Q(product__in=matching(SupplierProduct, query)) |
             models.Q(location__icontains=query)
         )
 
-    # Lọc theo danh mục
+    # Lọc theo danh mục / vị trí: giá trị lấy từ ô chọn nên so khớp đúng
+    # (dùng được index, và "Kệ A1" không còn khớp nhầm "Kệ A10")
     if category_filter:
-        stocks = stocks.filter(product__category__name__icontains=category_filter)
+        stocks = stocks.filter(product__category__name=category_filter)
 
-    # Lọc theo vị trí
+    # Lọc theo vị trí (stock_location_idx đã xếp sẵn theo khóa trang trong 1 vị trí)
     if location_filter:
-        stocks = stocks.filter(location__icontains=location_filter)
+        stocks = stocks.filter(location=location_filter)
 
-    # Lọc theo trạng thái
+    # Lọc theo trạng thái: status_rank ứng 1-1 với status và là cột đầu của
+    # stock_list_keyset_idx -> lọc + xếp trang trên cùng index, không sắp xếp lại
     if status_filter:
-        stocks = stocks.filter(status=status_filter)
-
-    # Sắp xếp ưu tiên: Cận hạn → Còn hạn → Hết hạn
-    sort_order = models.Case(
-        models.When(status="nearly_expired", then=models.Value(0)),
-        models.When(status="valid", then=models.Value(1)),
-        models.When(status="expired", then=models.Value(2)),
-        default=models.Value(3),
-        output_field=models.IntegerField(),
+        if status_filter in StockItem.STATUS_RANKS:
+            stocks = stocks.filter(status_rank=StockItem.STATUS_RANKS[status_filter])
+        else:
+            stocks = stocks.none()
+
+    # Sắp xếp ưu tiên: Cận hạn → Còn hạn → Hết hạn, rồi ngày nhập mới nhất.
+    # Lô hoàn (không có phiếu nhập) xếp cuối nhóm như trước; id làm khóa phụ
+    # để thứ tự là duy nhất -> phân trang keyset không trùng / sót dòng.
+    # status_rank / sort_date là cột lưu sẵn trên StockItem (index
+    # stock_list_keyset_idx) -> trang sâu không phải tính + sắp xếp toàn bảng.
+
+    page_size = parse_page_size(request.GET.get("page_size"))
+    total_count, total_exact = approximate_count(stocks)
+
+    page = keyset_paginate(
+        stocks,
+        STOCK_LIST_KEYS,
+        page_size,
+        after=request.GET.get("after"),
+        before=request.GET.get("before"),
     )
-    stocks = stocks.order_by(sort_order, "-import_receipt__import_date")
 
-    # Cập nhật trạng thái hạn sử dụng nếu cần
-    for s in stocks:
-        s.save()
+    # Trạng thái hạn dùng được tính lại theo lô bằng lệnh refresh_stock_status
+    # (chạy hằng ngày) -> trang xem không ghi gì vào DB.
 
     # TÍNH TỔNG TỒN KHO (quantity toàn bộ StockItem)
     stock_total = StockItem.objects.aggregate(total=models.Sum("quantity"))["total"] or 0
 
+    # Giữ nguyên bộ lọc khi chuyển trang
+    params = request.GET.copy()
+    params.pop("after", None)
+    params.pop("before", None)
+    params["page_size"] = page_size
+    base_query = params.urlencode()
+
     return render(request, "stock_list.html", {
-        "stocks": stocks,
+        "stocks": page,
+        "page": page,
+        "page_size": page_size,
+        "page_size_choices": PAGE_SIZE_CHOICES,
+        "total_count": total_count,
+        "total_exact": total_exact,
+        "base_query": base_query,
         "categories": categories,
         "locations": locations,
         "query": query,
@@ -381,7 +394,6 @@ def stock_list(request):
 
 from .forms import (ImportReceiptForm, ImportItemFormSet)
 from .models import (ImportReceipt, ImportItem)
-from django.db.models.functions import Lower
 # ===================== NHẬP KHO =====================
 @group_required('Cửa hàng trưởng', 'Nhân viên')
 @login_required(login_url='login')
@@ -393,26 +405,18 @@ def import_list(request):
     date_to = request.GET.get("date_to", "")
 
 
-    imports = ImportReceipt.objects.select_related("supplier") \
+    imports = ImportReceipt.objects.select_related("supplier", "created_by", "asn") \
         .prefetch_related("items__product")
 
 
     if q:
-        search = q.lower()
-
-        imports = imports.annotate(
-            import_code_l=Lower("import_code"),
-            note_l=Lower("note"),
-            creator_l=Lower("created_by__username"),
-            supplier_l=Lower("supplier__company_name"),
-        ).filter(
-            Q(import_code_l__contains=search) |
-            Q(note_l__contains=search) |
-            Q(creator_l__contains=search) |
-            Q(supplier_l__contains=search) |
-            Q(items__product__product_code__icontains=q) |
-            Q(items__product__name__icontains=q)
-        ).distinct()
+        imports = apply_search(imports, q, also=[
+            Q(created_by__username__icontains=q),
+            Q(supplier__in=matching(Supplier, q)),
+            Exists(ImportItem.objects.filter(
+                import_receipt=OuterRef("pk"), product__in=matching(SupplierProduct, q)
+            )),
+        ])
 
     # LỌC THEO NHÀ CUNG CẤP
     if supplier_filter:
@@ -426,10 +430,10 @@ def import_list(request):
         imports = imports.filter(import_date__lte=date_to)
 
 
-    imports = imports.order_by("-import_code")
+    imports = ordered_by_rank(imports, "-import_code")
 
     suppliers = Supplier.objects.all()
-    perms = get_permission_flags(request.user)
+    perms = get_permission_flags(request.user, request)
 
     return render(request, "import_list.html", {
         "imports": imports,
@@ -487,13 +491,15 @@ def create_import(request):
                 receipt.created_by = request.user
                 receipt.save()
 
-                # gán instance cho formset rồi save
+                # gán instance cho formset rồi lưu gộp cả phiếu
+                # (ImportItem.bulk_receive: bulk_create dòng nhập + lô, không save() từng dòng)
                 formset.instance = receipt
-                items = formset.save()
+                items = ImportItem.bulk_receive(receipt, formset.save(commit=False))
 
                 if not items:
                     raise ValueError("Chưa có dòng sản phẩm nào hợp lệ.")
 
+                count_receipt("import", len(items))
                 messages.success(
                     request,
                     f" Đã tạo phiếu nhập {receipt.import_code} thành công."
@@ -543,14 +549,14 @@ def create_import(request):
     # Chỉ lấy ASN chưa được nhập kho
     available_asn = ASN.objects.filter(
         importreceipt__asn__isnull=True
-    )
+    ).select_related("supplier")
     initial = {}
     if asn:
         initial["asn"] = asn
         initial["supplier"] = asn.supplier
 
     # Hiển thị mã PN mới luôn trên form
-    initial.setdefault("import_code", ImportReceipt.generate_new_code())
+    initial.setdefault("import_code", ImportReceipt.preview_new_code())
 
     form = ImportReceiptForm(initial=initial)
 
@@ -605,26 +611,30 @@ def create_import(request):
 @group_required('Cửa hàng trưởng', 'Nhân viên')
 @login_required(login_url='login')
 def import_export_pdf(request, code):
-    receipt = get_object_or_404(ImportReceipt, import_code=code)
+    receipt = get_object_or_404(
+        ImportReceipt.objects.select_related("supplier", "created_by").prefetch_related("items__product"),
+        import_code=code,
+    )
     html = render_to_string('import_pdf.html', {'receipt': receipt})
 
     config = pdfkit.configuration(
         wkhtmltopdf=r"C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe"
     )
 
-    pdf = pdfkit.from_string(
-        html,
-        False,
-        configuration=config,
-        options={
-            'encoding': 'utf-8',
-            'page-size': 'A4',
-            'margin-top': '10mm',
-            'margin-bottom': '15mm',
-            'margin-left': '10mm',
-            'margin-right': '10mm',
-        },
-    )
+    with external_call("pdfkit"):
+        pdf = pdfkit.from_string(
+            html,
+            False,
+            configuration=config,
+            options={
+                'encoding': 'utf-8',
+                'page-size': 'A4',
+                'margin-top': '10mm',
+                'margin-bottom': '15mm',
+                'margin-left': '10mm',
+                'margin-right': '10mm',
+            },
+        )
 
     response = HttpResponse(pdf, content_type='application/pdf')
     response['Content-Disposition'] = f'inline; filename=\"PhieuNhap_{receipt.import_code}.pdf\"'
@@ -633,6 +643,8 @@ def import_export_pdf(request, code):
 # ===================== XUẤT KHO =====================
 from .models import (ExportReceipt, ExportItem)
 from .forms import (ExportReceiptForm, ExportItemFormSet)
+from .allocation import FefoAllocation
+from django.core.exceptions import ValidationError
 @group_required('Cửa hàng trưởng', 'Nhân viên')
 @login_required(login_url='login')
 def export_list(request):
@@ -642,19 +654,19 @@ def export_list(request):
     date_to = request.GET.get("date_to", "")
     count_filter = request.GET.get("count", "")
 
-    exports = ExportReceipt.objects.prefetch_related(
-        "items__stock_item__product"
+    exports = ExportReceipt.objects.select_related("created_by").prefetch_related(
+        "items__stock_item__product",
+        "items__stock_item__import_receipt",
     )
 
     # search
     if q:
-        exports = exports.filter(
-            Q(export_code__icontains=q) |
-            Q(note__icontains=q) |
-            Q(destination__icontains=q) |
-            Q(created_by__username__icontains=q) |
-            Q(items__stock_item__product__name__icontains=q)
-        ).distinct()
+        exports = apply_search(exports, q, also=[
+            Q(created_by__username__icontains=q),
+            Exists(ExportItem.objects.filter(
+                receipt=OuterRef("pk"), stock_item__product__in=matching(SupplierProduct, q)
+            )),
+        ])
 
     # --- Lọc theo nơi nhận ---
     if destination:
@@ -666,7 +678,7 @@ def export_list(request):
     if date_to:
         exports = exports.filter(export_date__lte=date_to)
 
-    exports = exports.order_by("-export_code")
+    exports = ordered_by_rank(exports, "-export_code")
 
     # Danh sách nơi nhận gợi ý
     destinations = (
@@ -691,7 +703,10 @@ def export_list(request):
 @transaction.atomic
 def create_export(request):
     # ================== XUẤT THEO FEFO ==================
-    stock_queryset = StockItem.objects.filter(quantity__gt=0).order_by("expiry_date")
+    # lô chọn qua api_stock_lots (tìm + phân trang), không render sẵn mọi lô
+    # sản phẩm còn hàng – cho ô "Phân bổ tự động (FEFO)"
+    fefo_products = SupplierProduct.objects.filter(stockitem__quantity__gt=0) \
+                                           .distinct().order_by("name")
 
     if request.method == "POST":
         form = ExportReceiptForm(request.POST)
@@ -721,44 +736,56 @@ def create_export(request):
                     return render(request, "export_create.html", {
                         "form": form,
                         "formset": formset,
-                        "stock_queryset": stock_queryset,
+                        "fefo_products": fefo_products,
                     })
 
-            # ===== LƯU PHIẾU XUẤT =====
-            export = form.save(commit=False)
-            export.created_by = request.user
-            export.save()
-
-            saved_count = 0
-
-            # ===== LƯU TỪNG ITEM =====
+            # ===== DÒNG HỢP LỆ (bỏ dòng xoá / dòng trống) =====
+            items = []
             for f in formset.forms:
                 if f.cleaned_data.get("DELETE"):
                     continue
-
                 stock_item = f.cleaned_data.get("stock_item")
                 qty = f.cleaned_data.get("quantity") or 0
-
-                # Bỏ dòng trống
                 if not stock_item or qty <= 0:
                     continue
+                items.append(f.save(commit=False))
 
-                item = f.save(commit=False)
-                item.receipt = export
-                item.save()     # <- ExportItem.save() sẽ tự trừ tồn
-
-                saved_count += 1
-
-            # Nếu không có dòng nào hợp lệ -> xoá phiếu export vừa tạo
-            if saved_count == 0:
-                export.delete()
+            if not items:
                 messages.error(request, "Không có dòng hàng hợp lệ. Hãy chọn ít nhất 1 lô.")
                 return render(request, "export_create.html", {
                     "form": form,
                     "formset": formset,
-                    "stock_queryset": stock_queryset,
+                    "fefo_products": fefo_products,
+                })
+
+            # ===== LƯU PHIẾU + DÒNG QUA FefoAllocation.commit =====
+            # trừ tồn gộp mọi lô (1 câu UPDATE có điều kiện), bulk_create dòng
+            # xuất + sổ kho, tính tổng phiếu và số liệu theo ngày 1 lần
+            try:
+                with transaction.atomic():
+                    export = form.save(commit=False)
+                    export.created_by = request.user
+                    export.save()
+                    FefoAllocation(items, {}).commit(export)
+            except ValidationError:
+                # Lô vừa bị người khác xuất hết giữa lúc kiểm tra và lúc lưu,
+                # hoặc nhiều dòng cùng lô vượt tồn -> huỷ toàn bộ phiếu
+                needed = FefoAllocation(items, {}).lot_amounts()
+                on_hand = dict(StockItem.objects.filter(pk__in=needed).values_list("pk", "quantity"))
+                short = next((item.stock_item for item in items
+                              if on_hand.get(item.stock_item_id, 0) < needed[item.stock_item_id]),
+                             items[0].stock_item)
+                messages.error(
+                    request,
+                    f"Lô {short} không còn đủ tồn kho (vừa có phiếu xuất khác). Vui lòng kiểm tra lại."
+                )
+                return render(request, "export_create.html", {
+                    "form": form,
+                    "formset": formset,
+                    "fefo_products": fefo_products,
                 })
 
+            count_receipt("export", len(items))
             messages.success(request, f"Tạo phiếu xuất {export.export_code} thành công!")
             return redirect("export_list")
 
@@ -767,45 +794,51 @@ def create_export(request):
         return render(request, "export_create.html", {
             "form": form,
             "formset": formset,
-            "stock_queryset": stock_queryset,
+            "fefo_products": fefo_products,
         })
 
     # ================== GET REQUEST ==================
     # -> tạo form mới + code mới
-    new_code = ExportReceipt.generate_new_code()
+    new_code = ExportReceipt.preview_new_code()
     form = ExportReceiptForm(initial={"export_code": new_code})
     formset = ExportItemFormSet(prefix="items")
 
     return render(request, "export_create.html", {
         "form": form,
         "formset": formset,
-        "stock_queryset": stock_queryset,
+        "fefo_products": fefo_products,
     })
 
 
 @group_required('Cửa hàng trưởng', 'Nhân viên')
 @login_required(login_url='login')
 def export_export_pdf(request, code):
-    receipt = get_object_or_404(ExportReceipt, export_code=code)
+    receipt = get_object_or_404(
+        ExportReceipt.objects.select_related("created_by").prefetch_related(
+            "items__stock_item__product", "items__stock_item__import_receipt"
+        ),
+        export_code=code,
+    )
     html = render_to_string('export_pdf.html', {'receipt': receipt})
 
     config = pdfkit.configuration(
         wkhtmltopdf=r"C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe"
     )
 
-    pdf = pdfkit.from_string(
-        html,
-        False,
-        configuration=config,
-        options={
-            'encoding': 'utf-8',
-            'page-size': 'A4',
-            'margin-top': '10mm',
-            'margin-bottom': '15mm',
-            'margin-left': '10mm',
-            'margin-right': '10mm',
-        },
-    )
+    with external_call("pdfkit"):
+        pdf = pdfkit.from_string(
+            html,
+            False,
+            configuration=config,
+            options={
+                'encoding': 'utf-8',
+                'page-size': 'A4',
+                'margin-top': '10mm',
+                'margin-bottom': '15mm',
+                'margin-left': '10mm',
+                'margin-right': '10mm',
+            },
+        )
 
     response = HttpResponse(pdf, content_type='application/pdf')
     response['Content-Disposition'] = f'inline; filename=\"PhieuXuat_{receipt.export_code}.pdf\"'
@@ -824,20 +857,20 @@ def return_list(request):
     date_to = request.GET.get("date_to", "")
     count_filter = request.GET.get("count", "")
 
-    returns = ReturnReceipt.objects.prefetch_related(
-        "items__product",
-        "created_by"
+    returns = ReturnReceipt.objects.select_related(
+        "created_by", "export_receipt"
+    ).prefetch_related(
+        "items__product"
     )
 
     # --- Search ---
     if q:
-        returns = returns.filter(
-            Q(return_code__icontains=q) |
-            Q(note__icontains=q) |
-            Q(items__reason__icontains=q) |
-            Q(items__product__name__icontains=q) |
-            Q(created_by__username__icontains=q)
-        ).distinct()
+        returns = apply_search(returns, q, also=[
+            Q(created_by__username__icontains=q),
+            Exists(ReturnItem.objects.filter(receipt=OuterRef("pk")).filter(
+                Q(reason__icontains=q) | Q(product__in=matching(SupplierProduct, q))
+            )),
+        ])
 
     # --- Lọc theo ngày ---
     if date_from:
@@ -845,7 +878,7 @@ def return_list(request):
     if date_to:
         returns = returns.filter(return_date__lte=date_to)
 
-    returns = returns.order_by("-return_code")
+    returns = ordered_by_rank(returns, "-return_code")
 
     return render(request, "return_list.html", {
         "returns": returns,
@@ -887,7 +920,7 @@ def create_return(request):
 
                 receipt.save()
 
-                saved = 0
+                items = []
 
                 for f in formset:
                     if not f.cleaned_data or f.cleaned_data.get("DELETE", False):
@@ -898,38 +931,28 @@ def create_return(request):
                     if not item.export_item_id:
                         continue
 
-                    if item.export_item:
-                        try:
-                            export_item = item.export_item
-                            if not export_item.stock_item:
-                                continue
-
-                            item.product = export_item.stock_item.product
-                            item.unit_price = export_item.unit_price or Decimal('0')
-                            item.unit = export_item.unit or ""
-                            item.expiry_date = export_item.stock_item.expiry_date
-                            item.location = export_item.stock_item.location or ""
-
-                            if not item.quantity or item.quantity <= 0:
-                                continue
-
-                            if not item.reason:
-                                item.reason = "Hoàn hàng"
-                        except Exception:
-                            import traceback
-                            print("Error processing export_item:")
-                            print(traceback.format_exc())
-                            continue
-
-                    item.receipt = receipt
-                    item.save()
-                    saved += 1
+                    # export_item đã nạp sẵn kèm lô + sản phẩm (formset) -> không truy vấn thêm
+                    export_item = item.export_item
+                    if not export_item.stock_item:
+                        continue
+
+                    if not item.quantity or item.quantity <= 0:
+                        continue
+
+                    if not item.reason:
+                        item.reason = "Hoàn hàng"
+
+                    items.append(item)
+
+                # lưu gộp: 1 câu tính SL đã hoàn, bulk_create lô hoàn + dòng hoàn + sổ kho
+                saved = len(ReturnItem.bulk_return(receipt, items))
 
                 if saved == 0:
                     receipt.delete()
                     messages.warning(request, "Chưa có sản phẩm hợp lệ.")
                     return redirect("return_list")
 
+                count_receipt("return", saved)
                 messages.success(request, f"Đã tạo phiếu hoàn {receipt.return_code}.")
                 return redirect("return_list")
 
@@ -956,7 +979,7 @@ def create_return(request):
         return render(request, "return_create.html", {"form": form, "formset": formset})
 
     # GET
-    form = ReturnReceiptForm(initial={"return_code": ReturnReceipt.generate_new_code()})
+    form = ReturnReceiptForm(initial={"return_code": ReturnReceipt.preview_new_code()})
     formset = ReturnItemFormSet(
         prefix="items",
         queryset=ReturnItem.objects.none(),
@@ -969,26 +992,30 @@ def create_return(request):
 @login_required(login_url='login')
 def return_export_pdf(request, code):
 
-    receipt = get_object_or_404(ReturnReceipt, return_code=code)
+    receipt = get_object_or_404(
+        ReturnReceipt.objects.select_related("created_by").prefetch_related("items__product"),
+        return_code=code,
+    )
     html = render_to_string('return_pdf.html', {'receipt': receipt})
 
     config = pdfkit.configuration(
         wkhtmltopdf=r"C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe"
     )
 
-    pdf = pdfkit.from_string(
-        html,
-        False,
-        configuration=config,
-        options={
-            'encoding': 'utf-8',
-            'page-size': 'A4',
-            'margin-top': '10mm',
-            'margin-bottom': '15mm',
-            'margin-left': '10mm',
-            'margin-right': '10mm',
-        },
-    )
+    with external_call("pdfkit"):
+        pdf = pdfkit.from_string(
+            html,
+            False,
+            configuration=config,
+            options={
+                'encoding': 'utf-8',
+                'page-size': 'A4',
+                'margin-top': '10mm',
+                'margin-bottom': '15mm',
+                'margin-left': '10mm',
+                'margin-right': '10mm',
+            },
+        )
 
     response = HttpResponse(pdf, content_type='application/pdf')
     response['Content-Disposition'] = f'inline; filename=\"PhieuHoan_{receipt.return_code}.pdf\"'
@@ -1016,22 +1043,25 @@ def po_list(request):
         "supplier", "created_by"
     ).prefetch_related(
         "items__product"
+    ).annotate(
+        # số dòng SP + tiến độ PO (đã lên ASN / đã nhập kho) trong cùng câu SELECT
+        **PurchaseOrder.list_annotations()
     )
     user = request.user
-    perms = get_permission_flags(user)
+    perms = get_permission_flags(user, request)
 
     if perms["is_supplier"]:
         pos = pos.filter(supplier__supplier_code=user.username)
 
     # --- SEARCH ---
     if q:
-        pos = pos.filter(
-            Q(po_code__icontains=q) |
-            Q(note__icontains=q) |
-            Q(supplier__company_name__icontains=q) |
-            Q(created_by__username__icontains=q) |
-            Q(items__product__name__icontains=q)
-        ).distinct()
+        pos = apply_search(pos, q, also=[
+            Q(created_by__username__icontains=q),
+            Q(supplier__in=matching(Supplier, q)),
+            Exists(PurchaseOrderItem.objects.filter(
+                po=OuterRef("pk"), product__in=matching(SupplierProduct, q)
+            )),
+        ])
 
     # --- FILTER BY SUPPLIER ---
     if supplier_id:
@@ -1049,12 +1079,12 @@ def po_list(request):
 
 
     # Sắp xếp theo mã PO, cái tạo sau (PO lớn hơn) đứng trên cùng
-    pos = pos.order_by("-po_code")
+    pos = ordered_by_rank(pos, "-po_code")
 
     suppliers = Supplier.objects.all()
 
     # LẤY QUYỀN NGƯỜI DÙNG
-    perms = get_permission_flags(request.user)
+    perms = get_permission_flags(request.user, request)
 
     return render(request, "po_list.html", {
         "pos": pos,
@@ -1074,11 +1104,11 @@ def po_list(request):
 def create_po(request):
 
     # Xác định xem người tạo có phải Nhân viên hay không
-    is_staff = request.user.groups.filter(name='Nhân viên').exists()
+    is_staff = user_in_groups(request.user, ['Nhân viên'], request)
 
     if request.method == "GET":
         # Tạo mã mới để hiển thị trên form
-        new_code = PurchaseOrder.generate_new_code()
+        new_code = PurchaseOrder.preview_new_code()
         form = PurchaseOrderForm(initial={
             "po_code": new_code,
             # Nhân viên -> mặc định trạng thái pending
@@ -1112,7 +1142,8 @@ def create_po(request):
 
         po.save()
         formset.instance = po
-        formset.save()
+        items = formset.save()
+        count_receipt("purchase_order", len(items))
 
         messages.success(request, f"Đã tạo đơn đặt hàng {po.po_code} thành công!")
         return redirect("po_list")
@@ -1127,7 +1158,7 @@ def create_po(request):
 @transaction.atomic
 def po_edit(request, code):
     user = request.user
-    perms = get_permission_flags(user)
+    perms = get_permission_flags(user, request)
 
     if perms["is_supplier"]:
         po_obj = get_object_or_404(PurchaseOrder, pk=code)
@@ -1150,10 +1181,13 @@ def po_edit(request, code):
 @login_required(login_url='login')
 def po_export_pdf(request, code):
     user = request.user
-    perms = get_permission_flags(user)
+    perms = get_permission_flags(user, request)
 
     # lấy PO trước
-    po = get_object_or_404(PurchaseOrder, po_code=code)
+    po = get_object_or_404(
+        PurchaseOrder.objects.select_related("supplier", "created_by").prefetch_related("items__product"),
+        po_code=code,
+    )
 
     if perms["is_supplier"] and po.supplier.supplier_code != user.username:
         return redirect("po_list")
@@ -1164,12 +1198,13 @@ def po_export_pdf(request, code):
         wkhtmltopdf=r"C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe"
     )
 
-    pdf = pdfkit.from_string(
-        html,
-        False,
-        configuration=config,
-        options={"encoding": "utf-8"}
-    )
+    with external_call("pdfkit"):
+        pdf = pdfkit.from_string(
+            html,
+            False,
+            configuration=config,
+            options={"encoding": "utf-8"}
+        )
 
     response = HttpResponse(pdf, content_type="application/pdf")
     response["Content-Disposition"] = f'inline; filename="PO_{po.po_code}.pdf"'
@@ -1185,14 +1220,18 @@ from .forms import ASNForm, ASNItemFormSet
 @login_required(login_url='login')
 def asn_list(request):
     user = request.user
-    perms = get_permission_flags(user)
+    perms = get_permission_flags(user, request)
 
     # supplier_id an toàn (không lỗi user.supplier)
     supplier_id_user = getattr(user, "supplier_id", None)
     supplier_code_user = getattr(user, "username", None)
 
     # load base queryset
-    asns = ASN.objects.all().select_related("supplier", "po")
+    # số dòng / tổng SL / tổng tiền tính bằng subquery trong cùng câu SELECT,
+    # dòng hàng cho popup "Xem" nạp 1 lần (prefetch)
+    asns = ASN.objects.all().select_related("supplier", "po") \
+                            .prefetch_related("items__product") \
+                            .annotate(**ASN.list_annotations())
 
     # NCC chỉ xem phiếu của chính họ
     if perms["is_supplier"]:
@@ -1208,13 +1247,12 @@ def asn_list(request):
 
     # SEARCH
     if q:
-        asns = asns.filter(
-            Q(asn_code__icontains=q) |
-            Q(po__po_code__icontains=q) |
-            Q(supplier__company_name__icontains=q) |
-            Q(items__product__name__icontains=q) |
-            Q(deliverer_name__icontains=q)
-        ).distinct()
+        asns = apply_search(asns, q, also=[
+            Q(supplier__in=matching(Supplier, q)),
+            Exists(ASNItem.objects.filter(
+                asn=OuterRef("pk"), product__in=matching(SupplierProduct, q)
+            )),
+        ])
 
     # FILTER SUPPLIER (chỉ cho nhân viên / cửa hàng trưởng)
     if not perms["is_supplier"] and supplier_id:
@@ -1232,7 +1270,7 @@ def asn_list(request):
 
 
     # Sắp xếp theo mã ASN: cái nào tạo sau (mã lớn hơn) ở trên
-    asns = asns.order_by("-asn_code")
+    asns = ordered_by_rank(asns, "-asn_code")
 
     suppliers = Supplier.objects.all()
 
@@ -1263,7 +1301,7 @@ def create_asn(request):
         return redirect("asn_list")
 
     # PO của NCC này
-    allowed_po = PurchaseOrder.objects.filter(supplier=supplier)
+    allowed_po = PurchaseOrder.objects.filter(supplier=supplier).select_related("supplier")
 
     po = None
 
@@ -1315,6 +1353,7 @@ def create_asn(request):
                 for obj in formset.deleted_objects:
                     obj.delete()
 
+                count_receipt("asn", sum(1 for item in items if item.product_id))
                 messages.success(request, f"Tạo ASN {asn.asn_code} thành công.")
                 return redirect("asn_list")
 
@@ -1330,7 +1369,7 @@ def create_asn(request):
         )
 
     else:
-        form = ASNForm(initial={"asn_code": ASN.generate_new_code()})
+        form = ASNForm(initial={"asn_code": ASN.preview_new_code()})
         formset = ASNItemFormSet(
             instance=ASN(),
             form_kwargs={"po": None}
@@ -1348,9 +1387,12 @@ def create_asn(request):
 @login_required(login_url='login')
 def asn_export_pdf(request, code):
     user = request.user
-    perms = get_permission_flags(user)
+    perms = get_permission_flags(user, request)
 
-    asn = get_object_or_404(ASN, asn_code=code)
+    asn = get_object_or_404(
+        ASN.objects.select_related("supplier", "po", "created_by").prefetch_related("items__product"),
+        asn_code=code,
+    )
 
     # Nhà cung ứng chỉ xem được phiếu của chính mình
     if perms["is_supplier"] and asn.supplier.supplier_code != user.username:
@@ -1362,7 +1404,8 @@ def asn_export_pdf(request, code):
         wkhtmltopdf=r"C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe"
     )
 
-    pdf = pdfkit.from_string(html, False, configuration=config)
+    with external_call("pdfkit"):
+        pdf = pdfkit.from_string(html, False, configuration=config)
     response = HttpResponse(pdf, content_type="application/pdf")
 
     response['Content-Disposition'] = f'inline; filename="ASN_{asn.asn_code}.pdf"'
@@ -1376,7 +1419,7 @@ from .decorators import group_required
 @login_required(login_url="login")
 def edit_asn(request, code):
     user = request.user
-    perms = get_permission_flags(user)
+    perms = get_permission_flags(user, request)
 
     # Lấy ASN
     asn = get_object_or_404(ASN, asn_code=code)
@@ -1410,6 +1453,7 @@ def edit_asn(request, code):
 
 # ===================== BÁO CÁO =====================
 import json
+from .models import DailySummary
 @group_required('Cửa hàng trưởng', 'Nhân viên')
 @login_required(login_url='login')
 def reports(request):
@@ -1437,6 +1481,7 @@ def reports(request):
         end_date = today
 
     # 3. Tổng số phiếu nhập / xuất / hoàn trong khoảng ngày
+    #    (COUNT chỉ đọc index theo ngày của từng bảng phiếu)
     imports_qs = ImportReceipt.objects.filter(
         import_date__range=[start_date, end_date]
     )
@@ -1457,57 +1502,42 @@ def reports(request):
     nearly = StockItem.objects.filter(status="nearly_expired").count()
 
     # 2. Doanh thu = tổng tiền phiếu xuất - tổng tiền phiếu hoàn
-    total_export_value = ExportItem.objects.filter(
-        receipt__export_date__range=[start_date, end_date]
-    ).aggregate(total=Sum("total"))["total"] or 0
+    #    (đọc từ bảng số liệu theo ngày: mỗi ngày x sản phẩm 1 dòng)
+    summary = DailySummary.objects.filter(day__range=[start_date, end_date])
+    totals = DailySummary.totals(start_date, end_date)
 
-    total_return_value = ReturnItem.objects.filter(
-        receipt__return_date__range=[start_date, end_date]
-    ).aggregate(total=Sum("total"))["total"] or 0
+    total_export_value = totals["export_value"]
+    total_return_value = totals["return_value"]
 
     total_revenue = total_export_value - total_return_value
 
     # 4. Top 3 sản phẩm bán chạy (theo số lượng xuất)
     top_products_qs = (
-        ExportItem.objects.filter(
-            receipt__export_date__range=[start_date, end_date]
-        )
-        .values(
-            "stock_item__product__product_code",
-            "stock_item__product__name"
-        )
-        .annotate(total_qty=Sum("quantity"))
+        summary.filter(export_quantity__gt=0)
+        .values("product__product_code", "product__name")
+        .annotate(total_qty=Sum("export_quantity"))
         .order_by("-total_qty")[:3]
     )
 
     top_products = [
         {
-            "code": p["stock_item__product__product_code"],
-            "name": p["stock_item__product__name"],
+            "code": p["product__product_code"],
+            "name": p["product__name"],
             "total_qty": p["total_qty"],
         }
         for p in top_products_qs
     ]
 
     #  5. Biểu đồ: Doanh thu theo ngày = xuất - hoàn
-    exports_by_date = (
-        ExportItem.objects.filter(
-            receipt__export_date__range=[start_date, end_date]
-        )
-        .values("receipt__export_date")
-        .annotate(total=Sum("total"))
+    by_date = (
+        summary.filter(Q(export_quantity__gt=0) | Q(return_quantity__gt=0))
+        .values("day")
+        .annotate(export_total=Sum("export_value"), return_total=Sum("return_value"))
+        .order_by("day")
     )
 
-    returns_by_date = (
-        ReturnItem.objects.filter(
-            receipt__return_date__range=[start_date, end_date]
-        )
-        .values("receipt__return_date")
-        .annotate(total=Sum("total"))
-    )
-
-    export_dict = {r["receipt__export_date"]: r["total"] for r in exports_by_date}
-    return_dict = {r["receipt__return_date"]: r["total"] for r in returns_by_date}
+    export_dict = {r["day"]: r["export_total"] for r in by_date}
+    return_dict = {r["day"]: r["return_total"] for r in by_date}
 
     # Lấy tất cả các ngày có dữ liệu (xuất hoặc hoàn)
     all_dates = sorted(set(list(export_dict.keys()) + list(return_dict.keys())))
@@ -1543,6 +1573,45 @@ def reports(request):
     return render(request, "reports.html", context)
 
 
+# ===================== CÂU SQL CHẬM =====================
+from django.core.exceptions import PermissionDenied
+from .slow_queries import slow_query_summary, clear_slow_queries
+@login_required(login_url='login')
+def slow_queries(request):
+    # Chỉ superuser: câu SQL / kế hoạch truy vấn lộ cấu trúc dữ liệu
+    if not request.user.is_superuser:
+        raise PermissionDenied
+
+    if request.method == "POST":
+        clear_slow_queries()
+        messages.success(request, "Đã xoá nhật ký câu SQL chậm.")
+        return redirect("slow_queries")
+
+    return render(request, "slow_queries.html", {
+        "groups": slow_query_summary(),
+        "threshold_ms": getattr(settings, "SLOW_QUERY_MS", 200),
+        "capacity": getattr(settings, "SLOW_QUERY_LOG_SIZE", 500),
+    })
+
+
+# ===================== SỐ LIỆU PROMETHEUS =====================
+from .metrics import render_metrics
+def metrics(request):
+    # Prometheus: token METRICS_TOKEN (hoặc IP khai báo trong METRICS_ALLOWED_IPS);
+    # người dùng thì phải là superuser. Không cấu hình gì -> chỉ superuser.
+    token = getattr(settings, "METRICS_TOKEN", "")
+    sent = request.META.get("HTTP_AUTHORIZATION", "").removeprefix("Bearer ").strip()
+    allowed = (
+        request.user.is_superuser
+        or (token and hmac.compare_digest(sent.encode(), token.encode()))
+        or request.META.get("REMOTE_ADDR") in getattr(settings, "METRICS_ALLOWED_IPS", [])
+    )
+    if not allowed:
+        raise PermissionDenied
+
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 # ===================== API ENDPOINTS =====================
 @login_required
 def api_supplier_products(request, supplier_id):
@@ -1570,31 +1639,25 @@ def api_supplier_products(request, supplier_id):
 @login_required
 def api_po_details(request, po_id):
     # API: Lấy thông tin PO và sản phẩm (cho ASN)
-    from django.db.models import Sum
-
-
+    # SL đặt / đã giao / đã nhập của mọi sản phẩm lấy 1 câu (PurchaseOrderItem.fulfillment)
     try:
-        po = PurchaseOrder.objects.get(pk=po_id)
+        po = PurchaseOrder.objects.select_related('supplier').get(pk=po_id)
         products = {}
+        fulfillment = PurchaseOrderItem.fulfillment(po)
 
         # Lấy tất cả sản phẩm trong PO
         for po_item in PurchaseOrderItem.objects.filter(po=po).select_related('product'):
-            # Tính số lượng đã giao
-            delivered_qty = ASNItem.objects.filter(
-                asn__po=po,
-                product=po_item.product
-            ).aggregate(total=Sum('quantity'))['total'] or 0
-
-            # Số lượng còn lại = số lượng đặt - số lượng đã giao
-            max_quantity = po_item.quantity - delivered_qty
+            line = fulfillment[po_item.product_id]
 
             products[str(po_item.product.pk)] = {
                 'code': po_item.product.product_code,
                 'name': po_item.product.name,
                 'unit_price': float(po_item.unit_price),
                 'unit': po_item.unit,
-                'max_quantity': max_quantity,  # Số lượng còn lại trong PO
+                'max_quantity': line['remaining'],  # Số lượng còn lại trong PO
                 'ordered_quantity': po_item.quantity,  # Tổng số lượng đặt
+                'shipped_quantity': line['shipped'],  # Đã lên ASN
+                'received_quantity': line['received'],  # Đã nhập kho
             }
 
         return JsonResponse({
@@ -1608,21 +1671,21 @@ def api_po_details(request, po_id):
 @login_required
 def api_export_items(request, export_code):
     # API: Lấy danh sách sản phẩm của phiếu xuất (cho phiếu hoàn)
-    from django.db.models import Sum
     from .models import ExportItem, ReturnItem
 
     try:
         export_receipt = ExportReceipt.objects.get(pk=export_code)
         items = {}
 
-        for export_item in ExportItem.objects.filter(receipt=export_receipt).select_related('stock_item__product'):
-            # Tính số lượng đã hoàn
-            returned_qty = ReturnItem.objects.filter(
-                export_item=export_item
-            ).aggregate(total=Sum('quantity'))['total'] or 0
+        export_items = list(
+            ExportItem.objects.filter(receipt=export_receipt).select_related('stock_item__product')
+        )
+        # SL đã hoàn của mọi dòng: 1 câu GROUP BY
+        returned = ReturnItem.returned_quantities(ei.pk for ei in export_items)
 
+        for export_item in export_items:
             # Số lượng còn lại = số lượng xuất - số lượng đã hoàn
-            max_quantity = export_item.quantity - returned_qty
+            max_quantity = export_item.quantity - returned.get(export_item.pk, 0)
 
             items[str(export_item.pk)] = {
                 'product_code': export_item.stock_item.product.product_code,
@@ -1642,6 +1705,99 @@ def api_export_items(request, export_code):
         return JsonResponse({'error': 'Phiếu xuất không tồn tại'}, status=404)
 
 
+@login_required
+def api_stock_lots(request):
+    # API: tìm lô còn hàng cho ô chọn lô phiếu xuất (thứ tự FEFO)
+    # ?q=<đầu mã / tên SP>&after=<cursor>&page_size=<n>
+    from .pagination import keyset_paginate, parse_page_size
+
+    keys = [("fefo_date", False), ("id", False)]
+    page = keyset_paginate(
+        StockItem.picker_queryset(request.GET.get('q', '')),
+        keys,
+        parse_page_size(request.GET.get('page_size'), choices=(10, 25, 50), default=25),
+        after=request.GET.get('after'),
+    )
+
+    return JsonResponse({
+        'results': [
+            {
+                'id': lot.pk,
+                'product_code': lot.product.product_code,
+                'product_name': lot.product.name,
+                'quantity': lot.quantity,
+                'unit': lot.unit,
+                'unit_price': float(lot.unit_price),
+                'expiry_date': lot.expiry_date.strftime('%Y-%m-%d') if lot.expiry_date else None,
+                'status': lot.status,
+                'status_display': lot.get_status_display(),
+            }
+            for lot in page
+        ],
+        'next_cursor': page.next_cursor,
+    })
+
+
+@group_required('Cửa hàng trưởng', 'Nhân viên')
+@login_required
+def api_search(request):
+    # API: tìm chung mọi chứng từ / NCC / SP / lô (chỉ mục QuanLy/search_index.py)
+    # ?q=<từ khoá>&type=import&type=lot...&limit=<n>
+    from .search_index import DEFAULT_LIMIT, DOC_TYPES, MAX_LIMIT, global_search
+
+    types = [t for t in request.GET.getlist('type') if t]
+    unknown = [t for t in types if t not in DOC_TYPES]
+    if unknown:
+        return JsonResponse({'error': f"Loại không hợp lệ: {', '.join(unknown)}"}, status=400)
+
+    try:
+        limit = min(max(int(request.GET.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+    except ValueError:
+        return JsonResponse({'error': 'limit không hợp lệ'}, status=400)
+
+    q = request.GET.get('q', '').strip()
+    return JsonResponse({
+        'query': q,
+        'results': global_search(q, types or None, limit),
+    })
+
+
+@login_required
+def api_fefo_allocation(request):
+    # API: đề xuất lô xuất theo FEFO cho phiếu xuất
+    # ?product=<id>&quantity=<sl>&product=<id>&quantity=<sl>...
+    from .allocation import allocate_fefo
+
+    products = request.GET.getlist('product')
+    quantities = request.GET.getlist('quantity')
+    if len(products) != len(quantities):
+        return JsonResponse({'error': 'Thiếu số lượng cho sản phẩm'}, status=400)
+
+    try:
+        demands = [(int(p), int(q)) for p, q in zip(products, quantities)]
+    except ValueError:
+        return JsonResponse({'error': 'Dữ liệu không hợp lệ'}, status=400)
+
+    allocation = allocate_fefo(demands)
+
+    return JsonResponse({
+        'items': [
+            {
+                'stock_item': item.stock_item_id,
+                'product_id': item.stock_item.product_id,
+                'quantity': item.quantity,
+                'unit': item.unit,
+                'unit_price': float(item.unit_price),
+                'available': item.stock_item.quantity,
+                'expiry_date': item.stock_item.expiry_date.strftime('%Y-%m-%d')
+                if item.stock_item.expiry_date else None,
+            }
+            for item in allocation.items
+        ],
+        'shortages': {str(pk): qty for pk, qty in allocation.shortages.items()},
+    })
+
+
 from django.http import JsonResponse
 def api_asn_items(request, asn_code):
 
@@ -1685,7 +1841,7 @@ from django.db.models.functions import Coalesce
 @login_required(login_url='login')
 def supplier_history(request, pk):
     user = request.user
-    perms = get_permission_flags(user)
+    perms = get_permission_flags(user, request)
 
     # NCC chỉ xem được lịch sử của chính họ
     if perms["is_supplier"] and pk != user.username:
@@ -1822,14 +1978,15 @@ def forgot_password(request):
         """
 
         try:
-            send_mail(
-                subject="Mã OTP khôi phục mật khẩu - TH True Mart",
-                message="",
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[email],
-                html_message=html_message,
-                fail_silently=False,
-            )
+            with external_call("smtp"):
+                send_mail(
+                    subject="Mã OTP khôi phục mật khẩu - TH True Mart",
+                    message="",
+                    from_email=settings.DEFAULT_FROM_EMAIL,
+                    recipient_list=[email],
+                    html_message=html_message,
+                    fail_silently=False,
+                )
         except SMTPException as e:
             print("EMAIL ERROR:", e)
             messages.error(request, "Không gửi được email. Vui lòng thử lại sau.")
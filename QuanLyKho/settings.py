@@ -42,6 +42,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # RequestTimingMiddleware giữ execute_wrapper duy nhất của request; 2 middleware
+    # phía trước đọc thời gian SQL đã gom sau khi request xong
+    'QuanLy.metrics.MetricsMiddleware',
+    'QuanLy.slow_queries.SlowQueryMiddleware',
+    'QuanLy.performance.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,7 +60,8 @@ ROOT_URLCONF = 'QuanLyKho.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates + đo thời gian render (QuanLy/performance.py)
+        'BACKEND': 'QuanLy.performance.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -128,6 +134,58 @@ STATIC_URL = '/static/'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# ============ CACHE ============
+# Số liệu trang chủ (QuanLy/dashboard.py). Chạy nhiều worker thì đổi sang
+# cache dùng chung (Redis / Memcached) để mọi worker cùng thấy phiên bản mới.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "quanlykho",
+    },
+    # Phiên bản nhóm quyền của user (QuanLy/roles.py): mọi worker phải thấy
+    # cùng 1 bản -> bảng cache trong CSDL (tạo lúc migrate) hoặc Redis / Memcached
+    "roles": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "quanly_role_versions",
+    },
+}
+DASHBOARD_CACHE_TIMEOUT = 300  # giây
+# Lưu nhóm quyền của user vào session (ngoài cache theo request)
+ROLE_CACHE_IN_SESSION = False
+ROLE_VERSION_CACHE = "roles"
+
+# ============ ĐO HIỆU NĂNG REQUEST ============
+# QuanLy/performance.py: header Server-Timing + log JSON "QuanLy.performance"
+PERF_SAMPLE_RATE = 1.0          # tỉ lệ request được đo chi tiết (0..1)
+PERF_SLOW_REQUEST_MS = 1000     # chậm hơn mức này -> log WARNING
+# QuanLy/slow_queries.py: câu SQL chậm + EXPLAIN, xem ở /slow-queries/ (superuser)
+SLOW_QUERY_MS = 200
+SLOW_QUERY_LOG_SIZE = 500       # số câu gần nhất giữ trong bộ nhớ (mỗi tiến trình)
+SLOW_QUERY_EXPLAIN_INTERVAL = 300   # mỗi câu (theo dấu vân tay) EXPLAIN lại tối đa 1 lần / 300 giây
+# QuanLy/metrics.py: số liệu Prometheus ở /metrics, mỗi worker 1 file mmap trong
+# METRICS_DIR (xoá thư mục này mỗi lần khởi động lại server)
+METRICS_DIR = BASE_DIR / "metrics"
+# Ngoài superuser, /metrics chỉ mở cho Prometheus gửi "Authorization: Bearer
+# <METRICS_TOKEN>" hoặc đến từ IP trong METRICS_ALLOWED_IPS. Mặc định đóng cả
+# hai; sau reverse proxy mọi request cùng 1 REMOTE_ADDR -> dùng token.
+METRICS_TOKEN = ""
+METRICS_ALLOWED_IPS = []
+
+# manage.py test: METRICS_DIR trỏ sang thư mục tạm (QuanLy/testing.py)
+TEST_RUNNER = "QuanLy.testing.QuanLyTestRunner"
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        # "DEBUG" để ghi mọi request được đo, "WARNING" chỉ request chậm
+        "QuanLy.performance": {"handlers": ["console"], "level": "WARNING", "propagate": False},
+    },
+}
 # ============ EMAIL RESET MẬT KHẨU ============
 EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
 EMAIL_HOST = "smtp.gmail.com"